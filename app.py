@@ -9,11 +9,19 @@ from routes.face_verification import face_verification_bp
 from routes.kyc_verified_accounts import verified_accounts_bp
 from routes.admin import admin_bp
 from middleware.error_handler import register_error_handlers
+from utils.warmup import model_readiness
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 
-def create_app(config_name='development'):
+def create_app(config_name='development', warmup=True):
+    """
+    Tạo ứng dụng Flask
+
+    Args:
+        config_name: Tên cấu hình
+        warmup: Nạp sẵn các model khi khởi động (tắt khi chạy script hoặc ở tiến trình cha của reloader)
+    """
 
     app = Flask(__name__)
 
@@ -108,6 +116,17 @@ def create_app(config_name='development'):
     def index():
         return {"message": "KYC API Server"}
 
+    # Nạp sẵn các model (OCR, dlib, DeepFace) để yêu cầu đầu tiên không phải chờ
+    if warmup:
+        warmup_models = [name.strip() for name in app.config['WARMUP_MODELS'].split(',') if name.strip()]
+        model_readiness.start(warmup_models, background=app.config['WARMUP_BACKGROUND'])
+
+    @app.route('/ready')
+    def ready():
+        """Kiểm tra sẵn sàng cho load balancer: 200 khi mọi model đã được nạp, 503 nếu chưa"""
+        ready = model_readiness.is_ready()
+        return {"ready": ready, "models": model_readiness.snapshot()}, 200 if ready else 503
+
     # Thêm route để phục vụ các file tĩnh từ thư mục uploads
     from flask import send_from_directory
 
@@ -118,7 +137,9 @@ def create_app(config_name='development'):
     return app
 
 if __name__ == '__main__':
-    app = create_app()
+    # Reloader của Werkzeug chạy ứng dụng trong tiến trình con (WERKZEUG_RUN_MAIN=true),
+    # tiến trình cha chỉ theo dõi file nên không cần nạp model
+    app = create_app(warmup=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     app.run(debug=True, host="0.0.0.0", port=5000)
 
 
@@ -0,0 +1,427 @@
+"""
+Script đo hiệu năng phân tích liveness (utils.liveness.detect_blinks)
+
+Sinh các video tổng hợp (khuôn mặt với các lần nhắm mắt theo kịch bản) ở nhiều độ phân giải,
+fps, thời lượng và hướng xoay, hoặc dùng thư mục video quay thật, sau đó đo frames/giây,
+độ trễ p50/p95, bộ nhớ đỉnh (RSS) và độ khớp số lần nháy mắt.
+
+Ví dụ:
+    python benchmark_liveness.py --face-image face.jpg --resolutions 640x480,1280x720 --fps 15,30
+    python benchmark_liveness.py --clips recorded_clips --repeat 3 --json results.json
+    python benchmark_liveness.py --clips recorded_clips --detectors dlib_hog,haar,dnn
+    python benchmark_liveness.py --check-early-exit --fps 30 --durations 5,10,15
+
+Số lần nháy mắt mong đợi của video quay thật được lấy từ file expected.json trong thư mục
+({"ten_file.mp4": 3}) hoặc từ tên file dạng "..._blinks3.mp4".
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Cấu hình logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+# Hướng xoay của video tổng hợp (frame được xoay khi ghi, pipeline phải tự phát hiện hướng)
+SYNTHETIC_ROTATIONS = {
+    'none': None,
+    'cw': cv2.ROTATE_90_CLOCKWISE,
+    'ccw': cv2.ROTATE_90_COUNTERCLOCKWISE,
+    '180': cv2.ROTATE_180
+}
+
+# Thời gian một lần nháy mắt (giây) và khoảng cách giữa các lần nháy mắt
+BLINK_SECONDS = 0.2
+BLINK_INTERVAL_SECONDS = 1.5
+
+# EAR khi mắt mở và độ nhiễu EAR của dòng thời gian mô phỏng (--check-early-exit)
+OPEN_EAR = 0.30
+EAR_NOISE = 0.01
+
+def peak_rss_mb():
+    """
+    Bộ nhớ đỉnh (RSS) của tiến trình hiện tại (MB), None nếu không hỗ trợ
+
+    ru_maxrss chỉ tăng trong suốt vòng đời tiến trình nên mỗi video được đo trong một
+    tiến trình con riêng (xem run_clip).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) > 0 else 0.0
+
+def blink_schedule(fps, duration):
+    """
+    Kịch bản nhắm mắt: độ nhắm (0: mở, 1: nhắm hẳn) cho từng frame
+
+    Returns:
+        Tuple (closures, blink_count)
+    """
+    total_frames = int(round(fps * duration))
+    closures = np.zeros(total_frames, dtype=np.float32)
+    blink_frames = max(4, int(round(BLINK_SECONDS * fps)))
+    blink_count = 0
+    start = BLINK_INTERVAL_SECONDS
+    while start + BLINK_SECONDS < duration - 0.5:
+        first = int(round(start * fps))
+        # Nhắm dần rồi mở dần (hình tam giác), giữ nhắm hẳn ở giữa
+        profile = 1.0 - np.abs(np.linspace(-1.0, 1.0, blink_frames))
+        closures[first:first + blink_frames] = np.clip(profile * 1.5, 0.0, 1.0)
+        blink_count += 1
+        start += BLINK_INTERVAL_SECONDS
+    return closures, blink_count
+
+class FaceRenderer:
+    """
+    Vẽ khuôn mặt với độ nhắm mắt cho trước
+
+    Nếu có ảnh khuôn mặt, landmarks của mắt được tính bằng dlib và mi mắt được vẽ đè lên ảnh;
+    nếu không, khuôn mặt được vẽ đơn giản (bộ phát hiện HOG có thể không nhận ra).
+    """
+
+    def __init__(self, face_image=None):
+        self.image = None
+        self.eyes = []
+        if face_image:
+            self._load_face(face_image)
+
+    def _load_face(self, face_image):
+        from imutils import face_utils
+        from utils.liveness import face_detector, landmark_predictor, L_EYE_START, L_EYE_END, R_EYE_START, R_EYE_END
+
+        image = cv2.imread(face_image)
+        if image is None:
+            raise ValueError(f"Không thể đọc ảnh khuôn mặt: {face_image}")
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = face_detector(gray, 1)
+        if len(faces) == 0:
+            raise ValueError(f"Không phát hiện khuôn mặt trong ảnh: {face_image}")
+        shape = face_utils.shape_to_np(landmark_predictor(gray, faces[0]))
+        self.image = image
+        self.eyes = [shape[L_EYE_START:L_EYE_END], shape[R_EYE_START:R_EYE_END]]
+
+    def render(self, width, height, closure):
+        if self.image is None:
+            return self._render_drawn(width, height, closure)
+
+        frame = self.image.copy()
+        for eye in self.eyes:
+            if closure <= 0:
+                continue
+            # Màu da lấy từ vùng ngay dưới mắt
+            x, y, w, h = cv2.boundingRect(eye)
+            cheek = frame[min(frame.shape[0] - 1, y + h + h // 2):min(frame.shape[0], y + 2 * h + h // 2), x:x + w]
+            skin = cheek.reshape(-1, 3).mean(axis=0) if cheek.size > 0 else (150, 170, 200)
+
+            # Kéo mi trên (điểm 1, 2) xuống mi dưới (điểm 5, 4) theo độ nhắm
+            lid = eye.astype(np.float32).copy()
+            lid[1] += (eye[5] - eye[1]) * closure
+            lid[2] += (eye[4] - eye[2]) * closure
+            upper = np.array([eye[0], eye[1], eye[2], eye[3], lid[2], lid[1]], dtype=np.int32)
+            cv2.fillPoly(frame, [upper], tuple(int(c) for c in skin))
+            cv2.polylines(frame, [np.array([eye[0], lid[1], lid[2], eye[3]], dtype=np.int32)], False, (40, 40, 60), 2)
+
+        return cv2.resize(frame, (width, height))
+
+    def _render_drawn(self, width, height, closure):
+        frame = np.full((height, width, 3), (90, 110, 120), dtype=np.uint8)
+        cx, cy = width // 2, height // 2
+        face_w, face_h = int(min(width, height) * 0.3), int(min(width, height) * 0.4)
+        cv2.ellipse(frame, (cx, cy), (face_w, face_h), 0, 0, 360, (150, 175, 215), -1)
+
+        eye_w = face_w // 4
+        eye_h = max(1, int(eye_w * 0.45 * (1.0 - closure)))
+        for ex in (cx - face_w // 2, cx + face_w // 2):
+            ey = cy - face_h // 5
+            cv2.ellipse(frame, (ex, ey), (eye_w, eye_h), 0, 0, 360, (245, 245, 245), -1)
+            if eye_h > 2:
+                cv2.circle(frame, (ex, ey), min(eye_h, eye_w // 2), (40, 30, 20), -1)
+            cv2.ellipse(frame, (ex, ey), (eye_w, eye_h), 0, 0, 360, (40, 40, 60), 2)
+            cv2.line(frame, (ex - eye_w, ey - eye_w), (ex + eye_w, ey - eye_w - 4), (40, 40, 60), 3)
+
+        cv2.line(frame, (cx, cy - face_h // 10), (cx - face_w // 10, cy + face_h // 5), (90, 110, 150), 2)
+        cv2.ellipse(frame, (cx, cy + face_h // 2), (face_w // 3, face_h // 10), 0, 0, 180, (60, 60, 150), 3)
+        return frame
+
+def generate_clip(renderer, path, width, height, fps, duration, rotation):
+    """
+    Ghi một video tổng hợp
+
+    Returns:
+        Số lần nháy mắt theo kịch bản
+    """
+    closures, blink_count = blink_schedule(fps, duration)
+    rotate_code = SYNTHETIC_ROTATIONS[rotation]
+    size = (height, width) if rotate_code in (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE) else (width, height)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Không thể ghi video: {path}")
+    try:
+        for closure in closures:
+            frame = renderer.render(width, height, float(closure))
+            if rotate_code is not None:
+                frame = cv2.rotate(frame, rotate_code)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return blink_count
+
+def synthetic_clips(args, output_dir):
+    """Sinh các video tổng hợp theo tổ hợp tham số, trả về danh sách (name, path, expected_blinks)"""
+    renderer = FaceRenderer(args.face_image)
+    if args.face_image is None:
+        logger.warning("Không có --face-image, dùng khuôn mặt vẽ đơn giản (bộ phát hiện HOG có thể không nhận ra)")
+
+    clips = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(v) for v in resolution.lower().split('x'))
+        for fps in (float(v) for v in args.fps.split(',')):
+            for duration in (float(v) for v in args.durations.split(',')):
+                for rotation in args.rotations.split(','):
+                    name = f"synthetic_{width}x{height}_{fps:g}fps_{duration:g}s_{rotation}"
+                    path = os.path.join(output_dir, name + '.mp4')
+                    expected = generate_clip(renderer, path, width, height, fps, duration, rotation)
+                    logger.info(f"Đã tạo {path} ({expected} lần nháy mắt)")
+                    clips.append((name, path, expected))
+    return clips
+
+def recorded_clips(directory):
+    """Danh sách video quay thật trong thư mục, trả về danh sách (name, path, expected_blinks)"""
+    expected = {}
+    labels_path = os.path.join(directory, 'expected.json')
+    if os.path.exists(labels_path):
+        with open(labels_path, encoding='utf-8') as f:
+            expected = json.load(f)
+
+    clips = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.lower().endswith(VIDEO_EXTENSIONS):
+            continue
+        blinks = expected.get(file_name)
+        if blinks is None:
+            match = re.search(r'blinks(\d+)', file_name)
+            blinks = int(match.group(1)) if match else None
+        clips.append((file_name, os.path.join(directory, file_name), blinks))
+    return clips
+
+def benchmark_clip(name, path, expected, args, detector):
+    """Chạy detect_blinks nhiều lần trên một video và tổng hợp kết quả"""
+    from utils.liveness import detect_blinks
+
+    cap = cv2.VideoCapture(path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    latencies = []
+    results = None
+    for _ in range(args.repeat):
+        start_time = time.perf_counter()
+        results = detect_blinks(path, face_tracking=args.face_tracking, detection_width=args.detection_width,
+                                sample_fps=args.sample_fps, early_exit=args.early_exit,
+                                pipeline_workers=args.pipeline_workers, process_workers=args.process_workers,
+                                return_timings=True, save_timeline_file=False)
+        latencies.append(time.perf_counter() - start_time)
+
+    p50 = percentile(latencies, 50)
+    return {
+        'clip': name,
+        'detector': detector,
+        'frames': total_frames,
+        'runs': len(latencies),
+        'fps': total_frames / p50 if p50 > 0 else 0.0,
+        'latency_p50_ms': p50 * 1000,
+        'latency_p95_ms': percentile(latencies, 95) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+        'expected_blinks': expected,
+        'blink_count': results['blink_count'],
+        'blink_match': expected is not None and results['blink_count'] == expected,
+        'liveness_score': results['liveness_score'],
+        'analyzed_frames': results['analyzed_frames'],
+        'face_detected_frames': results['face_detected_frames'],
+        'face_rate': results['face_detected_frames'] / results['analyzed_frames'] if results['analyzed_frames'] > 0 else 0.0,
+        'rotation': results['rotation'],
+        'stages_ms': {stage: value['ms'] for stage, value in results['timings']['stages'].items()}
+    }
+
+def synthetic_eye_shape(ear):
+    """Landmarks 68 điểm (chỉ có 2 mắt) với EAR cho trước"""
+    from utils.liveness import L_EYE_START, L_EYE_END, R_EYE_START, R_EYE_END
+
+    # Mắt rộng 30 px: EAR = (2h + 2h) / (2 * 30) = h / 15
+    h = max(0.0, ear) * 15.0
+    eye = np.array([[0, 0], [10, -h], [20, -h], [30, 0], [20, h], [10, h]], dtype=np.float32)
+    shape = np.zeros((68, 2), dtype=np.float32)
+    shape[L_EYE_START:L_EYE_END] = eye + (100, 100)
+    shape[R_EYE_START:R_EYE_END] = eye + (160, 100)
+    return shape
+
+def simulate_early_exit(fps, duration, expected_frames=None, seed=0):
+    """
+    Mô phỏng dòng thời gian EAR theo kịch bản nhắm mắt (không giải mã/phát hiện khuôn mặt)
+    và tìm frame đầu tiên IncrementalLivenessAnalyzer trả kết quả sớm
+
+    Args:
+        expected_frames: Số frame dự kiến (như phiên theo luồng có khai báo, hoặc như
+            detect_blinks khi bằng tổng số frame), None: chỉ xét các frame đã nhận
+
+    Returns:
+        Tuple (decided_frame, blink_count, total_frames), decided_frame là None nếu không dừng sớm
+    """
+    from utils.liveness import IncrementalLivenessAnalyzer
+
+    closures, blink_count = blink_schedule(fps, duration)
+    rng = np.random.default_rng(seed)
+    analyzer = IncrementalLivenessAnalyzer(fps, face_tracking=False, expected_frames=expected_frames)
+    for frame_index, closure in enumerate(closures):
+        ear = OPEN_EAR * (1.0 - 0.85 * float(closure)) + rng.normal(0.0, EAR_NOISE)
+        analyzer.add_face_shapes([(None, synthetic_eye_shape(ear))])
+        if analyzer.is_decided():
+            return frame_index + 1, blink_count, len(closures)
+    return None, blink_count, len(closures)
+
+def check_early_exit(args):
+    """
+    In frame dừng sớm trên dòng thời gian EAR mô phỏng: phiên theo luồng (chỉ xét các frame đã nhận)
+    và video đã biết tổng số frame (như detect_blinks với LIVENESS_EARLY_EXIT). Trả về 1 nếu phiên
+    theo luồng 6 giây với 3 lần nháy mắt không có kết quả trước khi kết thúc.
+    """
+    header = f"{'fps':>5} {'giây':>6} {'blinks':>7} {'frames':>7} {'luồng':>8} {'biết độ dài':>12}"
+    print(header)
+    print('-' * len(header))
+    for fps in (float(v) for v in args.fps.split(',')):
+        for duration in (float(v) for v in args.durations.split(',')):
+            stream_frame, blink_count, total_frames = simulate_early_exit(fps, duration)
+            known_frame, _, _ = simulate_early_exit(fps, duration, expected_frames=total_frames)
+            print(f"{fps:>5g} {duration:>6g} {blink_count:>7} {total_frames:>7} {str(stream_frame or '-'):>8} "
+                  f"{str(known_frame or '-'):>12}")
+
+    decided_frame, blink_count, total_frames = simulate_early_exit(30.0, 6.0)
+    if decided_frame is None or decided_frame >= total_frames:
+        logger.error(f"Phiên theo luồng 6 giây ({blink_count} lần nháy mắt) không có kết quả trước khi kết thúc")
+        return 1
+    logger.info(f"Phiên theo luồng 6 giây ({blink_count} lần nháy mắt) có kết quả ở frame {decided_frame}/{total_frames}")
+    return 0
+
+def _benchmark_clip_in_child(name, path, expected, args, detector):
+    # Chạy trong tiến trình con: nạp bộ phát hiện khuôn mặt rồi đo một video
+    from utils.liveness import set_face_detector
+    set_face_detector(detector)
+    return benchmark_clip(name, path, expected, args, detector)
+
+def run_clip(name, path, expected, args, detector):
+    """
+    Đo một video trong tiến trình con mới ('spawn') để bộ nhớ đỉnh chỉ tính cho video đó
+    (kể cả phần nạp mô hình, giống nhau giữa các video)
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_benchmark_clip_in_child, name, path, expected, args, detector).result()
+
+def print_report(rows):
+    header = f"{'clip':<44} {'detector':>8} {'frames':>6} {'fps':>8} {'p50 ms':>9} {'p95 ms':>9} {'rss MB':>8} {'blinks':>9} {'face':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        expected = '?' if row['expected_blinks'] is None else row['expected_blinks']
+        rss = f"{row['peak_rss_mb']:.0f}" if row['peak_rss_mb'] is not None else 'n/a'
+        print(f"{row['clip'][:44]:<44} {row['detector']:>8} {row['frames']:>6} {row['fps']:>8.1f} {row['latency_p50_ms']:>9.1f} "
+              f"{row['latency_p95_ms']:>9.1f} {rss:>8} {str(row['blink_count']) + '/' + str(expected):>9} "
+              f"{str(row['face_detected_frames']) + '/' + str(row['analyzed_frames']):>9}")
+
+    # Tổng hợp theo bộ phát hiện khuôn mặt
+    print('-' * len(header))
+    for detector in dict.fromkeys(row['detector'] for row in rows):
+        detector_rows = [row for row in rows if row['detector'] == detector]
+        labelled = [row for row in detector_rows if row['expected_blinks'] is not None]
+        total_frames = sum(row['frames'] for row in detector_rows)
+        total_seconds = sum(row['latency_p50_ms'] for row in detector_rows) / 1000
+        face_rate = np.mean([row['face_rate'] for row in detector_rows])
+        print(f"[{detector}] Tổng: {total_frames} frames, {total_frames / total_seconds if total_seconds > 0 else 0:.1f} frames/giây (p50), "
+              f"tỉ lệ frame có khuôn mặt trung bình {face_rate * 100:.1f}%")
+        if labelled:
+            matches = sum(1 for row in labelled if row['blink_match'])
+            mean_error = np.mean([abs(row['blink_count'] - row['expected_blinks']) for row in labelled])
+            print(f"[{detector}] Khớp số lần nháy mắt: {matches}/{len(labelled)} video, sai số trung bình {mean_error:.2f}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Đo hiệu năng phân tích liveness")
+    parser.add_argument('--clips', help="Thư mục video quay thật (bỏ qua video tổng hợp)")
+    parser.add_argument('--face-image', help="Ảnh khuôn mặt dùng để sinh video tổng hợp")
+    parser.add_argument('--output-dir', help="Thư mục lưu video tổng hợp (mặc định: thư mục tạm)")
+    parser.add_argument('--resolutions', default='320x240,640x480,1280x720')
+    parser.add_argument('--fps', default='15,30')
+    parser.add_argument('--durations', default='5')
+    parser.add_argument('--rotations', default='none,cw', help="Các giá trị: " + ','.join(SYNTHETIC_ROTATIONS))
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy mỗi video")
+    parser.add_argument('--json', help="Ghi kết quả chi tiết ra file JSON")
+    parser.add_argument('--check-early-exit', action='store_true',
+                        help="Chỉ kiểm tra dừng sớm trên dòng thời gian EAR mô phỏng (dùng --fps, --durations)")
+
+    # Các bộ phát hiện khuôn mặt cần so sánh (mặc định: Config.LIVENESS_FACE_DETECTOR)
+    parser.add_argument('--detectors', help="Danh sách bộ phát hiện, ví dụ dlib_hog,haar,dnn")
+
+    # Tham số của detect_blinks (mặc định lấy từ Config)
+    parser.add_argument('--face-tracking', type=lambda v: v.lower() == 'true', default=None)
+    parser.add_argument('--detection-width', type=int, default=None)
+    parser.add_argument('--sample-fps', type=float, default=None)
+    parser.add_argument('--early-exit', type=lambda v: v.lower() == 'true', default=None)
+    parser.add_argument('--pipeline-workers', type=int, default=None)
+    parser.add_argument('--process-workers', type=int, default=None)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.check_early_exit:
+        return check_early_exit(args)
+
+    if args.clips:
+        clips = recorded_clips(args.clips)
+    else:
+        output_dir = args.output_dir or tempfile.mkdtemp(prefix='liveness_benchmark_')
+        os.makedirs(output_dir, exist_ok=True)
+        clips = synthetic_clips(args, output_dir)
+
+    if not clips:
+        logger.error("Không có video nào để đo")
+        return 1
+
+    from config import Config
+    detectors = args.detectors.split(',') if args.detectors else [Config.LIVENESS_FACE_DETECTOR]
+
+    rows = []
+    for detector in detectors:
+        for name, path, expected in clips:
+            logger.info(f"Đang đo {name} ({detector})...")
+            rows.append(run_clip(name, path, expected, args, detector))
+
+    print_report(rows)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        logger.info(f"Đã ghi kết quả vào {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,6 +27,53 @@ class Config:
     MIN_LIVENESS_SCORE = float(os.environ.get('MIN_LIVENESS_SCORE', 0.3))  # Giảm ngưỡng điểm số xuống cực thấp để dễ vượt qua
     MAX_VIDEO_FILE_SIZE = int(os.environ.get('MAX_VIDEO_FILE_SIZE', 16 * 1024 * 1024)) # 16MB max video file size
 
+    # Liveness analysis configuration
+    LIVENESS_FACE_TRACKING = os.environ.get('LIVENESS_FACE_TRACKING', 'true').lower() == 'true'  # Chỉ chạy bộ phát hiện khuôn mặt trên keyframe
+    LIVENESS_REDETECT_INTERVAL = int(os.environ.get('LIVENESS_REDETECT_INTERVAL', 15))  # Số frame tối đa giữa 2 lần phát hiện lại
+    LIVENESS_DETECTION_WIDTH = int(os.environ.get('LIVENESS_DETECTION_WIDTH', 480))  # Chiều rộng ảnh dùng để phát hiện khuôn mặt (0: độ phân giải gốc)
+    LIVENESS_FACE_DETECTOR = os.environ.get('LIVENESS_FACE_DETECTOR', 'dlib_hog')  # Bộ phát hiện khuôn mặt: dlib_hog, haar hoặc dnn
+    LIVENESS_DNN_PROTOTXT = os.environ.get('LIVENESS_DNN_PROTOTXT', os.path.join(os.path.dirname(__file__), 'utils', 'models', 'deploy.prototxt'))  # Cấu trúc mạng của bộ phát hiện dnn
+    LIVENESS_DNN_MODEL = os.environ.get('LIVENESS_DNN_MODEL', os.path.join(os.path.dirname(__file__), 'utils', 'models', 'res10_300x300_ssd_iter_140000.caffemodel'))  # Trọng số của bộ phát hiện dnn
+    LIVENESS_DNN_CONFIDENCE = float(os.environ.get('LIVENESS_DNN_CONFIDENCE', 0.5))  # Ngưỡng tin cậy của bộ phát hiện dnn
+    LIVENESS_SAMPLE_FPS = float(os.environ.get('LIVENESS_SAMPLE_FPS', 15))  # Tốc độ phân tích mục tiêu, phân tích đầy đủ quanh các lần EAR giảm (0: toàn bộ frame, không áp dụng cho pipeline nhiều luồng)
+    # Dừng phân tích khi đã đủ nháy mắt và các frame còn lại không thể làm thay đổi kết quả. Cận trên dùng
+    # cho các frame còn lại khá chặt nên thường chỉ tiết kiệm khoảng 10-50% số frame (mô phỏng 30 fps,
+    # xem benchmark_liveness.py --check-early-exit), nhiều hơn với video dài có nhiều lần nháy mắt
+    LIVENESS_EARLY_EXIT = os.environ.get('LIVENESS_EARLY_EXIT', 'false').lower() == 'true'
+    LIVENESS_PIPELINE_WORKERS = int(os.environ.get('LIVENESS_PIPELINE_WORKERS', 0))  # Số luồng xử lý song song cho mỗi video (0: tuần tự)
+    LIVENESS_PROCESS_WORKERS = int(os.environ.get('LIVENESS_PROCESS_WORKERS', 0))  # Số tiến trình phân tích song song các đoạn frame của video (0: không dùng)
+    LIVENESS_PIPELINE_QUEUE_SIZE = int(os.environ.get('LIVENESS_PIPELINE_QUEUE_SIZE', 8))  # Kích thước hàng đợi giữa các giai đoạn
+    LIVENESS_RETURN_TIMINGS = os.environ.get('LIVENESS_RETURN_TIMINGS', 'false').lower() == 'true'  # Trả về thời gian theo giai đoạn trong kết quả liveness
+    LIVENESS_SAVE_TIMELINE = os.environ.get('LIVENESS_SAVE_TIMELINE', 'true').lower() == 'true'  # Lưu dòng thời gian EAR (.timeline.npz) cạnh video để tính lại điểm
+    LIVENESS_JOB_WORKERS = int(os.environ.get('LIVENESS_JOB_WORKERS', 2))  # Số luồng nền chạy các job liveness bất đồng bộ
+    LIVENESS_JOB_TTL = int(os.environ.get('LIVENESS_JOB_TTL', 3600))  # Thời gian giữ trạng thái job đã kết thúc (giây)
+    LIVENESS_JOB_STALE_SECONDS = int(os.environ.get('LIVENESS_JOB_STALE_SECONDS', 900))  # Job không được cập nhật quá thời gian này bị coi là gián đoạn (giây)
+    LIVENESS_STREAM_TTL = int(os.environ.get('LIVENESS_STREAM_TTL', 600))  # Thời gian giữ phiên liveness theo luồng không hoạt động (giây)
+    LIVENESS_STREAM_MAX_FRAMES = int(os.environ.get('LIVENESS_STREAM_MAX_FRAMES', 1800))  # Số frame JPEG tối đa của một phiên theo luồng
+    LIVENESS_RETENTION_DAYS = float(os.environ.get('LIVENESS_RETENTION_DAYS', 7))  # Số ngày giữ workspace liveness (video, dòng thời gian, debug)
+    LIVENESS_DEBUG_RETENTION_HOURS = float(os.environ.get('LIVENESS_DEBUG_RETENTION_HOURS', 24))  # Số giờ giữ ảnh/log debug trong workspace (0: giữ đến khi xóa workspace)
+    LIVENESS_CLEANUP_INTERVAL = int(os.environ.get('LIVENESS_CLEANUP_INTERVAL', 600))  # Khoảng thời gian tối thiểu giữa 2 lần dọn dẹp workspace (giây)
+    LIVENESS_QUICK_REJECT = os.environ.get('LIVENESS_QUICK_REJECT', 'true').lower() == 'true'  # Kiểm tra nhanh vài frame mẫu và loại ngay video không dùng được
+    LIVENESS_QUICK_REJECT_SAMPLES = int(os.environ.get('LIVENESS_QUICK_REJECT_SAMPLES', 6))  # Số frame mẫu của bước kiểm tra nhanh
+    LIVENESS_QUICK_REJECT_MIN_BRIGHTNESS = float(os.environ.get('LIVENESS_QUICK_REJECT_MIN_BRIGHTNESS', 25))  # Độ sáng trung bình tối thiểu (0-255)
+    LIVENESS_QUICK_REJECT_MAX_BRIGHTNESS = float(os.environ.get('LIVENESS_QUICK_REJECT_MAX_BRIGHTNESS', 235))  # Độ sáng trung bình tối đa (0-255)
+    LIVENESS_QUICK_REJECT_MIN_SHARPNESS = float(os.environ.get('LIVENESS_QUICK_REJECT_MIN_SHARPNESS', 10))  # Phương sai Laplacian tối thiểu của vùng khuôn mặt
+
+    # OCR configuration
+    OCR_READER_POOL_SIZE = int(os.environ.get('OCR_READER_POOL_SIZE', 1))  # Số EasyOCR reader (cũng là số lượt nhận dạng đồng thời tối đa)
+    OCR_READER_TIMEOUT = float(os.environ.get('OCR_READER_TIMEOUT', 60)) or None  # Thời gian chờ reader rảnh tối đa (giây, 0: chờ mãi)
+    OCR_TORCH_THREADS = int(os.environ.get('OCR_TORCH_THREADS', 0))  # Số luồng torch cho mỗi lượt nhận dạng (0: mặc định của torch)
+    OCR_VARIANT_MODE = os.environ.get('OCR_VARIANT_MODE', 'sequential')  # Cách chạy các biến thể tiền xử lý CCCD: sequential, first (song song, lấy kết quả đủ trường đầu tiên) hoặc merge (song song, gộp trường)
+    OCR_VARIANT_WORKERS = int(os.environ.get('OCR_VARIANT_WORKERS', 4))  # Số luồng chạy song song các biến thể OCR
+    OCR_SHARED_DETECTION = os.environ.get('OCR_SHARED_DETECTION', 'true').lower() == 'true'  # Phát hiện vùng chữ một lần trên ảnh gốc, các biến thể chỉ chạy bộ nhận dạng
+    OCR_CARD_LOCALIZATION = os.environ.get('OCR_CARD_LOCALIZATION', 'true').lower() == 'true'  # Tìm và nắn thẻ CCCD trước khi OCR
+    OCR_CARD_WIDTH = int(os.environ.get('OCR_CARD_WIDTH', 1000))  # Chiều rộng chuẩn của thẻ sau khi nắn (pixel)
+    OCR_CARD_MIN_AREA_RATIO = float(os.environ.get('OCR_CARD_MIN_AREA_RATIO', 0.2))  # Diện tích tối thiểu của thẻ so với ảnh
+
+    # Model warm-up configuration
+    WARMUP_MODELS = os.environ.get('WARMUP_MODELS', 'ocr,dlib,deepface')  # Các model nạp sẵn khi khởi động (rỗng: không nạp sẵn)
+    WARMUP_BACKGROUND = os.environ.get('WARMUP_BACKGROUND', 'true').lower() == 'true'  # Nạp sẵn trong luồng nền, /ready trả về 503 cho đến khi xong
+
     # Face verification configuration
     FACE_MATCH_TOLERANCE = float(os.environ.get('FACE_MATCH_TOLERANCE', 0.45))  
 
@@ -23,7 +23,7 @@ def create_database():
         logger.info("Bắt đầu tạo mới database...")
         
         # Tạo ứng dụng Flask
-        app = create_app()
+        app = create_app(warmup=False)
         
         with app.app_context():
             # Xóa database cũ nếu tồn tại
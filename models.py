@@ -62,3 +62,16 @@ class IdentityInfo(db.Model):
     expiry_date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     verified_at = db.Column(db.DateTime, nullable=True)
+
+class LivenessJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Bằng user_id khi job đang chờ/đang chạy, NULL khi đã kết thúc. Ràng buộc unique đảm bảo
+    # mỗi người dùng chỉ có một job đang chạy, kể cả khi ứng dụng chạy nhiều tiến trình
+    active_user_id = db.Column(db.Integer, unique=True, nullable=True)
+    status = db.Column(db.String(20), default='queued')  # Các giá trị: 'queued', 'processing', 'completed', 'failed'
+    progress = db.Column(db.Float, default=0.0)
+    result = db.Column(db.Text, nullable=True)  # Kết quả trả về cho client (JSON)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,120 @@
+"""
+Script tính lại điểm liveness từ các dòng thời gian EAR đã lưu (.timeline.npz)
+
+Các dòng thời gian được phát lại qua máy trạng thái nháy mắt và bước tính điểm với
+tham số mới, không cần giải mã lại video. Dùng để tinh chỉnh ngưỡng trên dữ liệu cũ.
+
+Ví dụ:
+    python rescore_liveness.py
+    python rescore_liveness.py --set eye_ar_thresh=0.15 --set eye_ar_consec_frames=3
+    python rescore_liveness.py --grid eye_ar_thresh=0.11,0.13,0.15 --grid min_blinks=2,3 --json grid.json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import itertools
+import logging
+
+from config import Config
+from utils.liveness import DEFAULT_SCORING_PARAMS, load_timeline, rescore_timeline, scoring_params
+
+# Cấu hình logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def is_verified(result, min_liveness_score, min_blink_count):
+    """Điều kiện xác thực liveness giống routes/kyc.py"""
+    return result['liveness_score'] > min_liveness_score and result['blink_count'] >= min_blink_count
+
+def parse_assignment(value):
+    key, _, raw = value.partition('=')
+    if not raw:
+        raise argparse.ArgumentTypeError(f"Cần dạng ten=gia_tri: {value}")
+    return key.strip(), raw.strip()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tính lại điểm liveness từ các dòng thời gian EAR đã lưu")
+    parser.add_argument('paths', nargs='*', help="File .timeline.npz hoặc thư mục (mặc định: uploads/liveness)")
+    parser.add_argument('--set', action='append', type=parse_assignment, default=[],
+                        help="Ghi đè tham số, ví dụ eye_ar_thresh=0.15. Các tham số: " + ', '.join(DEFAULT_SCORING_PARAMS))
+    parser.add_argument('--grid', action='append', type=parse_assignment, default=[],
+                        help="Thử nhiều giá trị của một tham số, ví dụ eye_ar_thresh=0.11,0.13,0.15")
+    parser.add_argument('--min-liveness-score', type=float, default=Config.MIN_LIVENESS_SCORE)
+    parser.add_argument('--min-blink-count', type=int, default=Config.MIN_BLINK_COUNT)
+    parser.add_argument('--json', help="Ghi kết quả chi tiết ra file JSON")
+    return parser.parse_args()
+
+def find_timelines(paths):
+    if not paths:
+        paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'liveness')]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # Dòng thời gian nằm trong các workspace con (và trực tiếp trong thư mục với dữ liệu cũ)
+            files.extend(sorted(glob.glob(os.path.join(path, '**', '*.timeline.npz'), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+def parameter_sets(args):
+    """Các bộ tham số cần thử: --set áp dụng cho mọi bộ, --grid tạo tổ hợp"""
+    base = dict(args.set)
+    if not args.grid:
+        return [base]
+    keys = [key for key, _ in args.grid]
+    values = [raw.split(',') for _, raw in args.grid]
+    return [dict(base, **dict(zip(keys, combination))) for combination in itertools.product(*values)]
+
+def main():
+    args = parse_args()
+    files = find_timelines(args.paths)
+    if not files:
+        logger.error("Không tìm thấy file dòng thời gian nào")
+        return 1
+
+    timelines = []
+    for path in files:
+        try:
+            timelines.append((path, load_timeline(path)))
+        except Exception as e:
+            logger.warning(f"Không thể đọc {path}: {e}")
+    logger.info(f"Đã đọc {len(timelines)} dòng thời gian")
+
+    report = []
+    for overrides in parameter_sets(args):
+        params = scoring_params(overrides)
+        start_time = time.perf_counter()
+        rows = []
+        for path, data in timelines:
+            result = rescore_timeline(data, params)
+            original = {'liveness_score': float(data['liveness_score']), 'blink_count': int(data['blink_count'])}
+            rows.append({
+                'file': os.path.basename(path),
+                'original_blink_count': original['blink_count'],
+                'original_verified': is_verified(original, args.min_liveness_score, args.min_blink_count),
+                'blink_count': int(result['blink_count']),
+                'liveness_score': float(result['liveness_score']),
+                'verified': is_verified(result, args.min_liveness_score, args.min_blink_count)
+            })
+        elapsed = time.perf_counter() - start_time
+
+        verified = sum(1 for row in rows if row['verified'])
+        changed = sum(1 for row in rows if row['verified'] != row['original_verified'])
+        blink_changed = sum(1 for row in rows if row['blink_count'] != row['original_blink_count'])
+        print(f"{json.dumps(overrides, ensure_ascii=False) if overrides else 'mặc định'}: "
+              f"đạt {verified}/{len(rows)}, thay đổi kết quả {changed}, thay đổi số lần nháy mắt {blink_changed} "
+              f"({elapsed * 1000 / max(1, len(rows)):.2f} ms/video)")
+        report.append({'params': params, 'verified': verified, 'changed': changed,
+                       'blink_count_changed': blink_changed, 'rows': rows})
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Đã ghi kết quả vào {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
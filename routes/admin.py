@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request, current_app
 from models import db, User, KYCVerification, IdentityInfo
 from utils.auth import token_required
+from utils.timing import liveness_histograms, ocr_histograms
+from utils.easyocr_utils import reader_pool
 from datetime import datetime
 
 admin_bp = Blueprint('admin', __name__)
@@ -614,3 +616,37 @@ def get_statistics(current_user):
     except Exception as e:
         current_app.logger.error(f"Error getting statistics: {str(e)}")
         return jsonify({'error': 'Không thể lấy thống kê'}), 500
+
+@admin_bp.route('/liveness-timings', methods=['GET'])
+@admin_required
+def get_liveness_timings(current_user):
+    """
+    Lấy histogram thời gian theo giai đoạn của pipeline liveness (tổng hợp trong tiến trình)
+    """
+    return jsonify({'stages': liveness_histograms.snapshot()}), 200
+
+@admin_bp.route('/liveness-timings/reset', methods=['POST'])
+@superadmin_required
+def reset_liveness_timings(current_user):
+    """
+    Xóa histogram thời gian của pipeline liveness (chỉ superadmin)
+    """
+    liveness_histograms.reset()
+    return jsonify({'message': 'Đã xóa thống kê thời gian liveness'}), 200
+
+@admin_bp.route('/ocr-timings', methods=['GET'])
+@admin_required
+def get_ocr_timings(current_user):
+    """
+    Lấy trạng thái pool EasyOCR reader và histogram thời gian chờ/giữ reader
+    """
+    return jsonify({'pool': reader_pool.stats(), 'stages': ocr_histograms.snapshot()}), 200
+
+@admin_bp.route('/ocr-timings/reset', methods=['POST'])
+@superadmin_required
+def reset_ocr_timings(current_user):
+    """
+    Xóa histogram thời gian của EasyOCR (chỉ superadmin)
+    """
+    ocr_histograms.reset()
+    return jsonify({'message': 'Đã xóa thống kê thời gian OCR'}), 200
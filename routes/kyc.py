@@ -1,149 +1,439 @@
 from flask import Blueprint, request, jsonify, current_app
 from models import db, KYCVerification, User, IdentityInfo
 from utils.auth import token_required
-from utils.liveness import process_video_for_liveness
+from utils.liveness import process_video_for_liveness, store_liveness_upload, VideoTooLargeError
+from utils.liveness_jobs import liveness_jobs, LivenessJobConflict
+from utils.liveness_stream import liveness_streams
 # Thay thế Tesseract OCR bằng EasyOCR
-from utils.easyocr_utils import process_id_card
+from utils.easyocr_utils import process_id_card, ReaderPoolTimeout
 from middleware.rate_limit import kyc_rate_limit
 from middleware.security import is_valid_file_extension, is_valid_file_size, sanitize_file_name
 from datetime import datetime
 import os
+import shutil
 
 kyc_bp = Blueprint('kyc', __name__)
 
-@kyc_bp.route('/verify/liveness', methods=['POST'])
-@token_required
-@kyc_rate_limit()
-def verify_liveness(current_user):
+def apply_liveness_results(verification, user, results):
+    """
+    Cập nhật bản ghi KYCVerification (và trạng thái KYC của người dùng) từ kết quả phân tích liveness
+
+    Dùng chung cho xác thực đồng bộ và job bất đồng bộ, cần chạy trong app context.
+
+    Returns:
+        Thông báo kết quả xác thực
+    """
+    # Update verification record
+    verification.liveness_score = results['liveness_score']
+    verification.blink_count = results['blink_count']
+    verification.last_attempt_at = datetime.utcnow()
+
+    # Lưu tên file video nếu có
+    if 'video_filename' in results:
+        verification.selfie_path = results['video_filename']
+
+    # Video bị loại ở bước kiểm tra nhanh (không có khuôn mặt, quá tối, quá mờ...)
+    quick_reject = results.get('quick_reject')
+    if quick_reject and quick_reject['rejected']:
+        verification.status = 'failed'
+        verification.rejection_reason = quick_reject['message']
+        return f"Xác thực không thành công: {quick_reject['message']}"
+
+    if results['liveness_score'] > current_app.config['MIN_LIVENESS_SCORE']:
+        if results['blink_count'] >= current_app.config['MIN_BLINK_COUNT']:
+            verification.status = 'verified'
+            verification.verified_at = datetime.utcnow()
+            user.kyc_status = 'verified'
+            user.kyc_verified_at = datetime.utcnow()
+            message = 'Xác thực thành công'
+
+            # Kiểm tra và đảm bảo thông tin được lưu vào bảng identity_info
+            if verification.identity_card_front and verification.identity_card_back:
+                try:
+                    # Kiểm tra xem đã có bản ghi IdentityInfo chưa
+                    identity = IdentityInfo.query.filter_by(user_id=user.id).first()
+                    if not identity:
+                        # Lấy thông tin từ mặt trước và mặt sau
+                        front_path = os.path.join(current_app.config['UPLOAD_FOLDER'], verification.identity_card_front)
+                        back_path = os.path.join(current_app.config['UPLOAD_FOLDER'], verification.identity_card_back)
+                        front_info = process_id_card(front_path, True)
+                        back_info = process_id_card(back_path, False)
+
+                        # Kết hợp thông tin
+                        combined_info = {**front_info, **back_info}
+
+                        # Kiểm tra xem có đủ thông tin cần thiết không
+                        required_fields = ['id_number', 'full_name', 'date_of_birth', 'gender', 'nationality', 'issue_date', 'expiry_date']
+                        missing_fields = [field for field in required_fields if field not in combined_info or combined_info[field] is None]
+
+                        if not missing_fields:
+                            # Tạo bản ghi IdentityInfo mới
+                            identity = IdentityInfo(
+                                user_id=user.id,
+                                id_number=combined_info['id_number'],
+                                full_name=combined_info['full_name'],
+                                date_of_birth=combined_info['date_of_birth'],
+                                gender=combined_info['gender'],
+                                nationality=combined_info['nationality'],
+                                issue_date=combined_info['issue_date'],
+                                expiry_date=combined_info['expiry_date'],
+                                verified_at=verification.verified_at
+                            )
+                            db.session.add(identity)
+                            current_app.logger.info(f"Đã tạo bản ghi IdentityInfo cho user ID {user.id}")
+                        else:
+                            current_app.logger.warning(f"Thiếu thông tin cần thiết để tạo IdentityInfo: {missing_fields}")
+                except Exception as e:
+                    current_app.logger.error(f"Lỗi khi tạo bản ghi IdentityInfo: {str(e)}")
+        else:
+            verification.status = 'failed'
+            verification.rejection_reason = f'Không phát hiện đủ số lần nháy mắt (phát hiện {results["blink_count"]} lần, yêu cầu {current_app.config["MIN_BLINK_COUNT"]} lần)'
+            message = f'Không phát hiện đủ số lần nháy mắt (phát hiện {results["blink_count"]} lần, yêu cầu {current_app.config["MIN_BLINK_COUNT"]} lần)'
+    else:
+        verification.status = 'failed'
+        verification.rejection_reason = f'Điểm số liveness không đạt yêu cầu (điểm số: {results["liveness_score"]:.2f}, yêu cầu: {current_app.config["MIN_LIVENESS_SCORE"]:.2f})'
+        message = f'Xác thực không thành công: Điểm số liveness {results["liveness_score"]:.2f} thấp hơn ngưỡng yêu cầu {current_app.config["MIN_LIVENESS_SCORE"]:.2f}'
+
+    return message
+
+def liveness_response(message, results, verification):
+    """Dữ liệu trả về cho client sau khi xác thực liveness"""
+    # Đảm bảo tất cả các giá trị số và boolean được chuyển đổi sang kiểu Python gốc
+    response = {
+        'message': message,
+        'liveness_score': float(results['liveness_score']),
+        'blink_count': int(results['blink_count']),
+        'attempt_count': int(verification.attempt_count),
+        'status': verification.status
+    }
+
+    # Lý do loại nhanh để client hướng dẫn người dùng quay lại video
+    quick_reject = results.get('quick_reject')
+    if quick_reject and quick_reject['rejected']:
+        response['reject_reason'] = quick_reject['reason']
+
+    # Thời gian theo giai đoạn (chỉ có khi bật LIVENESS_RETURN_TIMINGS)
+    if 'timings' in results:
+        response['timings'] = results['timings']
+
+    return response
+
+def liveness_error_message(e):
+    """Phân loại lỗi để cung cấp hướng dẫn cụ thể cho người dùng"""
+    error_message = 'Không thể xác thực. Vui lòng thử lại.'
+
+    if "face" in str(e).lower():
+        error_message = "Không thể phát hiện khuôn mặt rõ ràng. Vui lòng đảm bảo ánh sáng đầy đủ và giữ khuôn mặt ở giữa khung hình."
+    elif "blink" in str(e).lower():
+        error_message = "Không thể phát hiện nháy mắt. Vui lòng nháy mắt rõ ràng và tự nhiên."
+    elif "video" in str(e).lower():
+        error_message = "Lỗi khi xử lý video. Vui lòng thử lại với ánh sáng tốt hơn."
+
+    return error_message
+
+def validate_liveness_upload():
+    """
+    Kiểm tra file video trong request
+
+    Returns:
+        Tuple (video_file, error_response) với error_response là None nếu hợp lệ
+    """
     if 'video' not in request.files:
-        return jsonify({'error': 'Không tìm thấy file video'}), 400
+        return None, (jsonify({'error': 'Không tìm thấy file video'}), 400)
 
     video_file = request.files['video']
     if not video_file.filename:
-        return jsonify({'error': 'Không có file nào được chọn'}), 400
+        return None, (jsonify({'error': 'Không có file nào được chọn'}), 400)
 
     # Validate file
     if not video_file.filename.lower().endswith(('.mp4', '.mov', '.webm')):
-        return jsonify({'error': 'Chỉ chấp nhận file MP4, MOV hoặc WebM'}), 400
+        return None, (jsonify({'error': 'Chỉ chấp nhận file MP4, MOV hoặc WebM'}), 400)
+
+    return video_file, None
+
+def get_liveness_verification(user_id):
+    """Lấy hoặc tạo bản ghi KYCVerification của người dùng"""
+    verification = KYCVerification.query.filter_by(user_id=user_id).first()
+    if not verification:
+        verification = KYCVerification(user_id=user_id)
+    return verification
 
-    # Check file size (16MB limit)
+def attempt_limit_response():
+    return jsonify({
+        'error': 'Quá số lần thử cho phép',
+        'message': 'Vui lòng thử lại sau 24 giờ'
+    }), 429
+
+@kyc_bp.route('/verify/liveness', methods=['POST'])
+@token_required
+@kyc_rate_limit()
+def verify_liveness(current_user):
+    video_file, error_response = validate_liveness_upload()
+    if error_response:
+        return error_response
+
+    # Kích thước file (16MB) được kiểm tra trong khi ghi video, không đọc trước toàn bộ file
     max_file_size = current_app.config['MAX_VIDEO_FILE_SIZE']
-    if len(video_file.read()) > max_file_size:
-        return jsonify({'error': f'File không được vượt quá {max_file_size / (1024 * 1024)}MB'}), 400
-    video_file.seek(0)
 
     try:
         # Get or create verification record
-        verification = KYCVerification.query.filter_by(user_id=current_user.id).first()
-        if not verification:
-            verification = KYCVerification(user_id=current_user.id)
+        verification = get_liveness_verification(current_user.id)
 
         # Check attempt limits
         if verification.attempt_count >= 5:
-            return jsonify({
-                'error': 'Quá số lần thử cho phép',
-                'message': 'Vui lòng thử lại sau 24 giờ'
-            }), 429
+            return attempt_limit_response()
 
         # Process video for liveness detection
         verification.increment_attempt()
-        results = process_video_for_liveness(video_file)
-
-        # Update verification record
-        verification.liveness_score = results['liveness_score']
-        verification.blink_count = results['blink_count']
-        verification.last_attempt_at = datetime.utcnow()
-
-        # Lưu tên file video nếu có
-        if 'video_filename' in results:
-            verification.selfie_path = results['video_filename']
-
-        if results['liveness_score'] > current_app.config['MIN_LIVENESS_SCORE']:
-            if results['blink_count'] >= current_app.config['MIN_BLINK_COUNT']:
-                verification.status = 'verified'
-                verification.verified_at = datetime.utcnow()
-                current_user.kyc_status = 'verified'
-                current_user.kyc_verified_at = datetime.utcnow()
-                message = 'Xác thực thành công'
-
-                # Kiểm tra và đảm bảo thông tin được lưu vào bảng identity_info
-                if verification.identity_card_front and verification.identity_card_back:
-                    try:
-                        # Kiểm tra xem đã có bản ghi IdentityInfo chưa
-                        identity = IdentityInfo.query.filter_by(user_id=current_user.id).first()
-                        if not identity:
-                            # Lấy thông tin từ mặt trước và mặt sau
-                            front_path = os.path.join(current_app.config['UPLOAD_FOLDER'], verification.identity_card_front)
-                            back_path = os.path.join(current_app.config['UPLOAD_FOLDER'], verification.identity_card_back)
-                            front_info = process_id_card(front_path, True)
-                            back_info = process_id_card(back_path, False)
-
-                            # Kết hợp thông tin
-                            combined_info = {**front_info, **back_info}
-
-                            # Kiểm tra xem có đủ thông tin cần thiết không
-                            required_fields = ['id_number', 'full_name', 'date_of_birth', 'gender', 'nationality', 'issue_date', 'expiry_date']
-                            missing_fields = [field for field in required_fields if field not in combined_info or combined_info[field] is None]
-
-                            if not missing_fields:
-                                # Tạo bản ghi IdentityInfo mới
-                                identity = IdentityInfo(
-                                    user_id=current_user.id,
-                                    id_number=combined_info['id_number'],
-                                    full_name=combined_info['full_name'],
-                                    date_of_birth=combined_info['date_of_birth'],
-                                    gender=combined_info['gender'],
-                                    nationality=combined_info['nationality'],
-                                    issue_date=combined_info['issue_date'],
-                                    expiry_date=combined_info['expiry_date'],
-                                    verified_at=verification.verified_at
-                                )
-                                db.session.add(identity)
-                                current_app.logger.info(f"Đã tạo bản ghi IdentityInfo cho user ID {current_user.id}")
-                            else:
-                                current_app.logger.warning(f"Thiếu thông tin cần thiết để tạo IdentityInfo: {missing_fields}")
-                    except Exception as e:
-                        current_app.logger.error(f"Lỗi khi tạo bản ghi IdentityInfo: {str(e)}")
-            else:
-                verification.status = 'failed'
-                verification.rejection_reason = f'Không phát hiện đủ số lần nháy mắt (phát hiện {results["blink_count"]} lần, yêu cầu {current_app.config["MIN_BLINK_COUNT"]} lần)'
-                message = f'Không phát hiện đủ số lần nháy mắt (phát hiện {results["blink_count"]} lần, yêu cầu {current_app.config["MIN_BLINK_COUNT"]} lần)'
-        else:
-            verification.status = 'failed'
-            verification.rejection_reason = f'Điểm số liveness không đạt yêu cầu (điểm số: {results["liveness_score"]:.2f}, yêu cầu: {current_app.config["MIN_LIVENESS_SCORE"]:.2f})'
-            message = f'Xác thực không thành công: Điểm số liveness {results["liveness_score"]:.2f} thấp hơn ngưỡng yêu cầu {current_app.config["MIN_LIVENESS_SCORE"]:.2f}'
+        try:
+            results = process_video_for_liveness(video_file, max_size=max_file_size)
+        except VideoTooLargeError as e:
+            return jsonify({'error': str(e)}), 400
+
+        message = apply_liveness_results(verification, current_user, results)
 
         db.session.add(verification)
         db.session.commit()
 
-        # Đảm bảo tất cả các giá trị số và boolean được chuyển đổi sang kiểu Python gốc
-        return jsonify({
-            'message': message,
-            'liveness_score': float(results['liveness_score']),
-            'blink_count': int(results['blink_count']),
-            'attempt_count': int(verification.attempt_count),
-            'status': verification.status
-        }), 200
+        return jsonify(liveness_response(message, results, verification)), 200
 
     except Exception as e:
         current_app.logger.error(f"Liveness verification error: {str(e)}")
 
-        # Thêm thông tin chi tiết về lỗi để giúp người dùng hiểu vấn đề
-        error_message = 'Không thể xác thực. Vui lòng thử lại.'
+        return jsonify({
+            'error': liveness_error_message(e),
+            'details': str(e) if current_app.config.get('DEBUG', False) else None
+        }), 500
+
+def run_liveness_job(job_id, user_id, video_path, video_filename):
+    """
+    Chạy phân tích liveness trong luồng nền (trong app context do liveness_jobs tạo)
+    và cập nhật KYCVerification như xác thực đồng bộ
+
+    Returns:
+        Dữ liệu trả về cho client (như verify_liveness)
+    """
+    try:
+        results = process_video_for_liveness(
+            video_path, video_filename=video_filename,
+            progress_callback=lambda processed, total: liveness_jobs.set_progress(job_id, processed, total))
+
+        user = User.query.get(user_id)
+        verification = get_liveness_verification(user_id)
+        verification.increment_attempt()
+        message = apply_liveness_results(verification, user, results)
+
+        db.session.add(verification)
+        db.session.commit()
+
+        return liveness_response(message, results, verification)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Liveness job {job_id} error: {str(e)}")
+        raise Exception(liveness_error_message(e))
+
+def active_job_response(job_id):
+    """Phản hồi khi người dùng đã có job liveness đang được xử lý"""
+    return jsonify({
+        'error': 'Đang có yêu cầu xác thực liveness được xử lý',
+        'job_id': job_id
+    }), 409
+
+@kyc_bp.route('/verify/liveness/async', methods=['POST'])
+@token_required
+@kyc_rate_limit()
+def submit_liveness_job(current_user):
+    """
+    Nhận video và đưa phân tích liveness vào hàng đợi nền, trả về job_id ngay lập tức
+    """
+    video_file, error_response = validate_liveness_upload()
+    if error_response:
+        return error_response
 
-        # Phân loại lỗi để cung cấp hướng dẫn cụ thể
-        if "face" in str(e).lower():
-            error_message = "Không thể phát hiện khuôn mặt rõ ràng. Vui lòng đảm bảo ánh sáng đầy đủ và giữ khuôn mặt ở giữa khung hình."
-        elif "blink" in str(e).lower():
-            error_message = "Không thể phát hiện nháy mắt. Vui lòng nháy mắt rõ ràng và tự nhiên."
-        elif "video" in str(e).lower():
-            error_message = "Lỗi khi xử lý video. Vui lòng thử lại với ánh sáng tốt hơn."
+    try:
+        verification = get_liveness_verification(current_user.id)
+        if verification.attempt_count is not None and verification.attempt_count >= 5:
+            return attempt_limit_response()
+
+        # Mỗi người dùng chỉ có một job đang chạy để không vượt giới hạn số lần thử
+        # (kiểm tra sớm để không phải lưu video, submit kiểm tra lại trên mọi tiến trình)
+        active_job = liveness_jobs.active_job_for_user(current_user.id)
+        if active_job:
+            return active_job_response(active_job['job_id'])
+
+        try:
+            video_path, video_filename, _ = store_liveness_upload(video_file, current_app.config['MAX_VIDEO_FILE_SIZE'])
+        except VideoTooLargeError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            job_id = liveness_jobs.submit(current_app._get_current_object(), current_user.id, run_liveness_job,
+                                          current_user.id, video_path, video_filename)
+        except LivenessJobConflict as e:
+            shutil.rmtree(os.path.dirname(video_path), ignore_errors=True)
+            return active_job_response(e.job_id)
+
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f"/kyc/verify/liveness/{job_id}"
+        }), 202
 
+    except Exception as e:
+        current_app.logger.error(f"Liveness job submit error: {str(e)}")
         return jsonify({
-            'error': error_message,
+            'error': 'Không thể xác thực. Vui lòng thử lại.',
             'details': str(e) if current_app.config.get('DEBUG', False) else None
         }), 500
 
+@kyc_bp.route('/verify/liveness/<job_id>', methods=['GET'])
+@token_required
+def get_liveness_job(current_user, job_id):
+    """
+    Lấy tiến trình và kết quả của job liveness
+    """
+    job = liveness_jobs.get(job_id)
+    if not job or job['user_id'] != current_user.id:
+        return jsonify({'error': 'Không tìm thấy yêu cầu xác thực'}), 404
+
+    response = {
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': round(job['progress'], 3)
+    }
+    if job['status'] == 'completed':
+        response['result'] = job['result']
+    elif job['status'] == 'failed':
+        response['error'] = job['error']
+
+    return jsonify(response), 200
+
+def finish_liveness_stream(session, user):
+    """
+    Kết thúc phiên liveness theo luồng, cập nhật KYCVerification như xác thực đồng bộ
+
+    Giới hạn số lần thử được kiểm tra lại khi kết thúc vì người dùng có thể đã dùng hết
+    lượt thử (ở phiên hoặc yêu cầu khác) kể từ khi bắt đầu phiên.
+
+    Returns:
+        Phản hồi HTTP
+    """
+    verification = get_liveness_verification(user.id)
+    if verification.attempt_count is not None and verification.attempt_count >= 5:
+        return attempt_limit_response()
+
+    results = session.finish()
+
+    verification.increment_attempt()
+    message = apply_liveness_results(verification, user, results)
+
+    db.session.add(verification)
+    db.session.commit()
+
+    session.response = liveness_response(message, results, verification)
+    session.response['stopped_early'] = bool(results['stopped_early'])
+    session.finished = True
+    return jsonify(dict(session.response, stream_status='completed')), 200
+
+@kyc_bp.route('/verify/liveness/stream', methods=['POST'])
+@token_required
+@kyc_rate_limit()
+def start_liveness_stream(current_user):
+    """
+    Bắt đầu phiên liveness theo luồng
+
+    Tham số (form hoặc JSON): mode='frames' (các frame JPEG) hoặc 'video' (các khối byte của video),
+    fps (tốc độ frame của chế độ 'frames', mặc định 30), expected_frames (số frame dự kiến gửi,
+    không bắt buộc: nếu có, kết quả chỉ được trả sớm khi các frame còn lại không thể làm thay đổi
+    kết quả; nếu không, kết quả được tính trên các frame đã nhận)
+    """
+    data = request.get_json(silent=True) or request.form
+    mode = data.get('mode', 'frames')
+    if mode not in ('frames', 'video'):
+        return jsonify({'error': "mode phải là 'frames' hoặc 'video'"}), 400
+    try:
+        fps = float(data.get('fps', 30))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'fps không hợp lệ'}), 400
+    expected_frames = data.get('expected_frames')
+    if expected_frames is not None:
+        try:
+            expected_frames = int(expected_frames)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'expected_frames không hợp lệ'}), 400
+        if not 0 < expected_frames <= current_app.config['LIVENESS_STREAM_MAX_FRAMES']:
+            return jsonify({'error': f"expected_frames phải từ 1 đến {current_app.config['LIVENESS_STREAM_MAX_FRAMES']}"}), 400
+
+    verification = get_liveness_verification(current_user.id)
+    if verification.attempt_count is not None and verification.attempt_count >= 5:
+        return attempt_limit_response()
+
+    session = liveness_streams.create(current_user.id, mode, fps, expected_frames)
+    return jsonify({
+        'session_id': session.session_id,
+        'mode': mode,
+        'upload_url': f"/kyc/verify/liveness/stream/{session.session_id}",
+        'finish_url': f"/kyc/verify/liveness/stream/{session.session_id}/finish"
+    }), 201
+
+@kyc_bp.route('/verify/liveness/stream/<session_id>', methods=['POST'])
+@token_required
+def upload_liveness_stream(current_user, session_id):
+    """
+    Gửi tiếp dữ liệu cho phiên liveness theo luồng
+
+    Chế độ 'frames': một hoặc nhiều file JPEG trong trường 'frames'.
+    Chế độ 'video': khối byte tiếp theo của video trong body request.
+    Trả về kết quả ngay khi đã đủ nháy mắt và kết quả không còn thay đổi.
+    """
+    with liveness_streams.open(session_id, current_user.id) as session:
+        if session is None:
+            return jsonify({'error': 'Không tìm thấy phiên xác thực'}), 404
+        if session.finished:
+            return jsonify(dict(session.response, stream_status='completed')), 200
+
+        try:
+            if session.mode == 'frames':
+                blobs = [frame_file.read() for frame_file in request.files.getlist('frames')]
+                if not blobs:
+                    return jsonify({'error': 'Không tìm thấy frame'}), 400
+                decided = session.add_jpeg_frames(blobs, current_app.config['LIVENESS_STREAM_MAX_FRAMES'])
+            else:
+                decided = session.add_video_chunk(request.stream, current_app.config['MAX_VIDEO_FILE_SIZE'])
+        except (ValueError, VideoTooLargeError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            if decided:
+                return finish_liveness_stream(session, current_user)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Liveness stream error: {str(e)}")
+            return jsonify({'error': liveness_error_message(e)}), 500
+
+        return jsonify(dict(session.analyzer.progress(), stream_status='analyzing')), 200
+
+@kyc_bp.route('/verify/liveness/stream/<session_id>/finish', methods=['POST'])
+@token_required
+def finish_liveness_stream_route(current_user, session_id):
+    """
+    Kết thúc phiên liveness theo luồng và trả về kết quả trên toàn bộ dữ liệu đã nhận
+    """
+    with liveness_streams.open(session_id, current_user.id) as session:
+        if session is None:
+            return jsonify({'error': 'Không tìm thấy phiên xác thực'}), 404
+        if session.finished:
+            return jsonify(dict(session.response, stream_status='completed')), 200
+        try:
+            return finish_liveness_stream(session, current_user)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Liveness stream error: {str(e)}")
+            return jsonify({
+                'error': liveness_error_message(e),
+                'details': str(e) if current_app.config.get('DEBUG', False) else None
+            }), 500
+
 @kyc_bp.route('/verify/id-card', methods=['POST'])
 @token_required
 @kyc_rate_limit()
@@ -262,6 +552,12 @@ def verify_id_card(current_user):
             'message': 'Tải lên thành công',
             'id_info': id_info
         }), 200
+    except ReaderPoolTimeout:
+        # Mọi reader OCR đang bận, client có thể thử lại sau
+        current_app.logger.warning("Hệ thống OCR đang bận, từ chối xác thực ID card")
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        return jsonify({'error': 'Hệ thống OCR đang bận. Vui lòng thử lại sau ít phút.', 'retry': True}), 503
     except Exception as e:
         current_app.logger.error(f"ID card verification error: {str(e)}")
         if filepath and os.path.exists(filepath):
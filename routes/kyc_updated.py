@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from models import db, KYCVerification, User, IdentityInfo
 from utils.auth import token_required
-from utils.liveness import process_video_for_liveness
+from utils.liveness import process_video_for_liveness, VideoTooLargeError
 # Thay thế Tesseract OCR bằng EasyOCR
 from utils.easyocr_utils import process_id_card
 from middleware.rate_limit import kyc_rate_limit
@@ -26,11 +26,8 @@ def verify_liveness(current_user):
     if not video_file.filename.lower().endswith(('.mp4', '.mov', '.webm')):
         return jsonify({'error': 'Chỉ chấp nhận file MP4, MOV hoặc WebM'}), 400
 
-    # Check file size (16MB limit)
+    # Kích thước file (16MB) được kiểm tra trong khi ghi video, không đọc trước toàn bộ file
     max_file_size = current_app.config['MAX_VIDEO_FILE_SIZE']
-    if len(video_file.read()) > max_file_size:
-        return jsonify({'error': f'File không được vượt quá {max_file_size / (1024 * 1024)}MB'}), 400
-    video_file.seek(0)
 
     try:
         # Get or create verification record
@@ -47,7 +44,10 @@ def verify_liveness(current_user):
 
         # Process video for liveness detection
         verification.increment_attempt()
-        results = process_video_for_liveness(video_file)
+        try:
+            results = process_video_for_liveness(video_file, max_size=max_file_size)
+        except VideoTooLargeError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Update verification record
         verification.liveness_score = results['liveness_score']
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from models import db, KYCVerification, User, IdentityInfo
 from utils.auth import token_required
-from utils.easyocr_utils import process_id_card
+from utils.easyocr_utils import process_id_card, ReaderPoolTimeout
 from middleware.rate_limit import kyc_rate_limit
 from datetime import datetime
 import os
@@ -93,6 +93,10 @@ def process_image_direct(current_user):
             'id_info': id_info
         }), 200
 
+    except ReaderPoolTimeout:
+        # Mọi reader OCR đang bận, client có thể thử lại sau
+        logger.warning("Hệ thống OCR đang bận, từ chối yêu cầu")
+        return jsonify({'error': 'Hệ thống OCR đang bận. Vui lòng thử lại sau ít phút.', 'retry': True}), 503
     except Exception as e:
         logger.error(f"Lỗi khi xử lý ảnh OCR: {str(e)}")
 
@@ -194,6 +198,12 @@ def upload_and_process(current_user):
             'image_path': filename  # Trả về tên file để có thể sử dụng lại sau này
         }), 200
 
+    except ReaderPoolTimeout:
+        # Mọi reader OCR đang bận, client có thể thử lại sau
+        logger.warning("Hệ thống OCR đang bận, từ chối yêu cầu")
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+        return jsonify({'error': 'Hệ thống OCR đang bận. Vui lòng thử lại sau ít phút.', 'retry': True}), 503
     except Exception as e:
         logger.error(f"Lỗi khi upload và xử lý ảnh OCR: {str(e)}")
 
@@ -75,7 +75,7 @@ def seed_database():
         logger.info("Bắt đầu tạo dữ liệu mẫu...")
         
         # Tạo ứng dụng Flask
-        app = create_app()
+        app = create_app(warmup=False)
         
         with app.app_context():
             # Tạo thư mục uploads nếu chưa tồn tại
@@ -2,42 +2,247 @@ import easyocr
 import cv2
 import numpy as np
 import os
+import time
+import queue
 import platform
 import subprocess
+import threading
 import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import re
+from config import Config
+from utils.timing import ocr_histograms
 
 # Cấu hình logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Biến toàn cục để lưu trữ reader
-_reader = None
+class ReaderPoolTimeout(Exception):
+    """Không lấy được EasyOCR reader trong thời gian chờ cho phép"""
 
-def get_reader(languages=['vi', 'en']):
+class ReaderPool:
     """
-    Lấy hoặc khởi tạo EasyOCR reader
-
-    Args:
-        languages: Danh sách ngôn ngữ cần nhận dạng, mặc định là tiếng Việt và tiếng Anh
+    Pool EasyOCR reader dùng chung giữa các luồng xử lý request
 
-    Returns:
-        EasyOCR reader object
+    Mỗi reader (mô hình torch riêng) chỉ được một luồng dùng tại một thời điểm: luồng
+    mượn reader bằng checkout và trả lại bằng checkin (hoặc dùng context manager reader()).
+    Số reader cũng là số lượt nhận dạng chạy đồng thời tối đa, các luồng khác chờ trong hàng đợi.
+    Reader được khởi tạo khi cần (có khóa nên không bao giờ khởi tạo thừa), thời gian chờ
+    và thời gian giữ reader được ghi vào ocr_histograms.
     """
-    global _reader
-    if _reader is None:
+
+    def __init__(self, size=1, languages=('vi', 'en'), timeout=None):
+        self.size = max(1, size)
+        self.languages = list(languages)
+        self.timeout = timeout
+        self.available = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.in_use = 0
+        self.waiting = 0
+
+    def _create_reader(self):
         try:
-            logger.info(f"Khởi tạo EasyOCR reader với ngôn ngữ: {languages}")
-            _reader = easyocr.Reader(languages, gpu=False)
+            logger.info(f"Khởi tạo EasyOCR reader {self.created}/{self.size} với ngôn ngữ: {self.languages}")
+            reader = easyocr.Reader(self.languages, gpu=False)
             logger.info("Đã khởi tạo EasyOCR reader thành công")
+            return reader
         except Exception as e:
             logger.error(f"Lỗi khi khởi tạo EasyOCR reader: {e}")
             raise Exception(f"Không thể khởi tạo EasyOCR reader: {e}")
-    return _reader
+
+    def checkout(self, timeout=None):
+        """
+        Mượn một reader, khởi tạo thêm nếu pool chưa đủ size reader
+
+        Args:
+            timeout: Thời gian chờ tối đa (giây), mặc định là timeout của pool (None: chờ mãi)
+
+        Returns:
+            EasyOCR reader object
+
+        Raises:
+            ReaderPoolTimeout: Nếu hết thời gian chờ
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start_time = time.perf_counter()
+
+        # Dành chỗ cho một reader mới nếu chưa có reader rảnh và pool chưa đủ
+        with self.lock:
+            create = self.available.empty() and self.created < self.size
+            if create:
+                self.created += 1
+            else:
+                self.waiting += 1
+
+        if create:
+            try:
+                reader = self._create_reader()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        else:
+            try:
+                reader = self.available.get(timeout=timeout)
+            except queue.Empty:
+                raise ReaderPoolTimeout(f"Hệ thống OCR đang bận, đã chờ {timeout} giây")
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+
+        wait_time = time.perf_counter() - start_time
+        ocr_histograms.observe('reader_wait', wait_time)
+        if wait_time > 1.0:
+            logger.info(f"Chờ EasyOCR reader {wait_time:.2f} giây")
+        with self.lock:
+            self.in_use += 1
+        return reader
+
+    def checkin(self, reader):
+        """Trả reader về pool"""
+        with self.lock:
+            self.in_use -= 1
+        self.available.put(reader)
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """Mượn reader trong một khối lệnh và tự động trả lại"""
+        reader = self.checkout(timeout)
+        start_time = time.perf_counter()
+        try:
+            yield reader
+        finally:
+            ocr_histograms.observe('reader_hold', time.perf_counter() - start_time)
+            self.checkin(reader)
+
+    def warm_up(self, image):
+        """
+        Khởi tạo đủ size reader và chạy thử nhận dạng một lần trên mỗi reader
+
+        Args:
+            image: Ảnh dùng để chạy thử
+        """
+        readers = []
+        try:
+            # Giữ các reader đã mượn để lần mượn sau khởi tạo reader mới
+            for _ in range(self.size):
+                readers.append(self.checkout())
+            for reader in readers:
+                reader.readtext(image, detail=0)
+        finally:
+            for reader in readers:
+                self.checkin(reader)
+
+    def stats(self):
+        """Trạng thái hiện tại của pool"""
+        with self.lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'in_use': self.in_use,
+                'available': self.available.qsize(),
+                'waiting': self.waiting
+            }
+
+def _configure_torch_threads():
+    # Giới hạn số luồng torch của mỗi lượt nhận dạng để nhiều reader chạy song song không tranh CPU
+    if Config.OCR_TORCH_THREADS > 0:
+        import torch
+        torch.set_num_threads(Config.OCR_TORCH_THREADS)
+
+_configure_torch_threads()
+
+# Pool reader dùng chung cho tiến trình
+reader_pool = ReaderPool(size=Config.OCR_READER_POOL_SIZE, timeout=Config.OCR_READER_TIMEOUT)
+
+def get_reader(languages=['vi', 'en']):
+    """
+    Mượn EasyOCR reader từ reader_pool, dùng với câu lệnh with để reader được trả lại:
+
+        with get_reader() as reader:
+            reader.readtext(...)
+
+    Args:
+        languages: Danh sách ngôn ngữ cần nhận dạng, chỉ hỗ trợ ngôn ngữ của reader_pool
+
+    Returns:
+        Context manager trả về EasyOCR reader object (xem ReaderPool.reader)
+    """
+    if list(languages) != reader_pool.languages:
+        raise ValueError(f"reader_pool chỉ hỗ trợ ngôn ngữ: {reader_pool.languages}")
+    return reader_pool.reader()
 
 # Các hàm xoay ảnh đã được loại bỏ theo yêu cầu
 
+def _order_corners(points):
+    """Sắp xếp 4 góc theo thứ tự: trên-trái, trên-phải, dưới-phải, dưới-trái"""
+    points = points.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([points[np.argmin(sums)], points[np.argmin(diffs)],
+                     points[np.argmax(sums)], points[np.argmax(diffs)]], dtype=np.float32)
+
+def localize_card(img, work_width=800):
+    """
+    Tìm tứ giác của thẻ CCCD trong ảnh và nắn phối cảnh về kích thước chuẩn
+
+    Biên của ảnh thu nhỏ được tìm bằng Canny, thẻ là đường viền lớn nhất xấp xỉ được
+    thành tứ giác lồi có diện tích đủ lớn và tỷ lệ cạnh gần với thẻ (85.6 x 54 mm).
+    Thẻ được nắn về chiều rộng OCR_CARD_WIDTH (thẻ chụp dọc giữ hướng dọc).
+
+    Args:
+        img: Ảnh BGR gốc
+        work_width: Chiều rộng ảnh thu nhỏ dùng để tìm biên
+
+    Returns:
+        Ảnh thẻ đã nắn hoặc None nếu không tìm thấy thẻ
+    """
+    height, width = img.shape[:2]
+    scale = min(1.0, work_width / float(width))
+    small = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(blurred, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=1)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = Config.OCR_CARD_MIN_AREA_RATIO * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            continue
+
+        corners = _order_corners(approx) / scale
+        top_left, top_right, bottom_right, bottom_left = corners
+        quad_width = max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))
+        quad_height = max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))
+        ratio = max(quad_width, quad_height) / max(1.0, min(quad_width, quad_height))
+        # Tỷ lệ thẻ là 1.586, nới rộng để chấp nhận ảnh chụp nghiêng
+        if not 1.2 <= ratio <= 2.1:
+            continue
+
+        card_width = Config.OCR_CARD_WIDTH
+        card_height = int(round(card_width / 1.586))
+        if quad_height > quad_width:
+            card_width, card_height = card_height, card_width
+        target = np.array([[0, 0], [card_width - 1, 0], [card_width - 1, card_height - 1], [0, card_height - 1]], dtype=np.float32)
+        # warpPerspective không hỗ trợ INTER_AREA: thu nhỏ ảnh lớn bằng INTER_AREA trước để tránh răng cưa
+        # (giữ thẻ lớn hơn kích thước chuẩn một chút), sau đó nắn phối cảnh bằng INTER_LINEAR
+        source = img
+        shrink = min(1.0, 1.5 * max(card_width, card_height) / max(quad_width, quad_height))
+        if shrink < 1.0:
+            source = cv2.resize(img, (int(width * shrink), int(height * shrink)), interpolation=cv2.INTER_AREA)
+        matrix = cv2.getPerspectiveTransform(corners * shrink, target)
+        return cv2.warpPerspective(source, matrix, (card_width, card_height), flags=cv2.INTER_LINEAR)
+    return None
+
 def preprocess_image(image_path):
     """
     Tiền xử lý ảnh để cải thiện kết quả OCR
@@ -46,7 +251,7 @@ def preprocess_image(image_path):
         image_path: Đường dẫn đến file ảnh
 
     Returns:
-        Ảnh đã được tiền xử lý
+        Tuple (ảnh đã được tiền xử lý, ảnh BGR của thẻ đã nắn hoặc ảnh gốc nếu không tìm thấy thẻ)
     """
     try:
         # Đọc ảnh
@@ -59,6 +264,16 @@ def preprocess_image(image_path):
         os.makedirs(debug_dir, exist_ok=True)
         cv2.imwrite(os.path.join(debug_dir, f"original_{os.path.basename(image_path)}"), img)
 
+        # Chỉ giữ lại thẻ CCCD (bỏ nền, nắn phối cảnh về kích thước chuẩn) nếu tìm thấy
+        if Config.OCR_CARD_LOCALIZATION:
+            card = localize_card(img)
+            if card is not None:
+                logger.info(f"Đã tìm thấy thẻ CCCD, nắn về kích thước {card.shape[1]}x{card.shape[0]}")
+                cv2.imwrite(os.path.join(debug_dir, f"card_{os.path.basename(image_path)}"), card)
+                img = card
+            else:
+                logger.warning("Không tìm thấy thẻ CCCD trong ảnh, sử dụng toàn bộ ảnh")
+
         # Lấy kích thước ảnh
         height, width = img.shape[:2]
         aspect_ratio = width / height
@@ -108,22 +323,24 @@ def extract_text(image):
         Văn bản trích xuất được
     """
     try:
-        reader = get_reader()
-
-        # Sử dụng EasyOCR để trích xuất text
-        results = reader.readtext(image)
+        with reader_pool.reader() as reader:
+            # Sử dụng EasyOCR để trích xuất text
+            results = reader.readtext(image)
 
-        # Kết hợp tất cả các text thành một chuỗi
-        text = "\n".join([result[1] for result in results])
+            # Kết hợp tất cả các text thành một chuỗi
+            text = "\n".join([result[1] for result in results])
 
-        # Kiểm tra nếu text quá ngắn
-        if len(text.strip()) < 20:
-            logger.warning("Văn bản trích xuất quá ngắn, thử lại với ảnh gốc...")
-            # Thử lại với ảnh gốc
-            results = reader.readtext(image, detail=0)
-            text = "\n".join(results)
+            # Kiểm tra nếu text quá ngắn
+            if len(text.strip()) < 20:
+                logger.warning("Văn bản trích xuất quá ngắn, thử lại với ảnh gốc...")
+                # Thử lại với ảnh gốc
+                results = reader.readtext(image, detail=0)
+                text = "\n".join(results)
 
         return text
+    except ReaderPoolTimeout:
+        # Pool đang bận, để route trả về 503 thay vì coi là lỗi EasyOCR
+        raise
     except Exception as e:
         logger.error(f"Lỗi khi trích xuất văn bản: {e}")
         raise Exception(f"Không thể trích xuất văn bản từ ảnh. Lỗi EasyOCR: {e}")
@@ -618,129 +835,243 @@ def parse_id_info(text, is_front):
 
     return info
 
-def process_id_card(image_path, is_front):
+def detect_text_boxes(image):
+    """
+    Phát hiện các vùng chữ (CRAFT) một lần để dùng lại cho nhiều biến thể ảnh cùng kích thước
+
+    Args:
+        image: Ảnh dùng để phát hiện (thường là ảnh gốc)
+
+    Returns:
+        Tuple (horizontal_list, free_list) theo định dạng của EasyOCR Reader.detect
+    """
+    start_time = time.perf_counter()
+    with reader_pool.reader() as reader:
+        horizontal_list, free_list = reader.detect(image)
+    ocr_histograms.observe('detect', time.perf_counter() - start_time)
+    return horizontal_list[0], free_list[0]
+
+def recognize_text(image, boxes):
+    """
+    Chỉ chạy bộ nhận dạng trên các vùng chữ đã phát hiện (xem detect_text_boxes)
+
+    Args:
+        image: Ảnh của biến thể (cùng kích thước với ảnh dùng để phát hiện)
+        boxes: Tuple (horizontal_list, free_list)
+
+    Returns:
+        Văn bản nhận dạng được
+    """
+    horizontal_list, free_list = boxes
+    if not horizontal_list and not free_list:
+        return ""
+    start_time = time.perf_counter()
+    with reader_pool.reader() as reader:
+        results = reader.recognize(image, horizontal_list=horizontal_list, free_list=free_list, detail=0)
+    ocr_histograms.observe('recognize', time.perf_counter() - start_time)
+    return "\n".join(results)
+
+def _otsu_variant(original_img):
+    """Biến thể ngưỡng hóa Otsu"""
+    gray = cv2.cvtColor(original_img, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, otsu_thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return otsu_thresh
+
+def _adaptive_variant(original_img):
+    """Biến thể tăng độ sáng/độ tương phản và ngưỡng hóa thích nghi"""
+    alpha = 1.5  # Điều chỉnh độ tương phản
+    beta = 30    # Điều chỉnh độ sáng
+    adjusted = cv2.convertScaleAbs(original_img, alpha=alpha, beta=beta)
+    adjusted_gray = cv2.cvtColor(adjusted, cv2.COLOR_BGR2GRAY)
+    return cv2.adaptiveThreshold(adjusted_gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+def _missing_required_fields(info, is_front):
+    """Các trường bắt buộc chưa trích xuất được"""
+    required_fields = ['id_number', 'full_name'] if is_front else ['issue_date', 'expiry_date']
+    return [field for field in required_fields if field not in info]
+
+def _log_keywords(text, label):
+    # Kiểm tra các chuỗi đặc trưng của CCCD trong văn bản để debug
+    if "KHOANG" in text or "KHOÀNG" in text or "NGHIA" in text or "NGHĨA" in text:
+        logger.info(f"{label}: Phát hiện từ khóa KHOANG hoặc NGHIA trong văn bản")
+    if "Họ, chữ đệm và tên khai sinh" in text or "//ull nutn" in text:
+        logger.info(f"{label}: Phát hiện chuỗi 'Họ, chữ đệm và tên khai sinh' hoặc '//ull nutn' trong văn bản")
+
+def _ocr_variant(name, image_path, is_front, debug_dir, build_image, cancel_event=None, boxes=None):
+    """
+    Nhận dạng và phân tích một biến thể tiền xử lý của ảnh CCCD
+
+    Args:
+        name: Tên biến thể ('preprocessed', 'otsu', 'adaptive', 'original')
+        image_path: Đường dẫn đến file ảnh
+        is_front: True nếu là mặt trước CCCD
+        debug_dir: Thư mục debug
+        build_image: Hàm trả về ảnh của biến thể
+        cancel_event: threading.Event, biến thể bị bỏ qua nếu đã được đặt trước khi nhận dạng
+        boxes: Vùng chữ đã phát hiện (xem detect_text_boxes), None: phát hiện lại trên ảnh của biến thể
+
+    Returns:
+        Tuple (name, info) hoặc None nếu bị hủy
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+    base_name = os.path.basename(image_path)
+
+    image = build_image()
+    # Ảnh preprocessed đã được lưu trong preprocess_image, ảnh gốc không cần lưu lại
+    if name in OCR_VARIANT_DEBUG_NAMES:
+        cv2.imwrite(os.path.join(debug_dir, f"{OCR_VARIANT_DEBUG_NAMES[name]}_{base_name}"), image)
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+    text = recognize_text(image, boxes) if boxes is not None else extract_text(image)
+
+    # Lưu text vào file để debug
+    suffix = '' if name == 'preprocessed' else f"_{name}"
+    with open(os.path.join(debug_dir, f"ocr_text{suffix}_{base_name}.txt"), "w", encoding="utf-8") as f:
+        f.write(text)
+    _log_keywords(text, f"Phương pháp {name}")
+
+    return name, parse_id_info(text, is_front)
+
+# Tên ảnh debug của các biến thể (giữ như trước)
+OCR_VARIANT_DEBUG_NAMES = {'otsu': 'otsu_thresh', 'adaptive': 'adaptive_thresh'}
+
+# Pool luồng chạy song song các biến thể OCR, được tạo khi cần
+_variant_executor = None
+_variant_executor_lock = threading.Lock()
+
+def _get_variant_executor():
+    global _variant_executor
+    with _variant_executor_lock:
+        if _variant_executor is None:
+            _variant_executor = ThreadPoolExecutor(max_workers=Config.OCR_VARIANT_WORKERS, thread_name_prefix='ocr-variant')
+        return _variant_executor
+
+def _best_variant(results, variant_names, is_front):
+    """Kết quả có ít trường bắt buộc bị thiếu nhất, ưu tiên theo thứ tự biến thể"""
+    return min(results, key=lambda item: (len(_missing_required_fields(item[1], is_front)), variant_names.index(item[0])))
+
+def _merge_variants(results, variant_names):
+    """Gộp các trường của mọi biến thể, trường của biến thể đứng trước được ưu tiên"""
+    merged = {}
+    for name, info in sorted(results, key=lambda item: variant_names.index(item[0])):
+        for field, value in info.items():
+            if value is not None and merged.get(field) is None:
+                merged[field] = value
+    return merged
+
+def process_id_card(image_path, is_front, mode=None, shared_detection=None):
     """
     Xử lý ảnh CCCD và trích xuất thông tin
 
+    Ảnh được nhận dạng theo các biến thể tiền xử lý: preprocess_image, ngưỡng hóa Otsu,
+    tăng tương phản + ngưỡng hóa thích nghi và ảnh gốc. Mọi biến thể được tạo từ ảnh thẻ đã
+    nắn bởi localize_card (ảnh gốc nếu không tìm thấy thẻ). Chế độ chạy:
+    - 'sequential': lần lượt từng biến thể, dừng khi có đủ các trường bắt buộc
+    - 'first': chạy song song, lấy biến thể đầu tiên hoàn thành có đủ các trường bắt buộc,
+      các biến thể chưa bắt đầu nhận dạng bị hủy
+    - 'merge': chạy song song mọi biến thể và gộp các trường trích xuất được
+    Nếu không biến thể nào đủ trường bắt buộc, dùng biến thể thiếu ít trường nhất.
+    Các chế độ song song cần OCR_READER_POOL_SIZE đủ lớn để các biến thể nhận dạng đồng thời.
+
+    Khi dùng chung bước phát hiện, vùng chữ được phát hiện một lần trên ảnh gốc (các biến thể
+    có cùng kích thước) và mỗi biến thể chỉ chạy bộ nhận dạng trên các vùng đó.
+
     Args:
         image_path: Đường dẫn đến file ảnh
         is_front: True nếu là mặt trước CCCD, False nếu là mặt sau
+        mode: Chế độ chạy các biến thể, mặc định lấy từ Config.OCR_VARIANT_MODE
+        shared_detection: Phát hiện vùng chữ một lần cho mọi biến thể, mặc định lấy từ
+            Config.OCR_SHARED_DETECTION
 
     Returns:
         Dictionary chứa thông tin trích xuất được
     """
+    if mode is None:
+        mode = Config.OCR_VARIANT_MODE
+    if shared_detection is None:
+        shared_detection = Config.OCR_SHARED_DETECTION
+    if mode not in ('sequential', 'first', 'merge'):
+        raise ValueError(f"Chế độ OCR không hợp lệ: {mode}")
+
     try:
         # Tạo thư mục debug
         debug_dir = os.path.join(os.path.dirname(image_path), "debug")
         os.makedirs(debug_dir, exist_ok=True)
 
         # Ghi log thông tin ảnh đầu vào
-        logger.info(f"Xử lý ảnh CCCD: {image_path}, {'mặt trước' if is_front else 'mặt sau'}")
+        logger.info(f"Xử lý ảnh CCCD: {image_path}, {'mặt trước' if is_front else 'mặt sau'}, chế độ {mode}")
 
         # Tiền xử lý ảnh (bao gồm phát hiện và xoay ảnh)
         processed_image, original_img = preprocess_image(image_path)
 
-        # Trích xuất text
-        text = extract_text(processed_image)
-
-        # Lưu text vào file để debug
-        debug_file = os.path.join(debug_dir, f"ocr_text_{os.path.basename(image_path)}.txt")
-        with open(debug_file, "w", encoding="utf-8") as f:
-            f.write(text)
-
-        # Kiểm tra xem có chuỗi "KHOANG" hoặc "NGHIA" trong văn bản không
-        if "KHOANG" in text or "KHOÀNG" in text or "NGHIA" in text or "NGHĨA" in text:
-            logger.info("Phát hiện từ khóa KHOANG hoặc NGHIA trong văn bản")
-
-        # Kiểm tra xem có chuỗi "Họ, chữ đệm và tên khai sinh" trong văn bản không
-        if "Họ, chữ đệm và tên khai sinh" in text or "//ull nutn" in text:
-            logger.info("Phát hiện chuỗi 'Họ, chữ đệm và tên khai sinh' hoặc '//ull nutn' trong văn bản")
-
-        # Phân tích thông tin
-        info = parse_id_info(text, is_front)
-
-        # Nếu không trích xuất được thông tin cơ bản, thử lại với các phương pháp tiền xử lý khác
-        required_fields = ['id_number', 'full_name'] if is_front else ['issue_date', 'expiry_date']
-        missing_fields = [field for field in required_fields if field not in info]
-
-        if (is_front and ("id_number" not in info or "full_name" not in info)) or (not is_front and len(missing_fields) > 0):
-            logger.warning(f"Không tìm thấy thông tin cơ bản: {missing_fields}, thử lại với phương pháp tiền xử lý khác...")
-
-            # Phương pháp 2: Sử dụng ngưỡng hóa Otsu
-            gray = cv2.cvtColor(original_img, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            _, otsu_thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-            # Lưu ảnh đã xử lý để debug
-            cv2.imwrite(os.path.join(debug_dir, f"otsu_thresh_{os.path.basename(image_path)}"), otsu_thresh)
-
-            # Thử OCR với ảnh đã xử lý mới
-            text = extract_text(otsu_thresh)
-
-            # Lưu text vào file để debug
-            with open(os.path.join(debug_dir, f"ocr_text_otsu_{os.path.basename(image_path)}.txt"), "w", encoding="utf-8") as f:
-                f.write(text)
-
-            # Kiểm tra xem có chuỗi "KHOANG" hoặc "NGHIA" trong văn bản không
-            if "KHOANG" in text or "KHOÀNG" in text or "NGHIA" in text or "NGHĨA" in text:
-                logger.info("Phương pháp Otsu: Phát hiện từ khóa KHOANG hoặc NGHIA trong văn bản")
-
-            # Kiểm tra xem có chuỗi "Họ, chữ đệm và tên khai sinh" trong văn bản không
-            if "Họ, chữ đệm và tên khai sinh" in text or "//ull nutn" in text:
-                logger.info("Phương pháp Otsu: Phát hiện chuỗi 'Họ, chữ đệm và tên khai sinh' hoặc '//ull nutn' trong văn bản")
-
-            # Phân tích thông tin lại
-            info = parse_id_info(text, is_front)
-
-            # Nếu vẫn không tìm thấy, thử phương pháp 3
-            missing_fields = [field for field in required_fields if field not in info]
-            if (is_front and ("id_number" not in info or "full_name" not in info)) or (not is_front and len(missing_fields) > 0):
-                logger.warning("Vẫn không tìm thấy thông tin cơ bản, thử lại với phương pháp thứ 3...")
-
-                # Phương pháp 3: Tăng độ sáng và độ tương phản
-                alpha = 1.5  # Điều chỉnh độ tương phản
-                beta = 30    # Điều chỉnh độ sáng
-                adjusted = cv2.convertScaleAbs(original_img, alpha=alpha, beta=beta)
-
-                # Chuyển sang ảnh xám và áp dụng ngưỡng hóa thích nghi
-                adjusted_gray = cv2.cvtColor(adjusted, cv2.COLOR_BGR2GRAY)
-                adaptive_thresh = cv2.adaptiveThreshold(adjusted_gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-
-                # Lưu ảnh đã xử lý để debug
-                cv2.imwrite(os.path.join(debug_dir, f"adaptive_thresh_{os.path.basename(image_path)}"), adaptive_thresh)
-
-                # Thử OCR với ảnh đã xử lý mới
-                text = extract_text(adaptive_thresh)
-
-                # Lưu text vào file để debug
-                with open(os.path.join(debug_dir, f"ocr_text_adaptive_{os.path.basename(image_path)}.txt"), "w", encoding="utf-8") as f:
-                    f.write(text)
-
-                # Phân tích thông tin lại
-                info = parse_id_info(text, is_front)
-
-                # Thử trực tiếp với ảnh gốc nếu các phương pháp trước không thành công
-                missing_fields = [field for field in required_fields if field not in info]
-                if (is_front and ("id_number" not in info or "full_name" not in info)) or (not is_front and len(missing_fields) > 0):
-                    logger.warning("Vẫn không tìm thấy thông tin cơ bản, thử lại với ảnh gốc...")
-
-                    # Thử OCR với ảnh gốc
-                    reader = get_reader()
-                    results = reader.readtext(image_path, detail=0)
-                    text = "\n".join(results)
-
-                    # Lưu text vào file để debug
-                    with open(os.path.join(debug_dir, f"ocr_text_original_{os.path.basename(image_path)}.txt"), "w", encoding="utf-8") as f:
-                        f.write(text)
-
-                    # Phân tích thông tin lại
-                    original_info = parse_id_info(text, is_front)
+        # Phát hiện vùng chữ một lần trên ảnh gốc, nếu lỗi thì mỗi biến thể tự phát hiện như trước
+        boxes = None
+        if shared_detection:
+            try:
+                boxes = detect_text_boxes(original_img)
+                logger.info(f"Phát hiện {len(boxes[0]) + len(boxes[1])} vùng chữ, dùng chung cho mọi phương pháp")
+            except ReaderPoolTimeout:
+                raise
+            except Exception as e:
+                logger.error(f"Lỗi khi phát hiện vùng chữ, phát hiện riêng cho từng phương pháp: {e}")
+
+        # Các biến thể theo thứ tự ưu tiên
+        variants = [
+            ('preprocessed', lambda: processed_image),
+            ('otsu', lambda: _otsu_variant(original_img)),
+            ('adaptive', lambda: _adaptive_variant(original_img)),
+            ('original', lambda: original_img)
+        ]
+        variant_names = [name for name, _ in variants]
+
+        results = []
+        if mode == 'sequential':
+            for name, build_image in variants:
+                results.append(_ocr_variant(name, image_path, is_front, debug_dir, build_image, boxes=boxes))
+                missing_fields = _missing_required_fields(results[-1][1], is_front)
+                if not missing_fields:
+                    break
+                logger.warning(f"Phương pháp {name} không tìm thấy thông tin cơ bản: {missing_fields}")
+        else:
+            cancel_event = threading.Event()
+            executor = _get_variant_executor()
+            futures = [executor.submit(_ocr_variant, name, image_path, is_front, debug_dir, build_image, cancel_event, boxes)
+                       for name, build_image in variants]
+            errors = []
+            try:
+                for future in as_completed(futures):
+                    # Lỗi của một biến thể không làm hỏng các biến thể khác
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Lỗi khi nhận dạng một biến thể: {e}")
+                        errors.append(e)
+                        continue
+                    if result is None:
+                        continue
+                    results.append(result)
+                    if mode == 'first' and not _missing_required_fields(result[1], is_front):
+                        logger.info(f"Phương pháp {result[0]} có đủ thông tin cơ bản, hủy các phương pháp còn lại")
+                        break
+            finally:
+                # Hủy các biến thể chưa chạy, các biến thể đang nhận dạng tự dừng trước bước tiếp theo
+                cancel_event.set()
+                for future in futures:
+                    future.cancel()
+            if not results:
+                raise errors[0]
+
+        if mode == 'merge':
+            info = _merge_variants(results, variant_names)
+        else:
+            name, info = _best_variant(results, variant_names, is_front)
+            logger.info(f"Sử dụng kết quả của phương pháp {name}")
 
-                    # Kiểm tra xem ảnh gốc có cho kết quả tốt hơn không
-                    original_missing_fields = [field for field in required_fields if field not in original_info]
-                    if len(original_missing_fields) < len(missing_fields):
-                        logger.info("Ảnh gốc cho kết quả tốt hơn, sử dụng kết quả này")
-                        info = original_info
+        missing_fields = _missing_required_fields(info, is_front)
+        if missing_fields:
+            logger.warning(f"Không tìm thấy thông tin cơ bản sau {len(results)} phương pháp: {missing_fields}")
 
         # Ghi log kết quả cuối cùng
         logger.info(f"Kết quả trích xuất thông tin: {info}")
@@ -757,9 +1088,6 @@ def test_easyocr():
         True nếu EasyOCR hoạt động bình thường, False nếu có lỗi
     """
     try:
-        # Kiểm tra EasyOCR
-        reader = get_reader()
-
         # Tạo một ảnh đơn giản để kiểm tra
         from PIL import Image, ImageDraw
 
@@ -775,7 +1103,8 @@ def test_easyocr():
         img.save(test_image_path)
 
         # Nhận dạng văn bản
-        result = reader.readtext(test_image_path, detail=0)
+        with get_reader() as reader:
+            result = reader.readtext(test_image_path, detail=0)
         text = "\n".join(result)
         print(f"\nKết quả OCR: {text.strip()}")
 
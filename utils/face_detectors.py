@@ -0,0 +1,141 @@
+import os
+import threading
+import cv2
+import dlib
+from config import Config
+
+class HaarCascadeDetector:
+    """
+    Bộ phát hiện khuôn mặt Haar cascade của OpenCV
+
+    Nhanh nhất trên CPU nhưng dễ phát hiện nhầm hơn HOG. CascadeClassifier không an toàn
+    khi dùng chung giữa các luồng nên mỗi luồng (pipeline) có một bản riêng.
+    """
+
+    def __init__(self, cascade_path=None, scale_factor=1.1, min_neighbors=5):
+        if cascade_path is None:
+            cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        if not os.path.exists(cascade_path):
+            raise FileNotFoundError(f"Không tìm thấy file Haar cascade: {cascade_path}")
+        self.cascade_path = cascade_path
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self._local = threading.local()
+
+    def _classifier(self):
+        classifier = getattr(self._local, 'classifier', None)
+        if classifier is None:
+            classifier = cv2.CascadeClassifier(self.cascade_path)
+            self._local.classifier = classifier
+        return classifier
+
+    def __call__(self, gray, upsample=0):
+        """
+        Phát hiện khuôn mặt (cùng giao diện với dlib.get_frontal_face_detector())
+
+        Args:
+            gray: Ảnh xám
+            upsample: Số lần phóng to ảnh gấp đôi trước khi phát hiện
+
+        Returns:
+            Danh sách dlib.rectangle theo tọa độ của ảnh đầu vào
+        """
+        scale = 2 ** upsample
+        for _ in range(upsample):
+            gray = cv2.pyrUp(gray)
+        faces = self._classifier().detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                    minNeighbors=self.min_neighbors, minSize=(40, 40))
+        return [dlib.rectangle(int(x / scale), int(y / scale), int((x + w) / scale), int((y + h) / scale))
+                for (x, y, w, h) in faces]
+
+class DnnFaceDetector:
+    """
+    Bộ phát hiện khuôn mặt OpenCV DNN (ResNet-10 SSD 300x300, Caffe) chạy trên CPU
+
+    Chính xác hơn HOG với khuôn mặt nghiêng/thiếu sáng, thời gian gần như không phụ thuộc
+    độ phân giải vì ảnh luôn được thu về 300x300. Mỗi luồng có một bản cv2.dnn.Net riêng.
+    Khung khuôn mặt của SSD rộng hơn khung HOG mà landmark predictor được huấn luyện,
+    cần kiểm tra độ khớp số lần nháy mắt bằng benchmark_liveness.py trước khi dùng.
+    """
+
+    INPUT_SIZE = (300, 300)
+    MEAN = (104.0, 177.0, 123.0)
+
+    def __init__(self, prototxt_path=None, model_path=None, confidence=None):
+        if prototxt_path is None:
+            prototxt_path = Config.LIVENESS_DNN_PROTOTXT
+        if model_path is None:
+            model_path = Config.LIVENESS_DNN_MODEL
+        if confidence is None:
+            confidence = Config.LIVENESS_DNN_CONFIDENCE
+        for path in (prototxt_path, model_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Không tìm thấy file mô hình DNN phát hiện khuôn mặt: {path}")
+        self.prototxt_path = prototxt_path
+        self.model_path = model_path
+        self.confidence = confidence
+        self._local = threading.local()
+        # Nạp mô hình ngay để phát hiện lỗi khi khởi động
+        self._net()
+
+    def _net(self):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(self.prototxt_path, self.model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def __call__(self, gray, upsample=0):
+        """
+        Phát hiện khuôn mặt (cùng giao diện với dlib.get_frontal_face_detector(),
+        upsample không có tác dụng vì ảnh luôn được thu về kích thước đầu vào của mạng)
+
+        Returns:
+            Danh sách dlib.rectangle theo tọa độ của ảnh đầu vào
+        """
+        height, width = gray.shape[:2]
+        image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, self.INPUT_SIZE), 1.0, self.INPUT_SIZE, self.MEAN)
+        net = self._net()
+        net.setInput(blob)
+        detections = net.forward()
+
+        faces = []
+        for detection in detections[0, 0]:
+            if detection[2] < self.confidence:
+                continue
+            left = max(0, int(detection[3] * width))
+            top = max(0, int(detection[4] * height))
+            right = min(width - 1, int(detection[5] * width))
+            bottom = min(height - 1, int(detection[6] * height))
+            if right > left and bottom > top:
+                faces.append(dlib.rectangle(left, top, right, bottom))
+        return faces
+
+# Các backend phát hiện khuôn mặt, chọn bằng Config.LIVENESS_FACE_DETECTOR
+FACE_DETECTOR_BACKENDS = {
+    'dlib_hog': dlib.get_frontal_face_detector,
+    'haar': HaarCascadeDetector,
+    'dnn': DnnFaceDetector
+}
+
+def create_face_detector(backend=None):
+    """
+    Khởi tạo bộ phát hiện khuôn mặt
+
+    Mọi backend đều là callable detector(gray, upsample) trả về danh sách dlib.rectangle
+    nên landmark predictor và FaceTracker dùng được với mọi backend.
+
+    Args:
+        backend: Tên backend ('dlib_hog', 'haar', 'dnn'), mặc định lấy từ Config.LIVENESS_FACE_DETECTOR
+
+    Returns:
+        Bộ phát hiện khuôn mặt
+    """
+    if backend is None:
+        backend = Config.LIVENESS_FACE_DETECTOR
+    if backend not in FACE_DETECTOR_BACKENDS:
+        raise ValueError(f"Bộ phát hiện khuôn mặt không hợp lệ: {backend} (hỗ trợ: {', '.join(FACE_DETECTOR_BACKENDS)})")
+    return FACE_DETECTOR_BACKENDS[backend]()
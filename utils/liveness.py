@@ -1,363 +1,1189 @@
 import cv2
-import numpy as np  # Sử dụng trong preprocess_frame
+import numpy as np
 import dlib
 from imutils import face_utils
-from scipy.spatial import distance as dist
 import os
 import time
-
-# Khởi tạo face detector và facial landmark predictor
-face_detector = dlib.get_frontal_face_detector()
+import uuid
+import queue
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from utils.timing import StageTimer, liveness_histograms
+from utils.face_detectors import create_face_detector
+
+# Khởi tạo face detector (backend theo Config.LIVENESS_FACE_DETECTOR) và facial landmark predictor
+face_detector_backend = Config.LIVENESS_FACE_DETECTOR
+face_detector = create_face_detector(face_detector_backend)
 predictor_path = os.path.join(os.path.dirname(__file__), 'models', 'shape_predictor_68_face_landmarks.dat')
 landmark_predictor = dlib.shape_predictor(predictor_path)
 
-def eye_aspect_ratio(eye):
-    # Tính tỉ lệ khung mắt dựa trên landmarks
-    A = dist.euclidean(eye[1], eye[5])
-    B = dist.euclidean(eye[2], eye[4])
-    C = dist.euclidean(eye[0], eye[3])
-    ear = (A + B) / (2.0 * C)
-    return ear
+# Chỉ số landmarks của 2 mắt trong 68 điểm
+(L_EYE_START, L_EYE_END) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
+(R_EYE_START, R_EYE_END) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
 
-def detect_blinks(video_path):
+def compute_ear_batch(eye_points):
     """
-    Phát hiện nháy mắt trong video
+    Tính EAR trung bình của 2 mắt cho nhiều frame trong một lần tính vector hóa
 
     Args:
-        video_path: Đường dẫn đến file video
+        eye_points: Mảng (n, 12, 2) gồm 6 điểm mắt trái và 6 điểm mắt phải của mỗi frame
 
     Returns:
-        Dictionary chứa kết quả phân tích
+        Mảng (n,) chứa EAR trung bình của 2 mắt cho từng frame
     """
-    # Các tham số cho thuật toán phát hiện nháy mắt
-    EYE_AR_THRESH = 0.13  # Ngưỡng tỉ lệ khung mắt để phát hiện nháy mắt (giảm xuống để nghiêm ngặt hơn)
-    EYE_AR_CONSEC_FRAMES = 2  # Số frame liên tiếp cần thiết để xác định nháy mắt (tăng lên để chính xác hơn)
+    eyes = np.asarray(eye_points, dtype=np.float32).reshape(-1, 2, 6, 2)
+    A = np.linalg.norm(eyes[:, :, 1] - eyes[:, :, 5], axis=-1)
+    B = np.linalg.norm(eyes[:, :, 2] - eyes[:, :, 4], axis=-1)
+    C = np.linalg.norm(eyes[:, :, 0] - eyes[:, :, 3], axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ears = np.where(C > 0, (A + B) / (2.0 * C), 0.0)
+    return ears.mean(axis=1)
+
+def eye_points_from_shape(shape):
+    """Lấy mảng (12, 2) gồm 6 điểm mắt trái và 6 điểm mắt phải từ 68 landmarks"""
+    return np.concatenate((shape[L_EYE_START:L_EYE_END], shape[R_EYE_START:R_EYE_END]))
+
+class EarTimeline:
+    """
+    Dòng thời gian EAR của video
 
-    # Biến toàn cục để tính EAR trung bình
-    global_ear_values = []
+    Landmarks của mắt được lưu vào mảng NumPy cấp phát trước có kích thước
+    (frames, 12, 2). EAR trung bình được cập nhật tăng dần, còn EAR của toàn bộ
+    video và phân phối EAR được tính vector hóa trong một lần.
+    """
 
-    # Tạo thư mục debug
-    debug_dir = os.path.join(os.path.dirname(video_path), "debug_frames")
-    os.makedirs(debug_dir, exist_ok=True)
+    def __init__(self, capacity=0):
+        capacity = max(int(capacity), 64)
+        self.eye_points = np.empty((capacity, 12, 2), dtype=np.float32)
+        self.frame_indices = np.empty(capacity, dtype=np.int32)
+        self.ears = np.empty(capacity, dtype=np.float32)
+        self.count = 0
+        self.ear_sum = 0.0
+        # Chỉ số dòng đầu tiên của mỗi frame trong dòng thời gian (tra cứu O(1))
+        self.row_by_frame = {}
+
+    def _grow(self):
+        # Tăng gấp đôi dung lượng khi số frame vượt quá ước lượng ban đầu
+        capacity = len(self.ears) * 2
+        self.eye_points = np.resize(self.eye_points, (capacity, 12, 2))
+        self.frame_indices = np.resize(self.frame_indices, capacity)
+        self.ears = np.resize(self.ears, capacity)
+
+    def append(self, frame_index, eye_points):
+        """
+        Thêm landmarks mắt của một frame và trả về EAR của frame đó
+
+        Args:
+            frame_index: Chỉ số frame trong video
+            eye_points: Mảng (12, 2) landmarks của 2 mắt
+
+        Returns:
+            Giá trị EAR của frame
+        """
+        if self.count == len(self.ears):
+            self._grow()
+        i = self.count
+        self.eye_points[i] = eye_points
+        self.frame_indices[i] = frame_index
+        ear = float(compute_ear_batch(self.eye_points[i:i + 1])[0])
+        self.ears[i] = ear
+        self.ear_sum += ear
+        self.row_by_frame.setdefault(frame_index, i)
+        self.count += 1
+        return ear
+
+    def ear_for_frame(self, frame_index):
+        """EAR của khuôn mặt đầu tiên trong frame, None nếu frame không có khuôn mặt"""
+        row = self.row_by_frame.get(frame_index)
+        return float(self.ears[row]) if row is not None else None
+
+    def previous_ear(self, frame_index, window=10):
+        """
+        EAR của frame có khuôn mặt gần nhất trước frame_index trong cửa sổ cho trước
+
+        Args:
+            frame_index: Chỉ số frame hiện tại
+            window: Số frame tối đa nhìn lại
+
+        Returns:
+            Giá trị EAR hoặc None nếu không tìm thấy
+        """
+        for i in range(frame_index - 1, max(0, frame_index - window), -1):
+            ear = self.ear_for_frame(i)
+            if ear is not None:
+                return ear
+        return None
+
+    def mean_ear(self, default=0.25):
+        """EAR trung bình hiện tại (tính tăng dần, O(1))"""
+        return self.ear_sum / self.count if self.count > 0 else default
+
+    def compute_ears(self):
+        """Tính lại EAR của toàn bộ dòng thời gian trong một lần vector hóa"""
+        self.ears[:self.count] = compute_ear_batch(self.eye_points[:self.count])
+        return self.ears[:self.count]
+
+    def distribution(self):
+        """
+        Phân tích phân phối EAR
+
+        Returns:
+            Tuple (trung bình 10% EAR thấp nhất, trung bình 50% EAR ở giữa)
+        """
+        sorted_ear_values = np.sort(self.ears[:self.count])
+        n = len(sorted_ear_values)
 
-    # Xóa các file log cũ
-    for file_name in ["ear_values.txt", "blink_frames.txt", "blinks.txt", "liveness_results.txt", "blink_thresholds.txt", "blinks_method2.txt", "blinks_method3.txt"]:
-        log_file = os.path.join(debug_dir, file_name)
-        if os.path.exists(log_file):
-            try:
-                os.remove(log_file)
-                print(f"Đã xóa file log cũ: {log_file}")
-            except Exception as e:
-                print(f"Không thể xóa file log cũ {log_file}: {e}")
+        # Tính phần trăm 10% giá trị EAR thấp nhất
+        lowest_10_percent = sorted_ear_values[:int(n * 0.1)]
+        lowest_10_percent_avg = float(lowest_10_percent.mean()) if len(lowest_10_percent) else 0
 
-    # Ghi log bắt đầu phân tích
-    with open(os.path.join(debug_dir, "analysis_log.txt"), "w", encoding="utf-8") as f:
-        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Bắt đầu phân tích video: {video_path}\n")
+        # Tính phần trăm 50% giá trị EAR trung bình
+        median_values = sorted_ear_values[int(n * 0.25):int(n * 0.75)]
+        median_avg = float(median_values.mean()) if len(median_values) else 0
+
+        return lowest_10_percent_avg, median_avg
+
+    def max_distribution_ratio(self, extra_values):
+        """
+        Cận trên của tỉ lệ (trung bình 10% EAR thấp nhất / trung bình 50% EAR ở giữa) mà
+        distribution() có thể cho sau khi thêm tối đa extra_values giá trị EAR chưa biết
+
+        Thêm nhiều frame mắt mở làm 10% thấp nhất chứa ít frame nháy mắt hơn nên tỉ lệ có thể
+        tăng. Xét các trường hợp thêm j giá trị bằng nhau v, với j từ 0 đến extra_values và v
+        chạy trên các phân vị của EAR hiện có (tính bằng tổng tiền tố, không sắp xếp lại).
+
+        Args:
+            extra_values: Số giá trị EAR tối đa còn có thể được thêm
+
+        Returns:
+            Tỉ lệ lớn nhất (0 nếu không tính được tỉ lệ, như score_liveness)
+        """
+        sorted_ear_values = np.sort(self.ears[:self.count]).astype(np.float64)
+        n = len(sorted_ear_values)
+        if n == 0:
+            return 0.0
+        prefix = np.concatenate(([0.0], np.cumsum(sorted_ear_values)))
+        values = np.unique(np.percentile(sorted_ear_values, np.arange(0, 101, 5)))
+        positions = np.searchsorted(sorted_ear_values, values)
+
+        worst = 0.0
+        for extra in np.unique(np.linspace(0, max(0, extra_values), 11).astype(int)):
+            total = n + extra
+
+            def prefix_sum(t):
+                # Tổng t giá trị nhỏ nhất sau khi chèn extra giá trị v tại vị trí positions
+                return np.where(t <= positions, prefix[min(t, n)],
+                                np.where(t <= positions + extra, prefix[positions] + (t - positions) * values,
+                                         prefix[max(0, t - extra)] + extra * values))
+
+            k, start, end = int(total * 0.1), int(total * 0.25), int(total * 0.75)
+            if k == 0 or end <= start:
+                continue
+            lowest_10_percent_avg = prefix_sum(k) / k
+            median_avg = (prefix_sum(end) - prefix_sum(start)) / (end - start)
+            ratios = np.where(median_avg > 0, lowest_10_percent_avg / np.maximum(median_avg, 1e-12), 0.0)
+            worst = max(worst, float(ratios.max()))
+        return worst
+
+# Các hướng xoay có thể áp dụng cho video (None: không xoay)
+ROTATION_LABELS = {
+    None: "none",
+    cv2.ROTATE_90_CLOCKWISE: "cw",
+    cv2.ROTATE_90_COUNTERCLOCKWISE: "ccw",
+    cv2.ROTATE_180: "180",
+}
+
+def rotate_frame(frame, rotate_code):
+    """Xoay frame theo hướng đã khóa cho video (không làm gì nếu rotate_code là None)"""
+    if rotate_code is None:
+        return frame
+    return cv2.rotate(frame, rotate_code)
+
+def detect_faces(gray, detection_width=0):
+    """
+    Phát hiện khuôn mặt trên ảnh xám đã thu nhỏ và ánh xạ kết quả về độ phân giải gốc
 
-    # Đọc video
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        error_msg = f"Không thể mở video: {video_path}"
-        print(error_msg)
-        with open(os.path.join(debug_dir, "error_log.txt"), "a", encoding="utf-8") as f:
-            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {error_msg}\n")
-        raise Exception(error_msg)
+    Args:
+        gray: Ảnh xám ở độ phân giải gốc
+        detection_width: Chiều rộng ảnh dùng để phát hiện (0: dùng độ phân giải gốc)
 
-    # Lấy thông tin video
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    Returns:
+        Danh sách dlib.rectangle theo tọa độ của ảnh gốc
+    """
+    height, width = gray.shape[:2]
+    if not detection_width or width <= detection_width:
+        return list(face_detector(gray, 0))
+
+    scale = detection_width / float(width)
+    small = cv2.resize(gray, (detection_width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    return [
+        dlib.rectangle(int(face.left() / scale), int(face.top() / scale),
+                       int(face.right() / scale), int(face.bottom() / scale))
+        for face in face_detector(small, 0)
+    ]
+
+def probe_video_orientation(cap, total_frames, debug_dir, samples=5, detection_width=0):
+    """
+    Xác định hướng xoay của video một lần duy nhất
 
-    # Ghi log thông tin video
-    with open(os.path.join(debug_dir, "video_details.txt"), "w", encoding="utf-8") as f:
-        f.write(f"Video path: {video_path}\n")
-        f.write(f"Resolution: {width}x{height}\n")
-        f.write(f"FPS: {fps}\n")
-        f.write(f"Total frames: {total_frames}\n")
-        f.write(f"Duration: {total_frames/fps:.2f} seconds\n")
+    Đọc metadata xoay của video trước. Nếu không có metadata và frame nằm ngang,
+    thử phát hiện khuôn mặt trên một vài frame mẫu ở các hướng khác nhau và chọn
+    hướng phát hiện được nhiều khuôn mặt nhất. Hướng này được khóa cho toàn bộ video.
 
-    # Khởi tạo các biến
-    blink_counter = 0
-    counter = 0
-    total_ear = 0
-    frame_count = 0
-    face_detected_frames = 0
-    rotated_frames_count = 0  # Số frame đã được xoay
+    Args:
+        cap: cv2.VideoCapture đã mở, vị trí đọc được đưa về đầu video sau khi kiểm tra
+        total_frames: Tổng số frame của video
+        debug_dir: Thư mục lưu debug
+        samples: Số frame mẫu dùng để kiểm tra
+        detection_width: Chiều rộng ảnh dùng để phát hiện khuôn mặt
 
-    # Xóa file log xoay cũ nếu có
+    Returns:
+        Mã xoay cv2 hoặc None nếu không cần xoay
+    """
     rotation_log_path = os.path.join(debug_dir, "rotation_log.txt")
-    if os.path.exists(rotation_log_path):
-        try:
-            os.remove(rotation_log_path)
-            print(f"Đã xóa file log xoay cũ: {rotation_log_path}")
-        except Exception as e:
-            print(f"Không thể xóa file log xoay cũ {rotation_log_path}: {e}")
 
-    # Danh sách lưu các frame có khuôn mặt để xử lý
-    face_frames = []
+    # Đọc metadata xoay (OpenCV >= 4.5). Nếu OpenCV đã tự xoay frame thì không cần xoay thêm
+    orientation_meta = int(cap.get(getattr(cv2, 'CAP_PROP_ORIENTATION_META', -1)) or 0)
+    auto_rotated = bool(cap.get(getattr(cv2, 'CAP_PROP_ORIENTATION_AUTO', -1)) or 0)
+    if orientation_meta in (90, 180, 270):
+        rotate_code = None
+        if not auto_rotated:
+            rotate_code = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}[orientation_meta]
+        with open(rotation_log_path, "a", encoding="utf-8") as f:
+            f.write(f"Metadata xoay: {orientation_meta} độ, OpenCV tự xoay: {auto_rotated}, áp dụng: {ROTATION_LABELS[rotate_code]}\n")
+        return rotate_code
+
+    # Lấy các frame mẫu cách đều nhau
+    if total_frames > 0:
+        sample_indices = sorted({int(i * total_frames / (samples + 1)) for i in range(1, samples + 1)})
+    else:
+        sample_indices = list(range(samples))
 
-    # Đọc tất cả các frame
-    frame_index = 0
-    while True:
+    sample_frames = []
+    for index in sample_indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
         ret, frame = cap.read()
-        if not ret:
+        if ret and frame.shape[0] > 0 and frame.shape[1] > 0:
+            sample_frames.append((index, frame))
+
+    # Đưa vị trí đọc về đầu video
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    # Chỉ thử xoay khi frame nằm ngang (chiều rộng > chiều cao)
+    if not sample_frames or sample_frames[0][1].shape[1] <= sample_frames[0][1].shape[0]:
+        return None
+
+    # Đếm số frame mẫu phát hiện được khuôn mặt ở từng hướng
+    scores = {}
+    for rotate_code in (None, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+        scores[rotate_code] = 0
+        for index, frame in sample_frames:
+            gray = rotate_frame(preprocess_frame_gray(frame), rotate_code)
+            if len(detect_faces(gray, detection_width)) > 0:
+                scores[rotate_code] += 1
+
+        # Không cần thử xoay nếu frame gốc đã phát hiện được khuôn mặt
+        if rotate_code is None and scores[None] == len(sample_frames):
             break
 
-        # Kiểm tra kích thước frame
-        if frame.shape[0] == 0 or frame.shape[1] == 0:
-            print(f"Frame {frame_index} có kích thước không hợp lệ: {frame.shape}")
-            frame_index += 1
-            continue
+    best_rotate_code = max(scores, key=lambda code: (scores[code], code is None))
+    if scores[best_rotate_code] <= scores[None]:
+        best_rotate_code = None
+
+    # Lưu frame mẫu gốc và đã xoay để debug
+    with open(rotation_log_path, "a", encoding="utf-8") as f:
+        f.write(f"Kiểm tra hướng trên {len(sample_frames)} frame mẫu: "
+                + ", ".join(f"{ROTATION_LABELS[code]}={count}" for code, count in scores.items())
+                + f", áp dụng: {ROTATION_LABELS[best_rotate_code]}\n")
+    if best_rotate_code is not None:
+        index, frame = sample_frames[0]
+        cv2.imwrite(os.path.join(debug_dir, f"original_frame_{index}.jpg"), frame)
+        cv2.imwrite(os.path.join(debug_dir, f"rotated_frame_{index}.jpg"), rotate_frame(frame, best_rotate_code))
+
+    return best_rotate_code
+
+# Thông báo cho người dùng theo lý do loại nhanh video
+QUICK_REJECT_MESSAGES = {
+    'unreadable': "Không thể đọc video. Vui lòng quay lại video.",
+    'too_short': "Video quá ngắn. Vui lòng quay video dài hơn và nháy mắt tự nhiên.",
+    'too_dark': "Video quá tối. Vui lòng quay lại ở nơi đủ ánh sáng.",
+    'too_bright': "Video quá sáng. Vui lòng tránh nguồn sáng chiếu thẳng vào camera.",
+    'no_face': "Không phát hiện được khuôn mặt trong video. Vui lòng giữ khuôn mặt ở giữa khung hình.",
+    'too_blurry': "Video bị mờ. Vui lòng giữ yên điện thoại và lau sạch camera."
+}
+
+def quick_reject_check(video_path, samples=None, detection_width=None):
+    """
+    Kiểm tra nhanh video trước khi phân tích đầy đủ
 
-        # Tăng kích thước frame để có độ phân giải tốt hơn (nếu cần)
-        if width < 480 or height < 480:
-            frame = cv2.resize(frame, (640, 640))
-
-        # Tiền xử lý frame để cải thiện chất lượng
-        enhanced_frame = preprocess_frame(frame)
-
-        # Chuyển sang ảnh xám
-        gray = cv2.cvtColor(enhanced_frame, cv2.COLOR_BGR2GRAY)
-
-        # Phát hiện khuôn mặt
-        faces = face_detector(gray, 0)
-
-        # Nếu không phát hiện được khuôn mặt, thử xoay frame và phát hiện lại
-        if len(faces) == 0:
-            # Kiểm tra xem frame có bị ngang không (chiều rộng > chiều cao)
-            if enhanced_frame.shape[1] > enhanced_frame.shape[0]:
-                # Thử xoay frame 90 độ theo chiều kim đồng hồ
-                rotated_frame = cv2.rotate(enhanced_frame, cv2.ROTATE_90_CLOCKWISE)
-                rotated_gray = cv2.cvtColor(rotated_frame, cv2.COLOR_BGR2GRAY)
-                rotated_faces = face_detector(rotated_gray, 0)
-
-                # Nếu phát hiện được khuôn mặt sau khi xoay, sử dụng frame đã xoay
-                if len(rotated_faces) > 0:
-                    enhanced_frame = rotated_frame
-                    gray = rotated_gray
-                    faces = rotated_faces
-                    # Lưu frame gốc và frame đã xoay để debug
-                    cv2.imwrite(os.path.join(debug_dir, f"original_frame_{frame_index}.jpg"), frame)
-                    cv2.imwrite(os.path.join(debug_dir, f"rotated_frame_{frame_index}.jpg"), rotated_frame)
-                    with open(os.path.join(debug_dir, "rotation_log.txt"), "a", encoding="utf-8") as f:
-                        f.write(f"Frame {frame_index}: Đã xoay 90 độ CW và phát hiện {len(rotated_faces)} khuôn mặt\n")
-                    rotated_frames_count += 1
-                else:
-                    # Thử xoay frame 90 độ ngược chiều kim đồng hồ
-                    rotated_frame = cv2.rotate(enhanced_frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                    rotated_gray = cv2.cvtColor(rotated_frame, cv2.COLOR_BGR2GRAY)
-                    rotated_faces = face_detector(rotated_gray, 0)
-
-                    # Nếu phát hiện được khuôn mặt sau khi xoay, sử dụng frame đã xoay
-                    if len(rotated_faces) > 0:
-                        enhanced_frame = rotated_frame
-                        gray = rotated_gray
-                        faces = rotated_faces
-                        # Lưu frame gốc và frame đã xoay để debug
-                        cv2.imwrite(os.path.join(debug_dir, f"original_frame_{frame_index}.jpg"), frame)
-                        cv2.imwrite(os.path.join(debug_dir, f"rotated_frame_{frame_index}.jpg"), rotated_frame)
-                        with open(os.path.join(debug_dir, "rotation_log.txt"), "a", encoding="utf-8") as f:
-                            f.write(f"Frame {frame_index}: Đã xoay 90 độ CCW và phát hiện {len(rotated_faces)} khuôn mặt\n")
-                        rotated_frames_count += 1
-
-        # Lưu frame có khuôn mặt để xử lý
-        if len(faces) > 0:
-            face_detected_frames += 1
-            face_frames.append((frame_index, enhanced_frame, gray, faces))
-
-            # Lưu frame để debug (chỉ lưu một số frame)
-            if frame_index % 10 == 0 or len(face_frames) < 10:
-                cv2.imwrite(os.path.join(debug_dir, f"frame_{frame_index}.jpg"), enhanced_frame)
-
-                # Vẽ hình chữ nhật xung quanh khuôn mặt
-                debug_frame = enhanced_frame.copy()
-                for face in faces:
-                    x, y, w, h = face.left(), face.top(), face.width(), face.height()
-                    cv2.rectangle(debug_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                cv2.imwrite(os.path.join(debug_dir, f"face_detected_{frame_index}.jpg"), debug_frame)
-
-        frame_index += 1
-
-        # Hiển thị tiến trình xử lý
-        if frame_index % 30 == 0:
-            print(f"Đã xử lý {frame_index}/{total_frames} frames ({frame_index/total_frames*100:.1f}%)")
-
-    # Đóng video sau khi đọc xong
-    cap.release()
+    Lấy một vài frame cách đều nhau rồi kiểm tra độ sáng, phát hiện khuôn mặt và độ nét
+    (phương sai Laplacian) của vùng khuôn mặt. Khuôn mặt được phát hiện giống hệt pipeline
+    chính (tiền xử lý, phóng to video độ phân giải thấp, detect_faces ở cùng detection_width,
+    thử cả các hướng xoay như probe_video_orientation với frame nằm ngang) nên video mà phân
+    tích đầy đủ phát hiện được khuôn mặt không bị loại vì 'no_face'. Video chỉ bị loại khi
+    đa số frame mẫu quá tối/quá sáng/quá mờ hoặc không frame mẫu nào có khuôn mặt.
 
-    # Ghi log số frame đã xử lý
-    with open(os.path.join(debug_dir, "analysis_log.txt"), "a", encoding="utf-8") as f:
-        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Đã xử lý {frame_index} frames, phát hiện khuôn mặt trong {face_detected_frames} frames\n")
+    Args:
+        video_path: Đường dẫn đến file video
+        samples: Số frame mẫu, mặc định lấy từ Config.LIVENESS_QUICK_REJECT_SAMPLES
+        detection_width: Chiều rộng ảnh dùng để phát hiện khuôn mặt, mặc định lấy từ Config.LIVENESS_DETECTION_WIDTH
 
-    # Nếu không phát hiện đủ frame có khuôn mặt
-    if face_detected_frames < 10:
-        print(f"Chỉ phát hiện được {face_detected_frames} frame có khuôn mặt, không đủ để phân tích")
-        return {
-            'liveness_score': 0.0,
-            'blink_count': 0,
-            'avg_ear': 0.0,
-            'blink_rate': 0.0,
-            'face_detected_frames': face_detected_frames,
-            'rotated_frames_count': rotated_frames_count
+    Returns:
+        Dictionary gồm 'rejected', 'reason' (None nếu đạt), 'message', thông tin video ('video_info')
+        và các số đo của frame mẫu
+    """
+    if samples is None:
+        samples = Config.LIVENESS_QUICK_REJECT_SAMPLES
+    if detection_width is None:
+        detection_width = Config.LIVENESS_DETECTION_WIDTH
+
+    report = {'rejected': False, 'reason': None, 'message': None, 'sampled_frames': 0,
+              'face_frames': 0, 'brightness': [], 'sharpness': [], 'video_info': None}
+
+    def reject(reason):
+        report['rejected'] = True
+        report['reason'] = reason
+        report['message'] = QUICK_REJECT_MESSAGES[reason]
+        return report
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return reject('unreadable')
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        report['video_info'] = {
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps,
+            'frame_count': total_frames,
+            'duration': total_frames / fps if fps > 0 else 0
         }
+        # Phân tích đầy đủ cần ít nhất 10 frame có khuôn mặt
+        if 0 < total_frames < 10:
+            return reject('too_short')
+        if total_frames > 0:
+            sample_indices = sorted({int(i * total_frames / (samples + 1)) for i in range(1, samples + 1)})
+        else:
+            sample_indices = list(range(samples))
+
+        dark = bright = blurry = 0
+        for index in sample_indices:
+            if total_frames > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = cap.read()
+            if not ret or frame.shape[0] == 0 or frame.shape[1] == 0:
+                continue
+            report['sampled_frames'] += 1
+
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            brightness = cv2.mean(gray)[0]
+            report['brightness'].append(round(brightness, 1))
+            if brightness < Config.LIVENESS_QUICK_REJECT_MIN_BRIGHTNESS:
+                dark += 1
+            elif brightness > Config.LIVENESS_QUICK_REJECT_MAX_BRIGHTNESS:
+                bright += 1
+
+            # Phát hiện khuôn mặt giống analyze_frame (tiền xử lý, xoay, phóng to, detect_faces),
+            # thử xoay nếu frame nằm ngang
+            height, width = frame.shape[:2]
+            upscale = width < 480 or height < 480
+            enhanced = preprocess_frame_gray(frame)
+            rotate_codes = (None, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE) if width > height else (None,)
+            for rotate_code in rotate_codes:
+                face_gray = rotate_frame(enhanced, rotate_code)
+                raw_gray = rotate_frame(gray, rotate_code)
+                if upscale:
+                    face_gray = cv2.resize(face_gray, (640, 640))
+                    raw_gray = cv2.resize(raw_gray, (640, 640))
+                faces = detect_faces(face_gray, detection_width)
+                if len(faces) > 0:
+                    break
+            if len(faces) == 0:
+                continue
+            report['face_frames'] += 1
+
+            # Độ nét đo trên vùng khuôn mặt của ảnh xám chưa làm mịn, thu về chiều rộng cố định
+            # để không phụ thuộc độ phân giải của video
+            face = faces[0]
+            top, bottom = max(0, face.top()), min(raw_gray.shape[0], face.bottom())
+            left, right = max(0, face.left()), min(raw_gray.shape[1], face.right())
+            if bottom - top < 8 or right - left < 8:
+                continue
+            face_crop = raw_gray[top:bottom, left:right]
+            face_crop = cv2.resize(face_crop, (128, max(1, int(128 * face_crop.shape[0] / face_crop.shape[1]))),
+                                   interpolation=cv2.INTER_AREA)
+            sharpness = cv2.Laplacian(face_crop, cv2.CV_64F).var()
+            report['sharpness'].append(round(sharpness, 1))
+            if sharpness < Config.LIVENESS_QUICK_REJECT_MIN_SHARPNESS:
+                blurry += 1
+    finally:
+        cap.release()
+
+    sampled = report['sampled_frames']
+    if sampled == 0:
+        return reject('unreadable')
+    if dark * 2 > sampled:
+        return reject('too_dark')
+    if bright * 2 > sampled:
+        return reject('too_bright')
+    if report['face_frames'] == 0:
+        return reject('no_face')
+    if blurry * 2 > len(report['sharpness']) and report['sharpness']:
+        return reject('too_blurry')
+    return report
+
+class FaceTracker:
+    """
+    Theo dõi khuôn mặt giữa các frame để bỏ qua bộ phát hiện HOG của dlib
+
+    Bộ phát hiện chỉ chạy trên keyframe. Ở các frame tiếp theo, vùng khuôn mặt được
+    suy ra từ 68 landmarks của frame trước. Việc phát hiện lại toàn bộ chỉ diễn ra khi
+    độ tin cậy theo dõi giảm hoặc sau một số frame nhất định.
+    """
+
+    # Phần mở rộng của hình chữ nhật bao landmarks (tỉ lệ theo kích thước)
+    MARGIN = 0.1
+    # Giới hạn thay đổi kích thước và độ dịch chuyển tâm giữa 2 frame liên tiếp
+    MIN_SCALE_RATIO = 0.8
+    MAX_SCALE_RATIO = 1.25
+    MAX_CENTER_SHIFT = 0.25
+    # Ngưỡng tương quan giữa vùng khuôn mặt của 2 frame liên tiếp
+    MIN_APPEARANCE_SCORE = 0.6
+    PATCH_SIZE = (64, 64)
+
+    def __init__(self, redetect_interval=15):
+        self.redetect_interval = redetect_interval
+        self.reset()
+
+    def reset(self):
+        """Mất dấu khuôn mặt, frame tiếp theo sẽ chạy bộ phát hiện"""
+        self.prev_shape = None
+        self.prev_patch = None
+        self.frames_since_detect = 0
+
+    def start(self, shape, gray):
+        """Bắt đầu theo dõi từ landmarks của một keyframe đã chạy bộ phát hiện"""
+        self.prev_shape = shape
+        self.prev_patch = self._face_patch(gray, shape)
+        self.frames_since_detect = 0
+
+    @staticmethod
+    def _bounding_box(shape):
+        x_min, y_min = shape.min(axis=0)
+        x_max, y_max = shape.max(axis=0)
+        return x_min, y_min, x_max - x_min, y_max - y_min
+
+    def _face_patch(self, gray, shape):
+        # Cắt vùng khuôn mặt theo landmarks và thu nhỏ về kích thước cố định
+        x, y, w, h = self._bounding_box(shape)
+        x, y = max(0, int(x)), max(0, int(y))
+        patch = gray[y:y + int(h), x:x + int(w)]
+        if patch.size == 0:
+            return None
+        return cv2.resize(patch, self.PATCH_SIZE)
+
+    def predict_rect(self, frame_shape):
+        """
+        Suy ra hình chữ nhật khuôn mặt của frame hiện tại từ landmarks của frame trước
+
+        Args:
+            frame_shape: Kích thước (height, width) của ảnh xám
+
+        Returns:
+            dlib.rectangle hoặc None nếu cần chạy bộ phát hiện
+        """
+        if self.prev_shape is None or self.frames_since_detect >= self.redetect_interval:
+            return None
+
+        x, y, w, h = self._bounding_box(self.prev_shape)
+        if w < 20 or h < 20:
+            return None
+
+        left = max(0, int(x - w * self.MARGIN))
+        top = max(0, int(y - h * self.MARGIN))
+        right = min(frame_shape[1] - 1, int(x + w * (1 + self.MARGIN)))
+        bottom = min(frame_shape[0] - 1, int(y + h * (1 + self.MARGIN)))
+        if right - left < 20 or bottom - top < 20:
+            return None
+
+        return dlib.rectangle(left, top, right, bottom)
+
+    def accept(self, shape, gray):
+        """
+        Kiểm tra độ tin cậy của landmarks tìm được bằng cách theo dõi
+
+        Args:
+            shape: 68 landmarks tính trên hình chữ nhật suy ra
+            gray: Ảnh xám của frame hiện tại
+
+        Returns:
+            True nếu kết quả theo dõi đáng tin cậy, False nếu cần phát hiện lại
+        """
+        _, _, prev_w, prev_h = self._bounding_box(self.prev_shape)
+        x, y, w, h = self._bounding_box(shape)
+        if prev_w <= 0 or prev_h <= 0:
+            return False
+
+        # Kích thước khuôn mặt không được thay đổi đột ngột
+        scale = (w * h) / float(prev_w * prev_h)
+        if not (self.MIN_SCALE_RATIO <= scale <= self.MAX_SCALE_RATIO):
+            return False
+
+        # Tâm khuôn mặt không được dịch chuyển quá xa
+        prev_center = self.prev_shape.mean(axis=0)
+        center = shape.mean(axis=0)
+        if np.linalg.norm(center - prev_center) > self.MAX_CENTER_SHIFT * prev_w:
+            return False
+
+        # Vùng khuôn mặt phải giống với frame trước (landmark predictor luôn trả về
+        # một hình dạng, kể cả khi khuôn mặt đã rời khỏi hình chữ nhật)
+        patch = self._face_patch(gray, shape)
+        if patch is None or self.prev_patch is None:
+            return False
+        score = cv2.matchTemplate(patch, self.prev_patch, cv2.TM_CCOEFF_NORMED)[0][0]
+        if score < self.MIN_APPEARANCE_SCORE:
+            return False
+
+        self.prev_shape = shape
+        self.prev_patch = patch
+        self.frames_since_detect += 1
+        return True
+
+class AdaptiveFrameSampler:
+    """
+    Chính sách lấy mẫu frame cho phân tích liveness
+
+    Video được phân tích ở tốc độ mục tiêu (ví dụ 15 fps) thay vì toàn bộ frame.
+    Khi EAR giảm xuống (có thể đang nháy mắt), các frame lân cận được phân tích
+    đầy đủ để không bỏ lỡ nháy mắt.
+    """
+
+    # EAR thấp hơn tỉ lệ này so với EAR trung bình được coi là dấu hiệu nháy mắt
+    DIP_RATIO = 0.85
+    # Thời gian (giây) phân tích đầy đủ sau mỗi lần EAR giảm
+    DENSE_SECONDS = 0.4
+
+    def __init__(self, fps, sample_fps):
+        if sample_fps and fps > 0 and fps > sample_fps:
+            self.stride = max(1, int(round(fps / sample_fps)))
+        else:
+            self.stride = 1
+        self.dense_frames = max(1, int(round(fps * self.DENSE_SECONDS))) if fps > 0 else 1
+        self.dense_until = -1
+        self.last_analyzed = None
+
+    def should_analyze(self, frame_index):
+        """Kiểm tra xem frame có cần được phân tích không"""
+        if self.stride == 1 or self.last_analyzed is None or frame_index <= self.dense_until:
+            return True
+        return frame_index - self.last_analyzed >= self.stride
+
+    def mark_analyzed(self, frame_index):
+        self.last_analyzed = frame_index
+
+    def observe(self, frame_index, ear, mean_ear):
+        """Chuyển sang phân tích đầy đủ khi EAR giảm đáng kể so với trung bình"""
+        if ear < mean_ear * self.DIP_RATIO:
+            self.dense_until = frame_index + self.dense_frames
+
+def analyze_frame(frame, rotate_code=None, upscale=False, detection_width=0, tracker=None,
+                  buffers=None, reuse_output=False):
+    """
+    Tiền xử lý một frame, phát hiện (hoặc theo dõi) khuôn mặt và tính facial landmarks
 
-    # Khởi tạo các biến cho phân tích nháy mắt
-    blink_counter = 0
-    counter = 0
-    total_ear = 0
-    frame_count = 0
-    global_ear_values = []
+    Hàm không phụ thuộc vào trạng thái nháy mắt nên có thể chạy song song trên nhiều luồng
+    (khi tracker là None).
+
+    Args:
+        frame: Frame BGR đã giải mã
+        rotate_code: Hướng xoay đã khóa cho video
+        upscale: Tăng kích thước frame lên 640x640 (video độ phân giải thấp)
+        detection_width: Chiều rộng ảnh dùng để phát hiện khuôn mặt
+        tracker: FaceTracker dùng cho chế độ theo dõi (None: phát hiện trên mọi frame)
+        buffers: FrameBuffers tái sử dụng cho tiền xử lý (xem preprocess_frame_gray)
+        reuse_output: Ghi ảnh đã tiền xử lý vào bộ đệm đầu ra của buffers
+
+    Returns:
+        Tuple (enhanced_frame, face_shapes, info) với enhanced_frame là ảnh xám đã tiền xử lý,
+        face_shapes là danh sách (face, shape) và info chứa thời gian tiền xử lý/phát hiện/landmarks của frame
+    """
+    info = {'preprocess_time': 0.0, 'detect_time': 0.0, 'detector_runs': 0, 'landmark_time': 0.0,
+            'landmark_runs': 0, 'tracked': False}
+
+    # Tiền xử lý trên ảnh xám (dùng cho cả phát hiện khuôn mặt và landmarks)
+    start_time = time.perf_counter()
+    gray = preprocess_frame_gray(frame, buffers, reuse_output)
+
+    # Xoay ảnh theo hướng đã khóa cho video
+    gray = rotate_frame(gray, rotate_code)
+
+    # Tăng kích thước ảnh để có độ phân giải tốt hơn (nếu cần)
+    if upscale:
+        gray = cv2.resize(gray, (640, 640))
+    info['preprocess_time'] = time.perf_counter() - start_time
+
+    # Danh sách (face, shape) của các khuôn mặt trong frame
+    face_shapes = []
+
+    # Chế độ theo dõi: suy ra khuôn mặt từ landmarks của frame trước
+    if tracker is not None and tracker.prev_shape is not None:
+        rect = tracker.predict_rect(gray.shape)
+        if rect is not None:
+            start_time = time.perf_counter()
+            shape = face_utils.shape_to_np(landmark_predictor(gray, rect))
+            info['landmark_time'] += time.perf_counter() - start_time
+            info['landmark_runs'] += 1
+            if tracker.accept(shape, gray):
+                face_shapes = [(rect, shape)]
+                info['tracked'] = True
+        if not face_shapes:
+            tracker.reset()
+
+    if not face_shapes:
+        # Phát hiện khuôn mặt trên ảnh thu nhỏ
+        start_time = time.perf_counter()
+        faces = detect_faces(gray, detection_width)
+        info['detect_time'] += time.perf_counter() - start_time
+        info['detector_runs'] += 1
+
+        # Tính facial landmarks trên ảnh độ phân giải gốc
+        start_time = time.perf_counter()
+        face_shapes = [(face, face_utils.shape_to_np(landmark_predictor(gray, face))) for face in faces]
+        info['landmark_time'] += time.perf_counter() - start_time
+        info['landmark_runs'] += len(faces)
+
+        if tracker is not None and face_shapes:
+            tracker.start(face_shapes[0][1], gray)
+
+    return gray, face_shapes, info
+
+class SequentialFrameSource:
+    """
+    Nguồn frame tuần tự: giải mã và phân tích từng frame trên luồng hiện tại
+
+    Khi duyệt, trả về lần lượt (frame_index, enhanced_frame, face_shapes, info)
+    theo đúng thứ tự frame trong video.
+    """
+
+    def __init__(self, cap, sampler, rotate_code=None, upscale=False, detection_width=0, tracker=None,
+                 start_frame=0, end_frame=None):
+        self.cap = cap
+        self.sampler = sampler
+        self.rotate_code = rotate_code
+        self.upscale = upscale
+        self.detection_width = detection_width
+        self.tracker = tracker
+        # Đoạn frame cần đọc [start_frame, end_frame), vị trí đọc của cap phải ở start_frame
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        # Số frame đã đọc từ video (kể cả các frame bỏ qua khi lấy mẫu)
+        self.frames_read = 0
+        # Bộ đệm tiền xử lý: frame trước đã được xử lý xong khi frame sau được đọc
+        self.buffers = FrameBuffers()
+
+    def read_frames(self):
+        """
+        Đọc các frame cần phân tích theo chính sách lấy mẫu, trả về (frame_index, frame, decode_time)
+        với decode_time là thời gian đọc frame, kể cả các frame bỏ qua ngay trước nó
+        """
+        frame_index = self.start_frame
+        decode_time = 0.0
+        while self.end_frame is None or frame_index < self.end_frame:
+            # Bỏ qua frame không cần phân tích (chỉ grab, không giải mã sang ảnh)
+            if not self.sampler.should_analyze(frame_index):
+                start_time = time.perf_counter()
+                grabbed = self.cap.grab()
+                decode_time += time.perf_counter() - start_time
+                if not grabbed:
+                    break
+                frame_index += 1
+                self.frames_read = frame_index - self.start_frame
+                continue
+
+            start_time = time.perf_counter()
+            ret, frame = self.cap.read()
+            decode_time += time.perf_counter() - start_time
+            if not ret:
+                break
+            frame_index += 1
+            self.frames_read = frame_index - self.start_frame
+
+            # Kiểm tra kích thước frame
+            if frame.shape[0] == 0 or frame.shape[1] == 0:
+                print(f"Frame {frame_index - 1} có kích thước không hợp lệ: {frame.shape}")
+                continue
+
+            self.sampler.mark_analyzed(frame_index - 1)
+            yield frame_index - 1, frame, decode_time
+            decode_time = 0.0
+
+    def _analyze(self, frame, tracker, buffers, reuse_output):
+        return analyze_frame(frame, self.rotate_code, self.upscale, self.detection_width, tracker,
+                             buffers, reuse_output)
+
+    def __iter__(self):
+        for frame_index, frame, decode_time in self.read_frames():
+            enhanced_frame, face_shapes, info = self._analyze(frame, self.tracker, self.buffers, True)
+            info['decode_time'] = decode_time
+            yield frame_index, enhanced_frame, face_shapes, info
+
+class PipelinedFrameSource(SequentialFrameSource):
+    """
+    Nguồn frame theo pipeline: một luồng giải mã đưa frame qua hàng đợi có giới hạn
+    tới nhiều luồng xử lý (tiền xử lý, phát hiện khuôn mặt, landmarks)
+
+    OpenCV giải phóng GIL trong mã native nên một yêu cầu liveness có thể dùng nhiều
+    nhân CPU. Kết quả được sắp xếp lại theo thứ tự frame trước khi trả về, bộ nhớ
+    bị giới hạn bởi kích thước hàng đợi. Chế độ theo dõi khuôn mặt không được dùng
+    vì mỗi frame phụ thuộc vào frame trước. Luồng giải mã gọi sampler.should_analyze trước
+    khi kết quả của các frame trong hàng đợi được quan sát, nên sampler cần phân tích toàn bộ
+    frame (xem detect_blinks).
+    """
+
+    def __init__(self, cap, sampler, rotate_code=None, upscale=False, detection_width=0, workers=2, queue_size=8):
+        super().__init__(cap, sampler, rotate_code, upscale, detection_width, tracker=None)
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+    @staticmethod
+    def _put(q, item, stop_event):
+        # Đưa phần tử vào hàng đợi, dừng lại nếu pipeline bị hủy
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(q, stop_event):
+        # Lấy phần tử từ hàng đợi, trả về None nếu pipeline bị hủy
+        while not stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def __iter__(self):
+        stop_event = threading.Event()
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+
+        def decode():
+            try:
+                for sequence, (frame_index, frame, decode_time) in enumerate(self.read_frames()):
+                    if not self._put(frame_queue, (sequence, frame_index, frame, decode_time), stop_event):
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # Báo cho các luồng xử lý rằng video đã hết
+                for _ in range(self.workers):
+                    self._put(frame_queue, None, stop_event)
+
+        def work():
+            # Bộ đệm trung gian riêng cho mỗi luồng, ảnh đầu ra được cấp phát mới
+            # vì frame còn nằm trong hàng đợi khi luồng xử lý frame tiếp theo
+            buffers = FrameBuffers()
+            while True:
+                item = self._get(frame_queue, stop_event)
+                if item is None:
+                    self._put(result_queue, None, stop_event)
+                    return
+                sequence, frame_index, frame, decode_time = item
+                try:
+                    result = self._analyze(frame, None, buffers, False)
+                    result[2]['decode_time'] = decode_time
+                except Exception as e:
+                    errors.append(e)
+                    stop_event.set()
+                    return
+                if not self._put(result_queue, (sequence, frame_index, result), stop_event):
+                    return
+
+        threads = [threading.Thread(target=decode, daemon=True)]
+        threads += [threading.Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Sắp xếp lại kết quả theo thứ tự frame để giữ đúng dòng thời gian EAR
+            pending = {}
+            next_sequence = 0
+            finished_workers = 0
+            while True:
+                if next_sequence in pending:
+                    frame_index, (enhanced_frame, face_shapes, info) = pending.pop(next_sequence)
+                    next_sequence += 1
+                    yield frame_index, enhanced_frame, face_shapes, info
+                    continue
+
+                if finished_workers == self.workers or errors:
+                    break
+
+                item = self._get(result_queue, stop_event)
+                if item is None:
+                    finished_workers += 1
+                    continue
+                sequence, frame_index, result = item
+                pending[sequence] = (frame_index, result)
+        finally:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+# Pool tiến trình dùng chung cho backend đa tiến trình, được tạo một lần và tái sử dụng
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+def _init_process_worker():
+    """Khởi tạo tiến trình con: bộ phát hiện khuôn mặt và landmark predictor đã được nạp khi import module"""
+    print(f"Tiến trình liveness {os.getpid()} đã sẵn sàng (detector: {face_detector_backend}, predictor: {predictor_path})")
+
+def get_liveness_process_pool(workers):
+    """
+    Lấy hoặc khởi tạo pool tiến trình cho phân tích liveness
+
+    Các tiến trình được khởi tạo bằng 'spawn' và nạp mô hình dlib một lần duy nhất,
+    sau đó được tái sử dụng cho mọi yêu cầu.
+
+    Args:
+        workers: Số tiến trình
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor
+    """
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            _process_pool = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_process_worker)
+            _process_pool_workers = workers
+        return _process_pool
+
+def set_face_detector(backend):
+    """
+    Đổi backend phát hiện khuôn mặt trong khi chạy (dùng cho benchmark)
+
+    Biến môi trường LIVENESS_FACE_DETECTOR cũng được cập nhật và pool tiến trình hiện có
+    bị đóng, để các tiến trình con ('spawn') khởi tạo lại với backend mới.
+
+    Args:
+        backend: Tên backend (xem utils.face_detectors.FACE_DETECTOR_BACKENDS)
+    """
+    global face_detector, face_detector_backend, _process_pool
+    detector = create_face_detector(backend)
+    with _process_pool_lock:
+        face_detector, face_detector_backend = detector, backend
+        Config.LIVENESS_FACE_DETECTOR = backend
+        os.environ['LIVENESS_FACE_DETECTOR'] = backend
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True)
+            _process_pool = None
+
+def _analyze_frame_range(video_path, start_frame, end_frame, fps, sample_fps, rotate_code, upscale,
+                         detection_width, face_tracking):
+    """
+    Phân tích một đoạn frame của video trong tiến trình con
+
+    Returns:
+        Tuple (observations, frames_read) với observations là danh sách
+        (frame_index, shapes, info) theo thứ tự frame
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception(f"Không thể mở video: {video_path}")
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        sampler = AdaptiveFrameSampler(fps, sample_fps)
+        tracker = FaceTracker(Config.LIVENESS_REDETECT_INTERVAL) if face_tracking else None
+        source = SequentialFrameSource(cap, sampler, rotate_code, upscale, detection_width, tracker,
+                                       start_frame=start_frame, end_frame=end_frame)
+
+        # Dòng thời gian cục bộ chỉ dùng cho chính sách lấy mẫu trong đoạn
+        timeline = EarTimeline(end_frame - start_frame)
+        observations = []
+        for frame_index, _, face_shapes, info in source:
+            shapes = [shape.astype(np.int32) for _, shape in face_shapes]
+            for shape in shapes:
+                ear = timeline.append(frame_index, eye_points_from_shape(shape))
+                sampler.observe(frame_index, ear, timeline.mean_ear())
+            observations.append((frame_index, shapes, info))
+        return observations, source.frames_read
+    finally:
+        cap.release()
+
+class ProcessPoolFrameSource:
+    """
+    Nguồn frame đa tiến trình: video được chia thành các đoạn frame, mỗi tiến trình
+    trong pool tự giải mã và phân tích đoạn của mình
+
+    Frame không được truyền giữa các tiến trình, chỉ có landmarks được trả về.
+    Kết quả của các đoạn được ghép lại theo thứ tự frame. Frame đã tiền xử lý
+    không có ở tiến trình chính nên các ảnh debug không được lưu.
+    """
+
+    def __init__(self, video_path, total_frames, fps, sample_fps, rotate_code=None, upscale=False,
+                 detection_width=0, face_tracking=False, workers=2):
+        self.video_path = video_path
+        self.total_frames = total_frames
+        self.fps = fps
+        self.sample_fps = sample_fps
+        self.rotate_code = rotate_code
+        self.upscale = upscale
+        self.detection_width = detection_width
+        self.face_tracking = face_tracking
+        self.workers = max(1, workers)
+        self.frames_read = 0
+
+    def frame_ranges(self):
+        """Chia video thành các đoạn frame liên tiếp (2 đoạn cho mỗi tiến trình để cân bằng tải)"""
+        chunks = min(self.total_frames, self.workers * 2)
+        bounds = [int(i * self.total_frames / chunks) for i in range(chunks + 1)]
+        return [(bounds[i], bounds[i + 1]) for i in range(chunks) if bounds[i] < bounds[i + 1]]
+
+    def __iter__(self):
+        pool = get_liveness_process_pool(self.workers)
+        futures = [
+            pool.submit(_analyze_frame_range, self.video_path, start_frame, end_frame, self.fps, self.sample_fps,
+                        self.rotate_code, self.upscale, self.detection_width, self.face_tracking)
+            for start_frame, end_frame in self.frame_ranges()
+        ]
+        try:
+            for future in futures:
+                observations, frames_read = future.result()
+                self.frames_read += frames_read
+                for frame_index, shapes, info in observations:
+                    yield frame_index, None, [(None, shape) for shape in shapes], info
+        finally:
+            # Hủy các đoạn chưa chạy khi dừng sớm hoặc có lỗi
+            for future in futures:
+                future.cancel()
+
+class BlinkStateMachine:
+    """
+    Máy trạng thái phát hiện nháy mắt, được cập nhật lần lượt từng frame
+    """
 
     # Các tham số cho thuật toán phát hiện nháy mắt
     EYE_AR_THRESH = 0.13  # Ngưỡng tỉ lệ khung mắt để phát hiện nháy mắt (giảm xuống để nghiêm ngặt hơn)
     EYE_AR_CONSEC_FRAMES = 2  # Số frame liên tiếp cần thiết để xác định nháy mắt (tăng lên để chính xác hơn)
 
-    # Xử lý các frame có khuôn mặt để phát hiện nháy mắt
-    for frame_index, enhanced_frame, gray, faces in face_frames:
-        for face in faces:
-            # Phát hiện facial landmarks
-            shape = landmark_predictor(gray, face)
-            shape = face_utils.shape_to_np(shape)
-
-            # Lấy tọa độ của mắt
-            (lStart, lEnd) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
-            (rStart, rEnd) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
-            leftEye = shape[lStart:lEnd]
-            rightEye = shape[rStart:rEnd]
-
-            # Tính EAR cho cả 2 mắt
-            leftEAR = eye_aspect_ratio(leftEye)
-            rightEAR = eye_aspect_ratio(rightEye)
-            ear = (leftEAR + rightEAR) / 2.0
-
-            # Lưu debug thông tin EAR
-            if frame_index % 5 == 0:
-                # Vẽ đường viền mắt để debug
-                leftEyeHull = cv2.convexHull(leftEye)
-                rightEyeHull = cv2.convexHull(rightEye)
-                debug_frame = enhanced_frame.copy()
-                cv2.drawContours(debug_frame, [leftEyeHull], -1, (0, 255, 0), 1)
-                cv2.drawContours(debug_frame, [rightEyeHull], -1, (0, 255, 0), 1)
-
-                # Hiển thị giá trị EAR
-                cv2.putText(debug_frame, f"EAR: {ear:.2f}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-                # Lưu frame đã được chỉnh sửa
-                cv2.imwrite(os.path.join(debug_dir, f"eye_frame_{frame_index}.jpg"), debug_frame)
-
-            total_ear += ear
-            frame_count += 1
-
-            # Lưu tất cả giá trị EAR để debug
-            with open(os.path.join(debug_dir, "ear_values.txt"), "a", encoding="utf-8") as f:
-                f.write(f"Frame {frame_index}: EAR = {ear:.4f}\n")
-
-            # Lưu giá trị EAR vào danh sách toàn cục
-            global_ear_values.append(ear)
-
-            # Tính EAR trung bình hiện tại
-            current_avg_ear = sum(global_ear_values) / len(global_ear_values) if global_ear_values else 0.25
-
-            # Phương pháp 1: Phát hiện nháy mắt khi EAR nhỏ hơn ngưỡng
-            if ear < EYE_AR_THRESH:
-                counter += 1
-                # Lưu frame khi phát hiện mắt nhắm
-                cv2.imwrite(os.path.join(debug_dir, f"blink_detected_{frame_index}.jpg"), enhanced_frame)
-                with open(os.path.join(debug_dir, "blink_frames.txt"), "a", encoding="utf-8") as f:
-                    f.write(f"Blink detected at frame {frame_index}: EAR = {ear:.4f}\n")
-            else:
-                # Nếu đã phát hiện mắt nhắm trong ít nhất 1 frame, coi như đã nháy mắt
-                if counter >= EYE_AR_CONSEC_FRAMES:
-                    blink_counter += 1
-                    # Lưu thông tin về nháy mắt được phát hiện
-                    with open(os.path.join(debug_dir, "blinks.txt"), "a", encoding="utf-8") as f:
-                        f.write(f"Blink #{blink_counter} detected at frame {frame_index}, lasted for {counter} frames\n")
-                counter = 0
-
-            # Phương pháp 2: Phát hiện nháy mắt khi EAR thấp hơn trung bình đáng kể
-            # Tăng độ nghiêm ngặt của phương pháp 2
-            if ear < current_avg_ear * 0.7 and ear < 0.18:  # Giảm ngưỡng xuống để nghiêm ngặt hơn
-                # Phát hiện nháy mắt bằng phương pháp thứ hai
-                with open(os.path.join(debug_dir, "blinks_method2.txt"), "a", encoding="utf-8") as f:
-                    f.write(f"Potential blink detected at frame {frame_index} using method 2: ear={ear:.4f}, avg_ear={current_avg_ear:.4f}\n")
-
-                # Chỉ tăng bộ đếm nếu chưa phát hiện bằng phương pháp khác và có ít nhất 3 frame đã được xử lý
+    def __init__(self, debug_dir, timeline, eye_ar_thresh=None, eye_ar_consec_frames=None):
+        # Thư mục lưu log debug (None: không ghi log, dùng khi tính lại điểm từ dòng thời gian đã lưu)
+        self.debug_dir = debug_dir
+        # Dòng thời gian EAR dùng chung để tính EAR trung bình
+        self.timeline = timeline
+        self.eye_ar_thresh = self.EYE_AR_THRESH if eye_ar_thresh is None else eye_ar_thresh
+        self.eye_ar_consec_frames = self.EYE_AR_CONSEC_FRAMES if eye_ar_consec_frames is None else eye_ar_consec_frames
+        self.blink_counter = 0
+        self.counter = 0
+
+    def _log(self, file_name, message):
+        if self.debug_dir is None:
+            return
+        with open(os.path.join(self.debug_dir, file_name), "a", encoding="utf-8") as f:
+            f.write(message + "\n")
+
+    def update(self, frame_index, ear, prev_ear, enhanced_frame, total_frames):
+        """
+        Cập nhật trạng thái với giá trị EAR của một khuôn mặt trong frame
+
+        Args:
+            frame_index: Chỉ số frame trong video
+            ear: Giá trị EAR của frame hiện tại (đã được thêm vào dòng thời gian)
+            prev_ear: Giá trị EAR của frame có khuôn mặt gần nhất trước đó (None nếu không có)
+            enhanced_frame: Frame đã tiền xử lý (dùng để lưu debug, None nếu không có)
+            total_frames: Tổng số frame của video
+        """
+        frame_count = self.timeline.count
+
+        # Lưu tất cả giá trị EAR để debug
+        self._log("ear_values.txt", f"Frame {frame_index}: EAR = {ear:.4f}")
+
+        # Tính EAR trung bình hiện tại
+        current_avg_ear = self.timeline.mean_ear()
+
+        # Phương pháp 1: Phát hiện nháy mắt khi EAR nhỏ hơn ngưỡng
+        if ear < self.eye_ar_thresh:
+            self.counter += 1
+            # Lưu frame khi phát hiện mắt nhắm
+            if enhanced_frame is not None and self.debug_dir is not None:
+                cv2.imwrite(os.path.join(self.debug_dir, f"blink_detected_{frame_index}.jpg"), enhanced_frame)
+            self._log("blink_frames.txt", f"Blink detected at frame {frame_index}: EAR = {ear:.4f}")
+        else:
+            # Nếu đã phát hiện mắt nhắm trong ít nhất 1 frame, coi như đã nháy mắt
+            if self.counter >= self.eye_ar_consec_frames:
+                self.blink_counter += 1
+                # Lưu thông tin về nháy mắt được phát hiện
+                self._log("blinks.txt", f"Blink #{self.blink_counter} detected at frame {frame_index}, lasted for {self.counter} frames")
+            self.counter = 0
+
+        # Phương pháp 2: Phát hiện nháy mắt khi EAR thấp hơn trung bình đáng kể
+        # Tăng độ nghiêm ngặt của phương pháp 2
+        if ear < current_avg_ear * 0.7 and ear < 0.18:  # Giảm ngưỡng xuống để nghiêm ngặt hơn
+            # Phát hiện nháy mắt bằng phương pháp thứ hai
+            self._log("blinks_method2.txt", f"Potential blink detected at frame {frame_index} using method 2: ear={ear:.4f}, avg_ear={current_avg_ear:.4f}")
+
+            # Chỉ tăng bộ đếm nếu chưa phát hiện bằng phương pháp khác và có ít nhất 3 frame đã được xử lý
+            # Điều này giúp tránh phát hiện sai ở đầu video khi chưa có đủ dữ liệu
+            if self.counter == 0 and self.blink_counter == 0 and frame_count > 10:
+                self.blink_counter += 1
+                self._log("blinks.txt", f"Blink #{self.blink_counter} detected at frame {frame_index} using method 2")
+
+        # Phương pháp 3: Phát hiện sự thay đổi đột ngột của EAR
+        # Bỏ qua frame đầu và frame cuối của video
+        if frame_index > 0 and frame_index < total_frames - 1:
+            # Nếu có sự thay đổi đột ngột của EAR (giảm rồi tăng), có thể là nháy mắt
+            # Tăng ngưỡng thay đổi EAR để nghiêm ngặt hơn
+            if prev_ear is not None and prev_ear - ear > 0.05 and ear < 0.15:
+                # Phát hiện nháy mắt bằng phương pháp thứ ba
+                self._log("blinks_method3.txt", f"Potential blink detected at frame {frame_index} using method 3: prev_ear={prev_ear:.4f}, current_ear={ear:.4f}")
+
+                # Chỉ tăng bộ đếm nếu chưa phát hiện bằng phương pháp khác và có ít nhất 10 frame đã được xử lý
                 # Điều này giúp tránh phát hiện sai ở đầu video khi chưa có đủ dữ liệu
-                if counter == 0 and blink_counter == 0 and frame_count > 10:
-                    blink_counter += 1
-                    with open(os.path.join(debug_dir, "blinks.txt"), "a", encoding="utf-8") as f:
-                        f.write(f"Blink #{blink_counter} detected at frame {frame_index} using method 2\n")
-
-            # Phương pháp 3: Phát hiện sự thay đổi đột ngột của EAR
-            if frame_index > 0 and frame_index < len(face_frames) - 1:
-                # Lấy giá trị EAR của frame trước nếu có
-                prev_ear = None
-
-                # Tìm frame trước có khuôn mặt
-                for i in range(frame_index-1, max(0, frame_index-10), -1):
-                    if i in [f[0] for f in face_frames]:
-                        # Tính EAR cho frame trước
-                        prev_frame = next((f for f in face_frames if f[0] == i), None)
-                        if prev_frame:
-                            prev_shape = landmark_predictor(prev_frame[2], prev_frame[3][0])
-                            prev_shape = face_utils.shape_to_np(prev_shape)
-                            prev_left_eye = prev_shape[lStart:lEnd]
-                            prev_right_eye = prev_shape[rStart:rEnd]
-                            prev_left_ear = eye_aspect_ratio(prev_left_eye)
-                            prev_right_ear = eye_aspect_ratio(prev_right_eye)
-                            prev_ear = (prev_left_ear + prev_right_ear) / 2.0
-                            break
-
-                # Nếu có sự thay đổi đột ngột của EAR (giảm rồi tăng), có thể là nháy mắt
-                # Tăng ngưỡng thay đổi EAR để nghiêm ngặt hơn
-                if prev_ear is not None and prev_ear - ear > 0.05 and ear < 0.15:
-                    # Phát hiện nháy mắt bằng phương pháp thứ ba
-                    with open(os.path.join(debug_dir, "blinks_method3.txt"), "a", encoding="utf-8") as f:
-                        f.write(f"Potential blink detected at frame {frame_index} using method 3: prev_ear={prev_ear:.4f}, current_ear={ear:.4f}\n")
-
-                    # Chỉ tăng bộ đếm nếu chưa phát hiện bằng phương pháp khác và có ít nhất 10 frame đã được xử lý
-                    # Điều này giúp tránh phát hiện sai ở đầu video khi chưa có đủ dữ liệu
-                    if counter == 0 and blink_counter == 0 and frame_count > 15:
-                        # Kiểm tra thêm: EAR phải thấp hơn đáng kể so với trung bình
-                        if ear < current_avg_ear * 0.7:
-                            blink_counter += 1
-                            with open(os.path.join(debug_dir, "blinks.txt"), "a", encoding="utf-8") as f:
-                                f.write(f"Blink #{blink_counter} detected at frame {frame_index} using method 3\n")
+                if self.counter == 0 and self.blink_counter == 0 and frame_count > 15:
+                    # Kiểm tra thêm: EAR phải thấp hơn đáng kể so với trung bình
+                    if ear < current_avg_ear * 0.7:
+                        self.blink_counter += 1
+                        self._log("blinks.txt", f"Blink #{self.blink_counter} detected at frame {frame_index} using method 3")
+
+# Tham số mặc định của thuật toán nháy mắt và tính điểm liveness, có thể ghi đè khi
+# tính lại điểm từ dòng thời gian đã lưu (xem rescore_timeline)
+DEFAULT_SCORING_PARAMS = {
+    'eye_ar_thresh': BlinkStateMachine.EYE_AR_THRESH,
+    'eye_ar_consec_frames': BlinkStateMachine.EYE_AR_CONSEC_FRAMES,
+    'min_blinks': 3,  # Số lần nháy mắt tối thiểu để đạt điểm nháy mắt tối đa
+    'uniform_ear_ratio': 0.85,  # Tỉ lệ EAR (10% thấp nhất / 50% giữa) tối đa trước khi coi là không nháy mắt thực sự
+    'blink_weight': 0.7,
+    'ear_weight': 0.1,
+    'rate_weight': 0.1,
+    'face_weight': 0.1
+}
+
+def scoring_params(overrides=None):
+    """
+    Tham số tính điểm với các giá trị ghi đè
 
-    # Tính điểm số liveness
-    avg_ear = total_ear / frame_count if frame_count > 0 else 0
-    duration = total_frames / fps if fps > 0 else 0
+    Args:
+        overrides: Dictionary các tham số cần ghi đè (khóa phải có trong DEFAULT_SCORING_PARAMS)
+
+    Returns:
+        Dictionary tham số đầy đủ
+    """
+    params = dict(DEFAULT_SCORING_PARAMS)
+    for key, value in (overrides or {}).items():
+        if key not in params:
+            raise ValueError(f"Tham số tính điểm không hợp lệ: {key}")
+        params[key] = type(params[key])(value)
+    return params
+
+# Điều kiện dừng sớm: số frame có khuôn mặt tối thiểu, tỉ lệ phát hiện khuôn mặt tối thiểu
+# và cận trên của tỉ lệ EAR (10% thấp nhất / 50% giữa) tối đa, có khoảng an toàn so với
+# ngưỡng 0.85 của bước kiểm tra phân phối EAR để kết quả không thay đổi khi phân tích thêm frame
+EARLY_EXIT_MIN_FACE_FRAMES = 30
+EARLY_EXIT_MIN_FACE_RATIO = 0.8
+EARLY_EXIT_MAX_EAR_RATIO = 0.75
+
+def can_stop_early(state, timeline, face_detected_frames, analyzed_frames, remaining_frames):
+    """
+    Kiểm tra xem kết quả đạt/không đạt đã ổn định để dừng phân tích sớm chưa
+
+    Số lần nháy mắt chỉ tăng khi phân tích thêm frame và điểm số liveness luôn
+    ít nhất 0.9 khi có nháy mắt, nên chỉ còn bước kiểm tra phân phối EAR có thể
+    thay đổi kết quả. Bước này được kiểm tra trên cận trên của tỉ lệ EAR mà các frame
+    còn lại có thể tạo ra (xem EarTimeline.max_distribution_ratio), với khoảng an toàn.
+
+    Args:
+        state: BlinkStateMachine hiện tại
+        timeline: EarTimeline hiện tại
+        face_detected_frames: Số frame đã phát hiện khuôn mặt
+        analyzed_frames: Số frame đã phân tích
+        remaining_frames: Số frame chưa đọc của video (None: chưa biết, không dừng sớm)
+
+    Returns:
+        True nếu có thể dừng phân tích
+    """
+    if state.blink_counter < max(1, Config.MIN_BLINK_COUNT) or Config.MIN_LIVENESS_SCORE >= 0.9:
+        return False
+    if face_detected_frames < EARLY_EXIT_MIN_FACE_FRAMES:
+        return False
+    if face_detected_frames / float(analyzed_frames) < EARLY_EXIT_MIN_FACE_RATIO:
+        return False
+
+    if remaining_frames is None:
+        return False
+
+    # Số giá trị EAR các frame còn lại có thể thêm (theo số khuôn mặt trung bình của frame có khuôn mặt)
+    ears_per_frame = timeline.count / float(face_detected_frames)
+    extra_values = int(np.ceil(max(0, remaining_frames) * ears_per_frame))
+    return timeline.max_distribution_ratio(extra_values) < EARLY_EXIT_MAX_EAR_RATIO
+
+def score_liveness(blink_counter, timeline, face_detected_frames, analyzed_frames, total_frames, duration_frames,
+                   fps, debug_dir=None, params=None):
+    """
+    Tính điểm số liveness từ số lần nháy mắt và dòng thời gian EAR
+
+    Args:
+        blink_counter: Số lần nháy mắt từ máy trạng thái
+        timeline: EarTimeline của video
+        face_detected_frames: Số frame đã phát hiện khuôn mặt
+        analyzed_frames: Số frame đã phân tích
+        total_frames: Tổng số frame của video
+        duration_frames: Số frame dùng để tính thời lượng (số frame đã đọc khi dừng sớm)
+        fps: FPS của video
+        debug_dir: Thư mục lưu log debug (None: không ghi log)
+        params: Tham số tính điểm (xem scoring_params), mặc định DEFAULT_SCORING_PARAMS
+
+    Returns:
+        Dictionary chứa số lần nháy mắt sau kiểm tra chéo, EAR trung bình, tần suất nháy mắt,
+        tỉ lệ phát hiện khuôn mặt, các điểm thành phần và điểm số liveness
+    """
+    if params is None:
+        params = DEFAULT_SCORING_PARAMS
+
+    # Tính lại EAR của toàn bộ video trong một lần vector hóa
+    ear_values = timeline.compute_ears()
+    avg_ear = float(ear_values.mean()) if len(ear_values) > 0 else 0
+    # Khi dừng sớm, chỉ tính thời lượng đoạn video đã phân tích
+    duration = duration_frames / fps if fps > 0 else 0
     blink_rate = blink_counter / duration if duration > 0 else 0
 
     # Thêm bước kiểm tra chéo để xác nhận nháy mắt thực sự
     # Phân tích phân phối EAR để phát hiện nháy mắt thực sự
-    if len(global_ear_values) > 10:
-        # Sắp xếp các giá trị EAR
-        sorted_ear_values = sorted(global_ear_values)
-
-        # Tính phần trăm 10% giá trị EAR thấp nhất
-        lowest_10_percent = sorted_ear_values[:int(len(sorted_ear_values) * 0.1)]
-        lowest_10_percent_avg = sum(lowest_10_percent) / len(lowest_10_percent) if lowest_10_percent else 0
-
-        # Tính phần trăm 50% giá trị EAR trung bình
-        median_values = sorted_ear_values[int(len(sorted_ear_values) * 0.25):int(len(sorted_ear_values) * 0.75)]
-        median_avg = sum(median_values) / len(median_values) if median_values else 0
+    if len(ear_values) > 10:
+        lowest_10_percent_avg, median_avg = timeline.distribution()
 
         # Ghi log phân tích phân phối EAR
-        with open(os.path.join(debug_dir, "ear_distribution.txt"), "w", encoding="utf-8") as f:
-            f.write(f"Lowest 10% EAR average: {lowest_10_percent_avg:.4f}\n")
-            f.write(f"Median 50% EAR average: {median_avg:.4f}\n")
-            f.write(f"Ratio (lowest/median): {lowest_10_percent_avg/median_avg if median_avg > 0 else 0:.4f}\n")
+        if debug_dir is not None:
+            with open(os.path.join(debug_dir, "ear_distribution.txt"), "w", encoding="utf-8") as f:
+                f.write(f"Lowest 10% EAR average: {lowest_10_percent_avg:.4f}\n")
+                f.write(f"Median 50% EAR average: {median_avg:.4f}\n")
+                f.write(f"Ratio (lowest/median): {lowest_10_percent_avg/median_avg if median_avg > 0 else 0:.4f}\n")
 
         # Nếu tỉ lệ giữa giá trị thấp nhất và trung bình quá cao (> 0.85),
         # có thể không có nháy mắt thực sự (không có sự khác biệt đáng kể giữa các giá trị EAR)
-        if lowest_10_percent_avg / median_avg > 0.85 and blink_counter > 0:
+        if median_avg > 0 and lowest_10_percent_avg / median_avg > params['uniform_ear_ratio'] and blink_counter > 0:
             # Ghi log cảnh báo
-            with open(os.path.join(debug_dir, "blink_verification.txt"), "w", encoding="utf-8") as f:
-                f.write("Cảnh báo: Có thể không có nháy mắt thực sự. Phân phối EAR quá đồng đều.\n")
-                f.write(f"Blink count trước khi điều chỉnh: {blink_counter}\n")
+            if debug_dir is not None:
+                with open(os.path.join(debug_dir, "blink_verification.txt"), "w", encoding="utf-8") as f:
+                    f.write("Cảnh báo: Có thể không có nháy mắt thực sự. Phân phối EAR quá đồng đều.\n")
+                    f.write(f"Blink count trước khi điều chỉnh: {blink_counter}\n")
 
             # Giảm số lần nháy mắt xuống 0 hoặc 1 tùy thuộc vào số lần đã phát hiện
             if blink_counter > 3:
@@ -365,21 +1191,22 @@ def detect_blinks(video_path):
             else:
                 blink_counter = 0  # Không có nháy mắt nếu chỉ phát hiện ít lần
 
-            with open(os.path.join(debug_dir, "blink_verification.txt"), "a", encoding="utf-8") as f:
-                f.write(f"Blink count sau khi điều chỉnh: {blink_counter}\n")
+            if debug_dir is not None:
+                with open(os.path.join(debug_dir, "blink_verification.txt"), "a", encoding="utf-8") as f:
+                    f.write(f"Blink count sau khi điều chỉnh: {blink_counter}\n")
 
-    
-    min_blinks = 3  
-    max_blinks = 20  
+    min_blinks = params['min_blinks']
+    max_blinks = 20
 
     # Ghi log ngưỡng nháy mắt
-    with open(os.path.join(debug_dir, "blink_thresholds.txt"), "w", encoding="utf-8") as f:
-        f.write(f"Video duration: {duration:.2f} seconds\n")
-        f.write(f"Min blinks required: {min_blinks}\n")
-        f.write(f"Max blinks allowed: {max_blinks}\n")
-        f.write(f"Actual blink count: {blink_counter}\n")
-        f.write(f"Face detected frames: {face_detected_frames} / {total_frames}\n")
-        f.write(f"Average EAR: {avg_ear:.4f}\n")
+    if debug_dir is not None:
+        with open(os.path.join(debug_dir, "blink_thresholds.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Video duration: {duration:.2f} seconds\n")
+            f.write(f"Min blinks required: {min_blinks}\n")
+            f.write(f"Max blinks allowed: {max_blinks}\n")
+            f.write(f"Actual blink count: {blink_counter}\n")
+            f.write(f"Face detected frames: {face_detected_frames} / {analyzed_frames} analyzed ({total_frames} total)\n")
+            f.write(f"Average EAR: {avg_ear:.4f}\n")
 
     # Tính điểm số nháy mắt - đơn giản hóa thuật toán
     blink_score = 0.0
@@ -401,11 +1228,13 @@ def detect_blinks(video_path):
     rate_score = 1.0 if 0.2 <= blink_rate <= 0.4 else max(0, 1 - abs(blink_rate - 0.3) / 0.3)
 
     # Tính điểm số phát hiện khuôn mặt
-    face_detection_ratio = face_detected_frames / total_frames if total_frames > 0 else 0
+    # Tỉ lệ được tính trên số frame đã phân tích (không tính các frame bỏ qua khi lấy mẫu)
+    face_detection_ratio = face_detected_frames / analyzed_frames if analyzed_frames > 0 else 0
     face_score = min(1.0, face_detection_ratio * 1.5)  # Cho điểm cao hơn nếu phát hiện nhiều khuôn mặt
 
     # Tổng hợp điểm số liveness - tăng trọng số cho blink_score
-    liveness_score = (blink_score * 0.7 + ear_score * 0.1 + rate_score * 0.1 + face_score * 0.1)
+    liveness_score = (blink_score * params['blink_weight'] + ear_score * params['ear_weight'] +
+                      rate_score * params['rate_weight'] + face_score * params['face_weight'])
 
     # Nếu phát hiện ít nhất 1 nháy mắt, luôn cho điểm cao
     if blink_counter >= 1:
@@ -415,12 +1244,426 @@ def detect_blinks(video_path):
     if face_detection_ratio > 0.8:
         liveness_score = max(liveness_score, 0.85)
 
+    return {
+        'liveness_score': liveness_score,
+        'blink_count': blink_counter,
+        'avg_ear': avg_ear,
+        'blink_rate': blink_rate,
+        'face_detection_ratio': face_detection_ratio,
+        'blink_score': blink_score,
+        'ear_score': ear_score,
+        'rate_score': rate_score,
+        'face_score': face_score
+    }
+
+def timeline_path(video_path):
+    """Đường dẫn file dòng thời gian đã lưu của video (cùng thư mục, đuôi .timeline.npz)"""
+    return os.path.splitext(video_path)[0] + '.timeline.npz'
+
+def save_timeline(path, timeline, analyzed_indices, face_counts, rotate_code, total_frames, duration_frames, fps, results):
+    """
+    Lưu dòng thời gian của video dưới dạng NumPy nén để tính lại điểm mà không cần giải mã lại video
+
+    Landmarks của mắt được lưu dạng int16 (landmarks của dlib là số nguyên) nên EAR được
+    tính lại chính xác. Kèm theo các frame đã phân tích, số khuôn mặt mỗi frame, hướng xoay
+    và kết quả ban đầu để so sánh.
+    """
+    np.savez_compressed(
+        path,
+        version=np.int32(1),
+        frame_indices=timeline.frame_indices[:timeline.count].astype(np.int32),
+        eye_points=timeline.eye_points[:timeline.count].astype(np.int16),
+        analyzed_indices=np.asarray(analyzed_indices, dtype=np.int32),
+        face_counts=np.asarray(face_counts, dtype=np.uint8),
+        rotation=np.array(ROTATION_LABELS[rotate_code]),
+        total_frames=np.int32(total_frames),
+        duration_frames=np.int32(duration_frames),
+        fps=np.float64(fps),
+        liveness_score=np.float64(results['liveness_score']),
+        blink_count=np.int32(results['blink_count'])
+    )
+
+def load_timeline(path):
+    """Đọc dòng thời gian đã lưu bằng save_timeline, trả về dictionary các mảng"""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def rescore_timeline(data, params=None):
+    """
+    Tính lại điểm liveness từ dòng thời gian đã lưu với tham số cho trước
+
+    Các frame được phát lại qua máy trạng thái nháy mắt và bước tính điểm theo đúng thứ tự
+    như khi phân tích video, không ghi log debug.
+
+    Args:
+        data: Dictionary từ load_timeline
+        params: Tham số tính điểm cần ghi đè (xem scoring_params)
+
+    Returns:
+        Dictionary chứa kết quả tính lại (như kết quả của score_liveness)
+    """
+    params = scoring_params(params)
+    frame_indices = data['frame_indices']
+    total_frames = int(data['total_frames'])
+    face_detected_frames = int(np.count_nonzero(data['face_counts']))
+    analyzed_frames = len(data['analyzed_indices'])
+
+    # Không đủ frame có khuôn mặt để phân tích
+    if face_detected_frames < 10:
+        return {
+            'liveness_score': 0.0,
+            'blink_count': 0,
+            'avg_ear': 0.0,
+            'blink_rate': 0.0,
+            'face_detected_frames': face_detected_frames,
+            'analyzed_frames': analyzed_frames
+        }
+
+    timeline = EarTimeline(len(frame_indices))
+    state = BlinkStateMachine(None, timeline, params['eye_ar_thresh'], params['eye_ar_consec_frames'])
+    prev_frame = None
+    prev_ear = None
+    for frame_index, eye_points in zip(frame_indices.tolist(), data['eye_points']):
+        # EAR của frame trước được tra cứu một lần cho mỗi frame, trước khi thêm các khuôn mặt của frame đó
+        if frame_index != prev_frame:
+            prev_ear = timeline.previous_ear(frame_index)
+            prev_frame = frame_index
+        ear = timeline.append(frame_index, eye_points)
+        state.update(frame_index, ear, prev_ear, None, total_frames)
+
+    results = score_liveness(state.blink_counter, timeline, face_detected_frames, analyzed_frames, total_frames,
+                             int(data['duration_frames']), float(data['fps']), params=params)
+    results['face_detected_frames'] = face_detected_frames
+    results['analyzed_frames'] = analyzed_frames
+    return results
+
+def _finish_timings(results, timer, record, return_timings):
+    """Ghi nhận thời gian các giai đoạn vào histogram và thêm vào kết quả nếu được yêu cầu"""
+    if record:
+        liveness_histograms.record(timer)
+    if return_timings:
+        results['timings'] = timer.as_dict()
+    return results
+
+def detect_blinks(video_path, face_tracking=None, detection_width=None, sample_fps=None, early_exit=None,
+                  pipeline_workers=None, process_workers=None, return_timings=None, timer=None, save_timeline_file=None,
+                  progress_callback=None):
+    """
+    Phát hiện nháy mắt trong video
+
+    Video được xử lý theo luồng trong một lần đọc duy nhất: mỗi frame được giải mã,
+    phát hiện khuôn mặt, tính landmarks/EAR và cập nhật máy trạng thái nháy mắt ngay,
+    sau đó được giải phóng. Chỉ landmarks của mắt được giữ lại trong dòng thời gian EAR,
+    nên bộ nhớ không phụ thuộc vào độ phân giải hay độ dài video.
+
+    Args:
+        video_path: Đường dẫn đến file video
+        face_tracking: Bật chế độ theo dõi khuôn mặt (chỉ chạy bộ phát hiện trên keyframe),
+            mặc định lấy từ Config.LIVENESS_FACE_TRACKING
+        detection_width: Chiều rộng ảnh dùng để phát hiện khuôn mặt, landmarks vẫn được tính
+            trên ảnh gốc (0: độ phân giải gốc), mặc định lấy từ Config.LIVENESS_DETECTION_WIDTH
+        sample_fps: Tốc độ phân tích mục tiêu, tự động phân tích đầy đủ quanh các lần EAR giảm
+            (0: phân tích toàn bộ frame, luôn phân tích toàn bộ khi dùng pipeline nhiều luồng),
+            mặc định lấy từ Config.LIVENESS_SAMPLE_FPS
+        early_exit: Dừng phân tích ngay khi kết quả đạt đã ổn định (kết quả có 'stopped_early'),
+            mặc định lấy từ Config.LIVENESS_EARLY_EXIT
+        pipeline_workers: Số luồng xử lý song song cho pipeline giải mã/tiền xử lý/phát hiện
+            (0: xử lý tuần tự), mặc định lấy từ Config.LIVENESS_PIPELINE_WORKERS
+        process_workers: Số tiến trình của backend đa tiến trình, video được chia thành các đoạn
+            frame phân tích song song (0: không dùng), mặc định lấy từ Config.LIVENESS_PROCESS_WORKERS
+        return_timings: Thêm thời gian theo giai đoạn (decode, preprocess, rotate, detect, landmarks,
+            ear, debug_io, scoring) và số frame vào kết quả ('timings'), mặc định lấy từ
+            Config.LIVENESS_RETURN_TIMINGS. Ở chế độ pipeline/đa tiến trình, thời gian các giai đoạn
+            theo frame là tổng trên mọi luồng/tiến trình nên có thể lớn hơn thời gian thực
+        timer: StageTimer của hàm gọi. Khi được truyền vào, hàm gọi chịu trách nhiệm ghi nhận
+            histogram và thêm thời gian vào kết quả
+        save_timeline_file: Lưu dòng thời gian EAR/khuôn mặt/hướng xoay cạnh video (xem timeline_path)
+            để tính lại điểm sau này, mặc định lấy từ Config.LIVENESS_SAVE_TIMELINE
+        progress_callback: Hàm callback(processed_frames, total_frames) được gọi định kỳ trong khi phân tích
+
+    Returns:
+        Dictionary chứa kết quả phân tích
+    """
+    if face_tracking is None:
+        face_tracking = Config.LIVENESS_FACE_TRACKING
+    if detection_width is None:
+        detection_width = Config.LIVENESS_DETECTION_WIDTH
+    if sample_fps is None:
+        sample_fps = Config.LIVENESS_SAMPLE_FPS
+    if early_exit is None:
+        early_exit = Config.LIVENESS_EARLY_EXIT
+    if pipeline_workers is None:
+        pipeline_workers = Config.LIVENESS_PIPELINE_WORKERS
+    if process_workers is None:
+        process_workers = Config.LIVENESS_PROCESS_WORKERS
+    if return_timings is None:
+        return_timings = Config.LIVENESS_RETURN_TIMINGS
+    if save_timeline_file is None:
+        save_timeline_file = Config.LIVENESS_SAVE_TIMELINE
+
+    # Đo thời gian theo giai đoạn, chỉ ghi nhận histogram khi timer được tạo tại đây
+    owns_timer = timer is None
+    if owns_timer:
+        timer = StageTimer()
+
+    # Tạo thư mục debug
+    debug_dir = os.path.join(os.path.dirname(video_path), "debug_frames")
+    os.makedirs(debug_dir, exist_ok=True)
+
+    # Xóa các file log cũ
+    for file_name in ["ear_values.txt", "blink_frames.txt", "blinks.txt", "liveness_results.txt", "blink_thresholds.txt", "blinks_method2.txt", "blinks_method3.txt"]:
+        log_file = os.path.join(debug_dir, file_name)
+        if os.path.exists(log_file):
+            try:
+                os.remove(log_file)
+                print(f"Đã xóa file log cũ: {log_file}")
+            except Exception as e:
+                print(f"Không thể xóa file log cũ {log_file}: {e}")
+
+    # Ghi log bắt đầu phân tích
+    with open(os.path.join(debug_dir, "analysis_log.txt"), "w", encoding="utf-8") as f:
+        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Bắt đầu phân tích video: {video_path}\n")
+
+    # Đọc video
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        error_msg = f"Không thể mở video: {video_path}"
+        print(error_msg)
+        with open(os.path.join(debug_dir, "error_log.txt"), "a", encoding="utf-8") as f:
+            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {error_msg}\n")
+        raise Exception(error_msg)
+
+    # Lấy thông tin video
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Ghi log thông tin video
+    with open(os.path.join(debug_dir, "video_details.txt"), "w", encoding="utf-8") as f:
+        f.write(f"Video path: {video_path}\n")
+        f.write(f"Resolution: {width}x{height}\n")
+        f.write(f"FPS: {fps}\n")
+        f.write(f"Total frames: {total_frames}\n")
+        f.write(f"Duration: {total_frames/fps:.2f} seconds\n")
+
+    # Khởi tạo các biến
+    face_detected_frames = 0
+    rotated_frames_count = 0  # Số frame đã được xoay
+    tracked_frames = 0  # Số frame lấy khuôn mặt bằng cách theo dõi (không chạy bộ phát hiện)
+    timeline = EarTimeline(total_frames)
+    state = BlinkStateMachine(debug_dir, timeline)
+
+    # Xóa file log xoay cũ nếu có
+    rotation_log_path = os.path.join(debug_dir, "rotation_log.txt")
+    if os.path.exists(rotation_log_path):
+        try:
+            os.remove(rotation_log_path)
+            print(f"Đã xóa file log xoay cũ: {rotation_log_path}")
+        except Exception as e:
+            print(f"Không thể xóa file log xoay cũ {rotation_log_path}: {e}")
+
+    # Xác định hướng xoay một lần cho toàn bộ video
+    with timer.stage('rotate'):
+        rotate_code = probe_video_orientation(cap, total_frames, debug_dir, detection_width=detection_width)
+
+    # Chính sách lấy mẫu frame
+    sampler = AdaptiveFrameSampler(fps, sample_fps)
+    analyzed_frames = 0  # Số frame đã được phân tích
+    analyzed_indices = []  # Chỉ số các frame đã phân tích và số khuôn mặt trong mỗi frame (để lưu dòng thời gian)
+    face_counts = []
+    stopped_early = False
+
+    # Nguồn frame: tuần tự (có thể theo dõi khuôn mặt), pipeline nhiều luồng hoặc pool tiến trình
+    upscale = width < 480 or height < 480
+    if process_workers > 0 and total_frames > 0:
+        source = ProcessPoolFrameSource(video_path, total_frames, fps, sample_fps, rotate_code, upscale,
+                                        detection_width, face_tracking, workers=process_workers)
+    elif pipeline_workers > 0:
+        # Luồng giải mã quyết định bỏ qua frame trước khi sampler.observe (ở luồng chính, chậm hơn
+        # khoảng 2 x queue_size + workers frame) thấy EAR giảm, nên pipeline phân tích toàn bộ frame
+        sampler = AdaptiveFrameSampler(fps, 0)
+        source = PipelinedFrameSource(cap, sampler, rotate_code, upscale, detection_width,
+                                      workers=pipeline_workers, queue_size=Config.LIVENESS_PIPELINE_QUEUE_SIZE)
+    else:
+        tracker = FaceTracker(Config.LIVENESS_REDETECT_INTERVAL) if face_tracking else None
+        source = SequentialFrameSource(cap, sampler, rotate_code, upscale, detection_width, tracker)
+
+    # Xử lý từng frame theo đúng thứ tự
+    frame_index = -1
+    frames = iter(source)
+    try:
+        for frame_index, enhanced_frame, face_shapes, info in frames:
+            analyzed_frames += 1
+            analyzed_indices.append(frame_index)
+            face_counts.append(len(face_shapes))
+            timer.add('decode', info['decode_time'])
+            timer.add('preprocess', info['preprocess_time'])
+            if info['detector_runs'] > 0:
+                timer.add('detect', info['detect_time'], info['detector_runs'])
+            if info['landmark_runs'] > 0:
+                timer.add('landmarks', info['landmark_time'], info['landmark_runs'])
+            if info['tracked']:
+                tracked_frames += 1
+
+            if len(face_shapes) > 0:
+                face_detected_frames += 1
+                if rotate_code is not None:
+                    rotated_frames_count += 1
+
+                # Lưu frame để debug (chỉ lưu một số frame)
+                if enhanced_frame is not None and (frame_index % 10 == 0 or face_detected_frames < 10):
+                    debug_start = time.perf_counter()
+                    cv2.imwrite(os.path.join(debug_dir, f"frame_{frame_index}.jpg"), enhanced_frame)
+
+                    # Vẽ hình chữ nhật xung quanh khuôn mặt
+                    debug_frame = cv2.cvtColor(enhanced_frame, cv2.COLOR_GRAY2BGR)
+                    for face, _ in face_shapes:
+                        x, y, w, h = face.left(), face.top(), face.width(), face.height()
+                        cv2.rectangle(debug_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                    cv2.imwrite(os.path.join(debug_dir, f"face_detected_{frame_index}.jpg"), debug_frame)
+                    timer.add('debug_io', time.perf_counter() - debug_start)
+
+                # Tra cứu EAR của frame trước có khuôn mặt từ dòng thời gian (phương pháp 3)
+                prev_ear = timeline.previous_ear(frame_index)
+
+                for face, shape in face_shapes:
+                    # Thêm landmarks của 2 mắt vào dòng thời gian và tính EAR
+                    ear_start = time.perf_counter()
+                    eye_points = eye_points_from_shape(shape)
+                    ear = timeline.append(frame_index, eye_points)
+                    leftEye, rightEye = eye_points[:6], eye_points[6:]
+                    timer.add('ear', time.perf_counter() - ear_start)
+
+                    # Lưu debug thông tin EAR
+                    if enhanced_frame is not None and frame_index % 5 == 0:
+                        debug_start = time.perf_counter()
+                        # Vẽ đường viền mắt để debug
+                        leftEyeHull = cv2.convexHull(leftEye)
+                        rightEyeHull = cv2.convexHull(rightEye)
+                        debug_frame = cv2.cvtColor(enhanced_frame, cv2.COLOR_GRAY2BGR)
+                        cv2.drawContours(debug_frame, [leftEyeHull], -1, (0, 255, 0), 1)
+                        cv2.drawContours(debug_frame, [rightEyeHull], -1, (0, 255, 0), 1)
+
+                        # Hiển thị giá trị EAR
+                        cv2.putText(debug_frame, f"EAR: {ear:.2f}", (10, 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+                        # Lưu frame đã được chỉnh sửa
+                        cv2.imwrite(os.path.join(debug_dir, f"eye_frame_{frame_index}.jpg"), debug_frame)
+                        timer.add('debug_io', time.perf_counter() - debug_start)
+
+                    # Cập nhật máy trạng thái nháy mắt
+                    ear_start = time.perf_counter()
+                    state.update(frame_index, ear, prev_ear, enhanced_frame, total_frames)
+
+                    # Phân tích đầy đủ các frame lân cận khi EAR giảm
+                    sampler.observe(frame_index, ear, timeline.mean_ear())
+                    timer.add('ear', time.perf_counter() - ear_start, runs=0)
+
+            # Dừng sớm khi đã đủ nháy mắt và kết quả không còn thay đổi (kiểm tra mỗi 5 frame phân tích)
+            remaining_frames = total_frames - frame_index - 1 if total_frames > 0 else None
+            if early_exit and state.blink_counter > 0 and analyzed_frames % 5 == 0 and can_stop_early(state, timeline, face_detected_frames, analyzed_frames, remaining_frames):
+                stopped_early = True
+                with open(os.path.join(debug_dir, "analysis_log.txt"), "a", encoding="utf-8") as f:
+                    f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Dừng sớm tại frame {frame_index + 1} sau {state.blink_counter} lần nháy mắt\n")
+                break
+
+            # Hiển thị tiến trình xử lý
+            if analyzed_frames % 30 == 0 and total_frames > 0:
+                print(f"Đã xử lý {frame_index + 1}/{total_frames} frames ({(frame_index + 1)/total_frames*100:.1f}%)")
+                if progress_callback is not None:
+                    progress_callback(frame_index + 1, total_frames)
+    finally:
+        # Dừng nguồn frame (kể cả các luồng pipeline) và đóng video
+        frames.close()
+        cap.release()
+
+    # Số frame đã đọc/phân tích
+    timer.count('frames_total', total_frames)
+    timer.count('frames_read', source.frames_read)
+    timer.count('frames_analyzed', analyzed_frames)
+    timer.count('frames_with_face', face_detected_frames)
+    timer.count('frames_tracked', tracked_frames)
+
+    # Tính điểm số (kể cả các file log kết quả)
+    scoring_start = time.perf_counter()
+    # Khi dừng sớm, chỉ tính thời lượng đoạn video đã phân tích
+    duration_frames = frame_index + 1 if stopped_early else total_frames
+
+    def finish(results):
+        # Thông tin video lấy từ chính capture dùng để phân tích (không cần mở lại video)
+        results['video_info'] = {
+            'width': width,
+            'height': height,
+            'fps': fps,
+            'frame_count': total_frames,
+            'duration': total_frames / fps if fps > 0 else 0
+        }
+        timer.add('scoring', time.perf_counter() - scoring_start)
+        if save_timeline_file:
+            with timer.stage('timeline_save'):
+                save_timeline(timeline_path(video_path), timeline, analyzed_indices, face_counts, rotate_code,
+                              total_frames, duration_frames, fps, results)
+        return _finish_timings(results, timer, owns_timer, owns_timer and return_timings)
+
+    # Thời gian trung bình theo độ phân giải phát hiện
+    detector_runs = timer.runs('detect')
+    landmark_runs = timer.runs('landmarks')
+    detection_timing = {
+        'detection_width': detection_width,
+        'detector_runs': detector_runs,
+        'detect_ms_avg': timer.seconds('detect') * 1000 / detector_runs if detector_runs > 0 else 0.0,
+        'landmark_runs': landmark_runs,
+        'landmark_ms_avg': timer.seconds('landmarks') * 1000 / landmark_runs if landmark_runs > 0 else 0.0
+    }
+    with open(os.path.join(debug_dir, "detection_timing.txt"), "w", encoding="utf-8") as f:
+        for key, value in detection_timing.items():
+            f.write(f"{key}: {value}\n")
+
+    # Ghi log số frame đã xử lý
+    with open(os.path.join(debug_dir, "analysis_log.txt"), "a", encoding="utf-8") as f:
+        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Đã xử lý {source.frames_read} frames (phân tích {analyzed_frames} frames), phát hiện khuôn mặt trong {face_detected_frames} frames\n")
+
+    # Nếu không phát hiện đủ frame có khuôn mặt
+    if face_detected_frames < 10:
+        print(f"Chỉ phát hiện được {face_detected_frames} frame có khuôn mặt, không đủ để phân tích")
+        results = {
+            'liveness_score': 0.0,
+            'blink_count': 0,
+            'avg_ear': 0.0,
+            'blink_rate': 0.0,
+            'face_detected_frames': face_detected_frames,
+            'analyzed_frames': analyzed_frames,
+            'rotated_frames_count': rotated_frames_count,
+            'rotation': ROTATION_LABELS[rotate_code],
+            'tracked_frames': tracked_frames,
+            'detection_timing': detection_timing,
+            'stopped_early': stopped_early
+        }
+        return finish(results)
+
+    # Tính điểm số liveness
+    scores = score_liveness(state.blink_counter, timeline, face_detected_frames, analyzed_frames, total_frames,
+                            duration_frames, fps, debug_dir)
+    blink_counter = scores['blink_count']
+    avg_ear = scores['avg_ear']
+    blink_rate = scores['blink_rate']
+    face_detection_ratio = scores['face_detection_ratio']
+    blink_score = scores['blink_score']
+    ear_score = scores['ear_score']
+    rate_score = scores['rate_score']
+    face_score = scores['face_score']
+    liveness_score = scores['liveness_score']
+
     # Ghi log thêm thông tin
     with open(os.path.join(debug_dir, "detection_details.txt"), "w", encoding="utf-8") as f:
         f.write(f"Video path: {video_path}\n")
         f.write(f"Total frames: {total_frames}\n")
         f.write(f"Face detected frames: {face_detected_frames}\n")
         f.write(f"Rotated frames: {rotated_frames_count}\n")
+        f.write(f"Tracked frames: {tracked_frames}\n")
+        f.write(f"Stopped early: {stopped_early}\n")
         f.write(f"Face detection ratio: {face_detection_ratio:.4f}\n")
         f.write(f"Blink count: {blink_counter}\n")
         f.write(f"Final liveness score: {liveness_score:.4f}\n")
@@ -440,42 +1683,193 @@ def detect_blinks(video_path):
         f.write(f"Face score: {face_score:.4f}\n")
         f.write(f"Liveness score: {liveness_score:.4f}\n")
 
-    return {
+    results = {
         'liveness_score': liveness_score,
         'blink_count': blink_counter,
         'avg_ear': avg_ear,
         'blink_rate': blink_rate,
         'face_detected_frames': face_detected_frames,
         'face_detection_ratio': face_detection_ratio,
-        'rotated_frames_count': rotated_frames_count
+        'analyzed_frames': analyzed_frames,
+        'rotated_frames_count': rotated_frames_count,
+        'rotation': ROTATION_LABELS[rotate_code],
+        'tracked_frames': tracked_frames,
+        'detection_timing': detection_timing,
+        'stopped_early': stopped_early
     }
+    return finish(results)
 
-def preprocess_frame(frame):
+class IncrementalLivenessAnalyzer:
+    """
+    Phân tích liveness tăng dần: các frame được đưa vào lần lượt ngay khi nhận được
+    (ví dụ trong lúc video đang được tải lên) thay vì đọc từ một file video hoàn chỉnh
+
+    Dùng chung máy trạng thái nháy mắt, dòng thời gian EAR và bước tính điểm với detect_blinks.
+    Tổng số frame chưa biết trước nên hướng xoay được khóa ở frame đầu tiên phát hiện được
+    khuôn mặt và phương pháp 3 không bỏ qua frame cuối. Không ghi log/ảnh debug. Kết quả được
+    tính trên các frame đã nhận nên việc dừng sớm chỉ xét các frame này, trừ khi client khai
+    báo số frame dự kiến (expected_frames) thì xét cả các frame còn lại (xem can_stop_early).
     """
-    Tiền xử lý frame để cải thiện chất lượng
 
-    Args:
-        frame: Frame cần xử lý
+    # Các hướng xoay thử khi frame nằm ngang không phát hiện được khuôn mặt
+    ROTATION_CANDIDATES = (cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+    def __init__(self, fps=30.0, face_tracking=None, detection_width=None, max_frames=None, expected_frames=None):
+        if face_tracking is None:
+            face_tracking = Config.LIVENESS_FACE_TRACKING
+        if detection_width is None:
+            detection_width = Config.LIVENESS_DETECTION_WIDTH
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.detection_width = detection_width
+        # Số frame tối đa được phân tích và số frame client dự kiến gửi (None: không giới hạn/không khai báo)
+        self.max_frames = max_frames
+        self.expected_frames = expected_frames
+        self.tracker = FaceTracker(Config.LIVENESS_REDETECT_INTERVAL) if face_tracking else None
+        self.buffers = FrameBuffers()
+        self.timeline = EarTimeline(int(self.fps * 10))
+        self.state = BlinkStateMachine(None, self.timeline)
+        self.rotate_code = None
+        self.orientation_locked = False
+        self.frame_count = 0
+        self.face_detected_frames = 0
+        self.analyzed_indices = []
+        self.face_counts = []
+
+    def __getstate__(self):
+        # Trạng thái được pickle để phiên theo luồng tiếp tục được ở tiến trình khác,
+        # bộ đệm tiền xử lý được cấp phát lại khi nạp
+        state = dict(self.__dict__)
+        del state['buffers']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buffers = FrameBuffers()
+
+    def _face_shapes(self, frame):
+        upscale = frame.shape[1] < 480 or frame.shape[0] < 480
+        if self.orientation_locked:
+            _, face_shapes, _ = analyze_frame(frame, self.rotate_code, upscale, self.detection_width, self.tracker,
+                                              self.buffers, True)
+            return face_shapes
+
+        # Chưa khóa hướng xoay: thử frame gốc trước, sau đó thử xoay nếu frame nằm ngang
+        _, face_shapes, _ = analyze_frame(frame, None, upscale, self.detection_width, None, self.buffers, True)
+        if face_shapes or frame.shape[1] <= frame.shape[0]:
+            self.orientation_locked = True
+            return face_shapes
+        for rotate_code in self.ROTATION_CANDIDATES:
+            _, face_shapes, _ = analyze_frame(frame, rotate_code, upscale, self.detection_width, None, self.buffers, True)
+            if face_shapes:
+                self.rotate_code = rotate_code
+                self.orientation_locked = True
+                return face_shapes
+        return []
+
+    def add_frame(self, frame):
+        """
+        Phân tích một frame BGR và cập nhật máy trạng thái nháy mắt
+
+        Returns:
+            Số khuôn mặt phát hiện được trong frame
+        """
+        frame_index = self.frame_count
+        self.frame_count += 1
+        if frame is None or frame.shape[0] == 0 or frame.shape[1] == 0:
+            return 0
+
+        return self.add_face_shapes(self._face_shapes(frame), frame_index)
+
+    def add_face_shapes(self, face_shapes, frame_index=None):
+        """
+        Cập nhật máy trạng thái nháy mắt với landmarks của một frame đã phân tích
+        (dùng trực tiếp khi mô phỏng dòng thời gian EAR, xem benchmark_liveness.py)
+
+        Args:
+            face_shapes: Danh sách (face, shape) của các khuôn mặt trong frame
+            frame_index: Chỉ số frame (None: frame tiếp theo)
+
+        Returns:
+            Số khuôn mặt trong frame
+        """
+        if frame_index is None:
+            frame_index = self.frame_count
+            self.frame_count += 1
+        self.analyzed_indices.append(frame_index)
+        self.face_counts.append(len(face_shapes))
+
+        if face_shapes:
+            self.face_detected_frames += 1
+            prev_ear = self.timeline.previous_ear(frame_index)
+            for _, shape in face_shapes:
+                ear = self.timeline.append(frame_index, eye_points_from_shape(shape))
+                # Tổng số frame chưa biết: không bỏ qua frame cuối ở phương pháp 3
+                self.state.update(frame_index, ear, prev_ear, None, float('inf'))
+        return len(face_shapes)
+
+    @property
+    def analyzed_frames(self):
+        return len(self.analyzed_indices)
+
+    def is_decided(self):
+        """Kết quả đạt đã ổn định (xem can_stop_early), có thể trả kết quả ngay"""
+        remaining_frames = max(0, self.expected_frames - self.frame_count) if self.expected_frames else 0
+        return (self.state.blink_counter > 0 and self.analyzed_frames > 0 and
+                can_stop_early(self.state, self.timeline, self.face_detected_frames, self.analyzed_frames,
+                               remaining_frames))
+
+    def progress(self):
+        return {
+            'frames_received': self.frame_count,
+            'face_detected_frames': self.face_detected_frames,
+            'blink_count': self.state.blink_counter
+        }
 
-    Returns:
-        Frame đã được xử lý
-    """
-    # Kiểm tra độ sáng trung bình của frame
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    avg_brightness = np.mean(gray)
+    def result(self, stopped_early=False):
+        """
+        Tính điểm liveness trên các frame đã nhận
+
+        Returns:
+            Dictionary kết quả với các khóa như detect_blinks
+        """
+        results = {
+            'face_detected_frames': self.face_detected_frames,
+            'analyzed_frames': self.analyzed_frames,
+            'rotation': ROTATION_LABELS[self.rotate_code],
+            'stopped_early': stopped_early
+        }
+        if self.face_detected_frames < 10:
+            results.update({'liveness_score': 0.0, 'blink_count': 0, 'avg_ear': 0.0, 'blink_rate': 0.0})
+            return results
+
+        scores = score_liveness(self.state.blink_counter, self.timeline, self.face_detected_frames, self.analyzed_frames,
+                                self.frame_count, self.frame_count, self.fps)
+        results.update({key: scores[key] for key in ('liveness_score', 'blink_count', 'avg_ear', 'blink_rate',
+                                                     'face_detection_ratio')})
+        return results
 
-    # Cải thiện độ tương phản và độ sáng
-    lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
-    enhanced_lab = cv2.merge((cl, a, b))
-    enhanced_frame = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
+    def save_timeline(self, path, results):
+        """Lưu dòng thời gian để tính lại điểm sau này (xem save_timeline)"""
+        save_timeline(path, self.timeline, self.analyzed_indices, self.face_counts, self.rotate_code,
+                      self.frame_count, self.frame_count, self.fps, results)
 
-    # Áp dụng bộ lọc làm mịn để giảm nhiễu
-    enhanced_frame = cv2.GaussianBlur(enhanced_frame, (5, 5), 0)
+# CLAHE được tạo một lần cho mỗi luồng (đối tượng CLAHE của OpenCV không an toàn khi dùng chung giữa các luồng)
+_clahe_local = threading.local()
 
-    # Điều chỉnh độ sáng và độ tương phản dựa trên độ sáng trung bình
+def _get_clahe():
+    clahe = getattr(_clahe_local, 'clahe', None)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        _clahe_local.clahe = clahe
+    return clahe
+
+def _brightness_adjustment(avg_brightness):
+    """
+    Tính hệ số độ tương phản (alpha) và độ sáng (beta) dựa trên độ sáng trung bình của frame
+
+    Returns:
+        Tuple (alpha, beta)
+    """
     alpha = 1.2  # Điều chỉnh độ tương phản
 
     # Điều chỉnh beta (độ sáng) dựa trên độ sáng trung bình của frame
@@ -487,85 +1881,278 @@ def preprocess_frame(frame):
     else:  # Frame có độ sáng bình thường
         beta = 10  # Tăng độ sáng vừa phải
 
-    enhanced_frame = cv2.convertScaleAbs(enhanced_frame, alpha=alpha, beta=beta)
+    return alpha, beta
 
-    return enhanced_frame
+class FrameBuffers:
+    """
+    Bộ đệm cấp phát trước cho tiền xử lý ảnh xám, được tái sử dụng giữa các frame
+    có cùng kích thước
+    """
 
-def process_video_for_liveness(video_file):
+    def __init__(self):
+        self.shape = None
+
+    def ensure(self, shape):
+        if self.shape != shape:
+            self.gray = np.empty(shape, dtype=np.uint8)
+            self.equalized = np.empty(shape, dtype=np.uint8)
+            self.blurred = np.empty(shape, dtype=np.uint8)
+            self.output = np.empty(shape, dtype=np.uint8)
+            self.shape = shape
+
+def preprocess_frame_gray(frame, buffers=None, reuse_output=False):
     """
-    Xử lý video để phát hiện liveness (nháy mắt)
+    Tiền xử lý frame trên ảnh xám cho phát hiện khuôn mặt và landmarks
+
+    Chỉ làm việc trên một kênh xám: CLAHE được tái sử dụng, không tách/ghép kênh LAB
+    và không chuyển ngược về BGR.
 
     Args:
-        video_file: File video từ request hoặc đường dẫn đến file video
+        frame: Frame BGR cần xử lý
+        buffers: FrameBuffers để ghi kết quả trung gian (None: cấp phát mới)
+        reuse_output: Ghi kết quả vào bộ đệm đầu ra của buffers. Kết quả sẽ bị ghi đè
+            ở lần gọi tiếp theo nên chỉ dùng khi frame được xử lý xong trước frame sau
 
     Returns:
-        Dictionary chứa kết quả phân tích liveness
+        Ảnh xám đã được xử lý
+    """
+    if buffers is not None:
+        buffers.ensure(frame.shape[:2])
+
+    # Chuyển sang ảnh xám và kiểm tra độ sáng trung bình
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.gray if buffers is not None else None)
+    avg_brightness = cv2.mean(gray)[0]
+
+    # Cải thiện độ tương phản
+    equalized = _get_clahe().apply(gray, buffers.equalized if buffers is not None else None)
+
+    # Áp dụng bộ lọc làm mịn để giảm nhiễu
+    blurred = cv2.GaussianBlur(equalized, (5, 5), 0, dst=buffers.blurred if buffers is not None else None)
+
+    # Điều chỉnh độ sáng và độ tương phản dựa trên độ sáng trung bình
+    alpha, beta = _brightness_adjustment(avg_brightness)
+    out = buffers.output if buffers is not None and reuse_output else None
+    return cv2.convertScaleAbs(blurred, dst=out, alpha=alpha, beta=beta)
+
+class VideoTooLargeError(Exception):
+    """Video tải lên vượt quá kích thước cho phép"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        super().__init__(f"File không được vượt quá {max_size / (1024 * 1024)}MB")
+
+# Kích thước mỗi khối khi ghi video tải lên
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_uploaded_video(video_file, video_path, max_size=None):
     """
-    # Tạo thư mục uploads nếu chưa có
+    Ghi video tải lên theo từng khối, kiểm tra kích thước trong khi ghi
+
+    Video chỉ được đọc một lần từ request và ghi một lần xuống đĩa, không giữ toàn bộ
+    nội dung trong bộ nhớ. File được tạo mới (không ghi đè file đã có).
+
+    Args:
+        video_file: File video từ request (FileStorage hoặc đối tượng có read(size))
+        video_path: Đường dẫn file video cần tạo
+        max_size: Kích thước tối đa (byte), None: không giới hạn
+
+    Returns:
+        Kích thước file (byte)
+
+    Raises:
+        VideoTooLargeError: Nếu video vượt quá max_size (file đang ghi dở bị xóa)
+    """
+    stream = getattr(video_file, 'stream', video_file)
+
+    file_size = 0
+    try:
+        with open(video_path, 'xb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                if max_size is not None and file_size > max_size:
+                    raise VideoTooLargeError(max_size)
+                f.write(chunk)
+    except VideoTooLargeError:
+        os.remove(video_path)
+        raise
+
+    return file_size
+
+def liveness_upload_dir():
+    """Thư mục lưu video liveness (uploads/liveness), được tạo nếu chưa có"""
     upload_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads', 'liveness')
     os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
 
-    # Tạo thư mục debug để lưu các frame và log
-    debug_dir = os.path.join(upload_dir, "debug_frames")
-    os.makedirs(debug_dir, exist_ok=True)
+def create_liveness_workspace():
+    """
+    Tạo workspace riêng cho một lần phân tích liveness
+
+    Mỗi workspace là một thư mục con duy nhất của uploads/liveness, được tạo nguyên tử
+    bằng os.mkdir nên các yêu cầu đồng thời không bao giờ dùng chung thư mục. Video,
+    dòng thời gian EAR và thư mục debug_frames của lần phân tích đều nằm trong workspace.
+
+    Returns:
+        Tuple (workspace_id, workspace_dir)
+    """
+    upload_dir = liveness_upload_dir()
+    while True:
+        workspace_id = f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:12]}"
+        workspace_dir = os.path.join(upload_dir, workspace_id)
+        try:
+            os.mkdir(workspace_dir)
+            return workspace_id, workspace_dir
+        except FileExistsError:
+            continue
+
+def workspace_created_at(workspace_id):
+    """
+    Thời điểm tạo workspace (epoch giây) lấy từ mã workspace
+
+    Returns:
+        Thời điểm tạo hoặc None nếu tên thư mục không phải mã workspace
+    """
+    try:
+        return time.mktime(time.strptime(workspace_id.split('_', 1)[0], '%Y%m%d%H%M%S'))
+    except ValueError:
+        return None
+
+def workspace_video_path(workspace_id, workspace_dir):
+    """
+    Đường dẫn video trong workspace
+
+    Returns:
+        Tuple (video_path, video_filename) với video_filename là đường dẫn tương đối
+        để lưu vào cơ sở dữ liệu
+    """
+    filename = f'liveness_{workspace_id}.mp4'
+    return os.path.join(workspace_dir, filename), '/'.join(('liveness', workspace_id, filename))
+
+def store_liveness_upload(video_file, max_size=None):
+    """
+    Lưu video tải lên vào một workspace mới (xem create_liveness_workspace và save_uploaded_video)
+
+    Returns:
+        Tuple (video_path, video_filename, file_size) với video_filename là đường dẫn tương đối
+        để lưu vào cơ sở dữ liệu
+
+    Raises:
+        VideoTooLargeError: Nếu video vượt quá max_size (workspace bị xóa)
+    """
+    workspace_id, workspace_dir = create_liveness_workspace()
+    video_path, video_filename = workspace_video_path(workspace_id, workspace_dir)
+    try:
+        file_size = save_uploaded_video(video_file, video_path, max_size)
+    except Exception:
+        shutil.rmtree(workspace_dir, ignore_errors=True)
+        raise
+    print(f"Đã lưu video vào: {video_path}")
+    return video_path, video_filename, file_size
+
+def quick_reject_results(report):
+    """Kết quả liveness (cùng dạng với detect_blinks) cho video bị loại ở bước kiểm tra nhanh"""
+    report = dict(report)
+    video_info = report.pop('video_info') or {'width': 0, 'height': 0, 'fps': 0, 'frame_count': 0, 'duration': 0}
+    return {
+        'liveness_score': 0.0,
+        'blink_count': 0,
+        'avg_ear': 0.0,
+        'blink_rate': 0.0,
+        'face_detected_frames': report['face_frames'],
+        'analyzed_frames': report['sampled_frames'],
+        'stopped_early': False,
+        'quick_reject': report,
+        'video_info': video_info
+    }
+
+def process_video_for_liveness(video_file, sample_fps=None, process_workers=None, return_timings=None, max_size=None,
+                               video_filename=None, progress_callback=None, quick_reject=None):
+    """
+    Xử lý video để phát hiện liveness (nháy mắt)
+
+    Args:
+        video_file: File video từ request hoặc đường dẫn đến file video
+        sample_fps: Tốc độ phân tích mục tiêu (xem detect_blinks), mặc định lấy từ Config
+        process_workers: Số tiến trình của backend đa tiến trình (xem detect_blinks), mặc định lấy từ Config
+        return_timings: Thêm thời gian theo giai đoạn vào kết quả (xem detect_blinks, thêm giai đoạn
+            upload_write), mặc định lấy từ Config.LIVENESS_RETURN_TIMINGS
+        max_size: Kích thước tối đa của video tải lên (byte), được kiểm tra trong khi ghi
+        video_filename: Tên file lưu vào cơ sở dữ liệu khi video_file là đường dẫn đã lưu bằng
+            store_liveness_upload
+        progress_callback: Hàm callback tiến trình (xem detect_blinks)
+        quick_reject: Kiểm tra nhanh vài frame mẫu trước khi phân tích đầy đủ và loại ngay các video
+            không dùng được (kết quả có 'quick_reject', xem quick_reject_check), mặc định lấy từ
+            Config.LIVENESS_QUICK_REJECT
+
+    Returns:
+        Dictionary chứa kết quả phân tích liveness
+
+    Raises:
+        VideoTooLargeError: Nếu video tải lên vượt quá max_size
+    """
+    if return_timings is None:
+        return_timings = Config.LIVENESS_RETURN_TIMINGS
+    if quick_reject is None:
+        quick_reject = Config.LIVENESS_QUICK_REJECT
+    timer = StageTimer()
 
     # Kiểm tra xem video_file là file từ request hay đường dẫn đến file
+    return_filename = video_filename
     if isinstance(video_file, str) and os.path.isfile(video_file):
         # Nếu là đường dẫn đến file, sử dụng trực tiếp
         video_path = video_file
+        file_size = os.path.getsize(video_path)
         print(f"Sử dụng video trực tiếp từ đường dẫn: {video_path}")
     else:
-        # Nếu là file từ request, lưu vào thư mục upload
-        timestamp = int(time.time())
-        filename = f'liveness_{timestamp}.mp4'
-        video_path = os.path.join(upload_dir, filename)
-
-        # Lưu video để có thể phân tích và debug sau này
-        with open(video_path, 'wb') as f:
-            f.write(video_file.read())
-
-        print(f"Đã lưu video vào: {video_path}")
+        # Nếu là file từ request, lưu vào thư mục upload để có thể phân tích và debug sau này
+        # và trả về tên file để lưu vào cơ sở dữ liệu
+        with timer.stage('upload_write'):
+            video_path, return_filename, file_size = store_liveness_upload(video_file, max_size)
 
-        # Trả về tên file để lưu vào cơ sở dữ liệu
-        return_filename = os.path.join('liveness', filename)
+    # Thư mục debug nằm cạnh video (trong workspace riêng của yêu cầu nếu video được lưu bằng store_liveness_upload)
+    debug_dir = os.path.join(os.path.dirname(video_path), "debug_frames")
+    os.makedirs(debug_dir, exist_ok=True)
 
     try:
-        # Ghi log thông tin video
+        # Kiểm tra nhanh để loại các video không có khuôn mặt/quá tối/quá mờ mà không cần phân tích đầy đủ
+        results = None
+        if quick_reject:
+            with timer.stage('quick_reject'):
+                report = quick_reject_check(video_path)
+            if report['rejected']:
+                print(f"Loại nhanh video liveness ({report['reason']}): {report}")
+                with open(os.path.join(debug_dir, "analysis_log.txt"), "a", encoding="utf-8") as f:
+                    f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Loại nhanh video: {report}\n")
+                results = quick_reject_results(report)
+
+        if results is None:
+            # Phân tích video
+            print(f"Bắt đầu phân tích video liveness: {video_path}")
+            results = detect_blinks(video_path, sample_fps=sample_fps, process_workers=process_workers, timer=timer,
+                                    progress_callback=progress_callback)
+        _finish_timings(results, timer, True, return_timings)
+        print(f"Kết quả phân tích: {results}")
+
+        # Ghi log thông tin video (độ phân giải, FPS lấy từ capture dùng để phân tích)
+        video_info = results['video_info']
         with open(os.path.join(debug_dir, "video_info.txt"), "w", encoding="utf-8") as f:
             f.write(f"Video path: {video_path}\n")
             f.write(f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-
-            # Kiểm tra kích thước file
-            file_size = os.path.getsize(video_path)
             f.write(f"File size: {file_size} bytes ({file_size/1024/1024:.2f} MB)\n")
-
-            # Kiểm tra định dạng file
-            cap = cv2.VideoCapture(video_path)
-            if cap.isOpened():
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                duration = frame_count / fps if fps > 0 else 0
-
-                f.write(f"Resolution: {width}x{height}\n")
-                f.write(f"FPS: {fps}\n")
-                f.write(f"Frame count: {frame_count}\n")
-                f.write(f"Duration: {duration:.2f} seconds\n")
-
-                cap.release()
-
-        # Phân tích video
-        print(f"Bắt đầu phân tích video liveness: {video_path}")
-        results = detect_blinks(video_path)
-        print(f"Kết quả phân tích: {results}")
+            f.write(f"Resolution: {video_info['width']}x{video_info['height']}\n")
+            f.write(f"FPS: {video_info['fps']}\n")
+            f.write(f"Frame count: {video_info['frame_count']}\n")
+            f.write(f"Duration: {video_info['duration']:.2f} seconds\n")
 
         # Không xóa video để có thể debug sau này
-        # Chỉ xóa các video cũ hơn 7 ngày
-        cleanup_old_videos(upload_dir, days=7)
+        # Chỉ xóa các workspace cũ theo chính sách lưu giữ
+        cleanup_liveness_workspaces()
 
         # Thêm tên file vào kết quả nếu có
-        if 'return_filename' in locals():
+        if return_filename is not None:
             results['video_filename'] = return_filename
 
         return results
@@ -577,15 +2164,58 @@ def process_video_for_liveness(video_file):
         # Vẫn giữ lại video để debug
         raise e
 
-def cleanup_old_videos(directory, days=7):
-    """Xóa các video cũ hơn số ngày chỉ định"""
-    try:
+# Thời điểm dọn dẹp workspace gần nhất (dọn dẹp tối đa một lần mỗi LIVENESS_CLEANUP_INTERVAL giây)
+_last_cleanup = 0.0
+_cleanup_lock = threading.Lock()
+
+def cleanup_liveness_workspaces(retention_days=None, debug_retention_hours=None, force=False):
+    """
+    Dọn dẹp các workspace liveness theo chính sách lưu giữ
+
+    - Workspace cũ hơn retention_days bị xóa toàn bộ (video, dòng thời gian, debug)
+    - Thư mục debug_frames của workspace cũ hơn debug_retention_hours bị xóa,
+      video và dòng thời gian được giữ lại (0: giữ debug đến khi xóa workspace)
+    - Các file video theo cách lưu cũ (trực tiếp trong uploads/liveness) cũ hơn retention_days bị xóa
+
+    Tuổi của workspace được tính từ thời điểm tạo trong mã workspace (không dùng mtime của
+    thư mục vì mtime thay đổi khi thư mục debug_frames bị xóa).
+
+    Args:
+        retention_days: Số ngày giữ workspace, mặc định lấy từ Config.LIVENESS_RETENTION_DAYS
+        debug_retention_hours: Số giờ giữ ảnh/log debug, mặc định lấy từ Config.LIVENESS_DEBUG_RETENTION_HOURS
+        force: Dọn dẹp ngay, bỏ qua giới hạn tần suất
+    """
+    global _last_cleanup
+    if retention_days is None:
+        retention_days = Config.LIVENESS_RETENTION_DAYS
+    if debug_retention_hours is None:
+        debug_retention_hours = Config.LIVENESS_DEBUG_RETENTION_HOURS
+
+    with _cleanup_lock:
         now = time.time()
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            # Kiểm tra xem file có phải là file thường và có cũ hơn số ngày chỉ định không
-            if os.path.isfile(file_path) and os.path.getmtime(file_path) < now - days * 86400:
-                os.remove(file_path)
-                print(f"Đã xóa file cũ: {file_path}")
+        if not force and now - _last_cleanup < Config.LIVENESS_CLEANUP_INTERVAL:
+            return
+        _last_cleanup = now
+
+    upload_dir = liveness_upload_dir()
+    try:
+        for entry in os.listdir(upload_dir):
+            path = os.path.join(upload_dir, entry)
+            if os.path.isdir(path):
+                # Thư mục debug dùng chung theo cách lưu cũ được giữ nguyên
+                if entry == "debug_frames":
+                    continue
+                created_at = workspace_created_at(entry)
+                age = now - (created_at if created_at is not None else os.path.getmtime(path))
+                if age > retention_days * 86400:
+                    shutil.rmtree(path, ignore_errors=True)
+                    print(f"Đã xóa workspace cũ: {path}")
+                elif debug_retention_hours > 0 and age > debug_retention_hours * 3600:
+                    debug_dir = os.path.join(path, "debug_frames")
+                    if os.path.isdir(debug_dir):
+                        shutil.rmtree(debug_dir, ignore_errors=True)
+            elif now - os.path.getmtime(path) > retention_days * 86400:
+                os.remove(path)
+                print(f"Đã xóa file cũ: {path}")
     except Exception as e:
-        print(f"Lỗi khi dọn dẹp các file cũ: {e}")
+        print(f"Lỗi khi dọn dẹp các workspace cũ: {e}")
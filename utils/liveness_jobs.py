@@ -0,0 +1,189 @@
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from models import db, LivenessJob
+from config import Config
+
+class LivenessJobConflict(Exception):
+    """Người dùng đã có một job liveness đang chờ hoặc đang chạy"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        super().__init__(f"Đang có job liveness {job_id} được xử lý")
+
+class LivenessJobManager:
+    """
+    Quản lý các job phân tích liveness chạy nền
+
+    Job được chạy trên một ThreadPoolExecutor riêng của tiến trình nhận video nên luồng xử lý
+    request được giải phóng ngay. Trạng thái, tiến trình và kết quả job được lưu trong bảng
+    LivenessJob nên mọi tiến trình (worker gunicorn) đều đọc được. Cột active_user_id (unique)
+    đảm bảo mỗi người dùng chỉ có một job đang chạy trên mọi tiến trình. Job đang chạy không
+    được cập nhật quá stale_seconds (tiến trình chạy job đã dừng) được coi là 'failed', các job
+    đã kết thúc bị xóa sau ttl_seconds. Việc dọn dẹp bảng chỉ chạy khi nhận job mới và tối đa một
+    lần mỗi cleanup_interval giây (như cleanup_liveness_workspaces), khi client hỏi trạng thái
+    job thì chỉ đọc.
+    """
+
+    # Khoảng thời gian tối thiểu giữa hai lần ghi tiến trình vào cơ sở dữ liệu (giây)
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, max_workers=2, ttl_seconds=3600, stale_seconds=900, cleanup_interval=600):
+        self.max_workers = max_workers
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+        self.lock = threading.Lock()
+        self._executor = None
+        # Thời điểm ghi tiến trình gần nhất của các job chạy trong tiến trình này
+        self._progress_written = {}
+
+    @property
+    def executor(self):
+        # Khởi tạo pool khi có job đầu tiên
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='liveness-job')
+            return self._executor
+
+    def _cleanup(self):
+        # Đánh dấu lỗi các job bị gián đoạn và xóa các job đã kết thúc quá ttl_seconds (cần app context),
+        # tối đa một lần mỗi cleanup_interval giây trong mỗi tiến trình
+        with self.lock:
+            if time.time() - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = time.time()
+        now = datetime.utcnow()
+        LivenessJob.query.filter(
+            LivenessJob.status.in_(('queued', 'processing')),
+            LivenessJob.updated_at < now - timedelta(seconds=self.stale_seconds)
+        ).update({'status': 'failed', 'active_user_id': None, 'updated_at': now,
+                  'error': 'Xử lý bị gián đoạn. Vui lòng thử lại.'}, synchronize_session=False)
+        LivenessJob.query.filter(
+            LivenessJob.status.in_(('completed', 'failed')),
+            LivenessJob.updated_at < now - timedelta(seconds=self.ttl_seconds)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _is_stale(self, job):
+        return (job.status in ('queued', 'processing') and
+                job.updated_at < datetime.utcnow() - timedelta(seconds=self.stale_seconds))
+
+    def _fail_stale(self, job):
+        # Đánh dấu lỗi một job bị gián đoạn (tiến trình chạy job đã dừng)
+        self.update(job.id, status='failed', active_user_id=None, error='Xử lý bị gián đoạn. Vui lòng thử lại.')
+
+    def _to_dict(self, job):
+        # Job bị gián đoạn được trả về như đã lỗi, bảng chỉ được cập nhật khi dọn dẹp
+        stale = self._is_stale(job)
+        return {
+            'job_id': job.id,
+            'user_id': job.user_id,
+            'status': 'failed' if stale else job.status,
+            'progress': job.progress or 0.0,
+            'created_at': job.created_at,
+            'updated_at': job.updated_at,
+            'result': json.loads(job.result) if job.result else None,
+            'error': 'Xử lý bị gián đoạn. Vui lòng thử lại.' if stale else job.error
+        }
+
+    def active_job_for_user(self, user_id):
+        """Job đang chờ hoặc đang chạy của người dùng, None nếu không có (cần app context)"""
+        job = LivenessJob.query.filter_by(active_user_id=user_id).first()
+        if job is not None and self._is_stale(job):
+            # Giải phóng người dùng khỏi job bị gián đoạn ngay, không chờ lần dọn dẹp tiếp theo
+            self._fail_stale(job)
+            return None
+        return self._to_dict(job) if job is not None else None
+
+    def submit(self, app, user_id, func, *args):
+        """
+        Đưa job vào hàng đợi (gọi trong request context)
+
+        Args:
+            app: Ứng dụng Flask, job chạy trong app context của ứng dụng này
+            user_id: Người dùng sở hữu job
+            func: Hàm chạy job, nhận job_id là tham số đầu tiên và trả về kết quả (JSON)
+            *args: Các tham số còn lại của func
+
+        Returns:
+            job_id
+
+        Raises:
+            LivenessJobConflict: Nếu người dùng đã có job đang chờ hoặc đang chạy
+        """
+        self._cleanup()
+        # Giải phóng job bị gián đoạn của người dùng (nếu có) trước khi kiểm tra ràng buộc unique
+        self.active_job_for_user(user_id)
+        job_id = uuid.uuid4().hex
+        db.session.add(LivenessJob(id=job_id, user_id=user_id, active_user_id=user_id, status='queued'))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            active_job = LivenessJob.query.filter_by(active_user_id=user_id).first()
+            raise LivenessJobConflict(active_job.id if active_job is not None else None)
+        self.executor.submit(self._run, app, job_id, func, args)
+        return job_id
+
+    def _run(self, app, job_id, func, args):
+        with app.app_context():
+            try:
+                # Job đã bị đánh dấu gián đoạn khi còn chờ trong hàng đợi thì không chạy nữa
+                if not self.update(job_id, status='processing'):
+                    return
+                try:
+                    result = func(job_id, *args)
+                except Exception as e:
+                    self.update(job_id, status='failed', active_user_id=None, error=str(e)[:500])
+                else:
+                    self.update(job_id, status='completed', active_user_id=None, progress=1.0,
+                                result=json.dumps(result))
+            finally:
+                with self.lock:
+                    self._progress_written.pop(job_id, None)
+                db.session.remove()
+
+    def update(self, job_id, **fields):
+        """
+        Cập nhật trạng thái/tiến trình/kết quả của job đang chờ hoặc đang chạy (cần app context)
+
+        Returns:
+            True nếu job được cập nhật
+        """
+        fields['updated_at'] = datetime.utcnow()
+        updated = LivenessJob.query.filter(
+            LivenessJob.id == job_id,
+            LivenessJob.status.in_(('queued', 'processing'))
+        ).update(fields, synchronize_session=False)
+        db.session.commit()
+        return updated > 0
+
+    def set_progress(self, job_id, processed_frames, total_frames):
+        """Callback tiến trình cho detect_blinks (tối đa một lần ghi mỗi PROGRESS_INTERVAL giây)"""
+        if total_frames <= 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self._progress_written.get(job_id, 0) < self.PROGRESS_INTERVAL:
+                return
+            self._progress_written[job_id] = now
+        self.update(job_id, progress=min(0.99, processed_frames / float(total_frames)))
+
+    def get(self, job_id):
+        """Trạng thái job, None nếu không tồn tại hoặc đã hết hạn (chỉ đọc, cần app context)"""
+        job = LivenessJob.query.get(job_id)
+        if job is None or (job.status in ('completed', 'failed') and
+                           job.updated_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds)):
+            return None
+        return self._to_dict(job)
+
+# Pool job liveness của tiến trình, trạng thái job dùng chung qua cơ sở dữ liệu
+liveness_jobs = LivenessJobManager(max_workers=Config.LIVENESS_JOB_WORKERS, ttl_seconds=Config.LIVENESS_JOB_TTL,
+                                   stale_seconds=Config.LIVENESS_JOB_STALE_SECONDS,
+                                   cleanup_interval=Config.LIVENESS_CLEANUP_INTERVAL)
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import pickle
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from filelock import FileLock
+from config import Config
+from utils.liveness import (IncrementalLivenessAnalyzer, VideoTooLargeError, create_liveness_workspace,
+                            liveness_upload_dir, timeline_path, workspace_video_path)
+
+class LivenessStreamSession:
+    """
+    Phiên phân tích liveness theo luồng
+
+    Hai chế độ:
+    - 'frames': client gửi lần lượt các frame JPEG, mỗi frame được phân tích ngay khi nhận
+    - 'video': client gửi video theo từng khối byte, khối được ghi nối vào file và các frame
+      mới giải mã được sẽ được phân tích. Chỉ các định dạng giải mã được khi chưa tải xong
+      (WebM, MP4 phân mảnh) mới được phân tích trong lúc tải; MP4 thông thường (moov ở cuối file)
+      chỉ giải mã được sau khối cuối cùng
+
+    Mã phiên cũng là mã workspace của phiên. Trạng thái phiên được pickle vào workspace
+    (xem LivenessStreamManager) nên các khối dữ liệu có thể đến bất kỳ tiến trình nào.
+    """
+
+    def __init__(self, workspace_id, workspace_dir, user_id, mode='frames', fps=30.0, expected_frames=None):
+        self.session_id = workspace_id
+        self.workspace_id = workspace_id
+        self.workspace_dir = workspace_dir
+        self.user_id = user_id
+        self.mode = mode
+        self.analyzer = IncrementalLivenessAnalyzer(fps, max_frames=Config.LIVENESS_STREAM_MAX_FRAMES,
+                                                    expected_frames=expected_frames)
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished = False
+        self.response = None
+        self.bytes_received = 0
+        # Số frame video đã phân tích, cũng là vị trí tiếp tục giải mã ở lần sau
+        self.decoded_frames = 0
+        self.video_path = None
+        self.video_filename = None
+        if mode == 'video':
+            self.video_path, self.video_filename = workspace_video_path(self.workspace_id, self.workspace_dir)
+
+    def add_jpeg_frames(self, blobs, max_frames):
+        """
+        Giải mã và phân tích các frame JPEG
+
+        Returns:
+            True nếu kết quả đã ổn định (có thể kết thúc phiên)
+        """
+        for blob in blobs:
+            if self.analyzer.frame_count >= max_frames:
+                raise ValueError(f"Vượt quá số frame cho phép ({max_frames})")
+            frame = cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError("Không thể giải mã frame ảnh")
+            self.analyzer.add_frame(frame)
+            if self.analyzer.is_decided():
+                return True
+        return False
+
+    def add_video_chunk(self, stream, max_size, chunk_size=1024 * 1024):
+        """
+        Ghi nối một khối video vào file và phân tích các frame mới giải mã được
+
+        Returns:
+            True nếu kết quả đã ổn định (có thể kết thúc phiên)
+
+        Raises:
+            VideoTooLargeError: Nếu tổng kích thước video vượt quá max_size
+        """
+        with open(self.video_path, 'ab') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                self.bytes_received += len(chunk)
+                if max_size is not None and self.bytes_received > max_size:
+                    raise VideoTooLargeError(max_size)
+                f.write(chunk)
+        return self.decode_available()
+
+    def decode_available(self, final=False):
+        """
+        Phân tích các frame chưa được phân tích trong file video hiện có
+
+        Giải mã tiếp từ vị trí decoded_frames (seek thay vì đọc lại từ đầu file). Khi video
+        chưa tải xong, frame cuối cùng giải mã được có thể bị cắt dở nên chỉ được phân tích
+        khi đã có frame sau nó hoặc khi kết thúc phiên (final=True); frame này được giải mã
+        lại ở lần sau. Các frame sau max_frames của bộ phân tích bị bỏ qua.
+
+        Args:
+            final: Video đã tải xong, phân tích cả frame cuối cùng
+
+        Returns:
+            True nếu kết quả đã ổn định
+        """
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            # File chưa đủ dữ liệu để giải mã
+            return False
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            if self.decoded_frames == 0 and fps > 0:
+                self.analyzer.fps = fps
+
+            if self.decoded_frames > 0 and not cap.set(cv2.CAP_PROP_POS_FRAMES, self.decoded_frames):
+                # Không seek được: bỏ qua các frame đã phân tích (grab không chuyển sang ảnh)
+                for _ in range(self.decoded_frames):
+                    if not cap.grab():
+                        return False
+
+            # Chỉ phân tích tối đa max_frames frame đầu tiên của video (như chế độ 'frames')
+            pending = None
+            while self.decoded_frames + (pending is not None) < self.analyzer.max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if pending is not None and self._analyze_video_frame(pending):
+                    return True
+                pending = frame
+            return final and pending is not None and self._analyze_video_frame(pending)
+        finally:
+            cap.release()
+
+    def _analyze_video_frame(self, frame):
+        self.decoded_frames += 1
+        self.analyzer.add_frame(frame)
+        return self.analyzer.is_decided()
+
+    def finish(self):
+        """
+        Kết thúc phân tích và tính điểm (phiên được đánh dấu finished sau khi lưu kết quả)
+
+        Returns:
+            Dictionary kết quả (như detect_blinks)
+        """
+        stopped_early = self.analyzer.is_decided()
+        if self.mode == 'video' and not stopped_early:
+            self.decode_available(final=True)
+            stopped_early = self.analyzer.is_decided()
+
+        results = self.analyzer.result(stopped_early=stopped_early)
+        if self.video_filename is not None and os.path.exists(self.video_path):
+            results['video_filename'] = self.video_filename
+
+        if Config.LIVENESS_SAVE_TIMELINE:
+            path = timeline_path(self.video_path or workspace_video_path(self.workspace_id, self.workspace_dir)[0])
+            self.analyzer.save_timeline(path, results)
+
+        return results
+
+class LivenessStreamManager:
+    """
+    Lưu các phiên phân tích liveness theo luồng trong workspace của phiên
+
+    Trạng thái phiên (kể cả trạng thái phân tích) được pickle vào file trong workspace và mỗi
+    lần truy cập giữ một khóa file, nên mọi tiến trình (worker gunicorn) đều tiếp tục được
+    phiên và các khối dữ liệu của cùng một phiên được xử lý lần lượt. Phiên không hoạt động
+    quá ttl_seconds bị coi là hết hạn; workspace được dọn theo cleanup_liveness_workspaces.
+    """
+
+    STATE_FILE = 'stream_session.pkl'
+    # Mã phiên là mã workspace (xem create_liveness_workspace)
+    SESSION_ID_PATTERN = re.compile(r'^\d{14}_[0-9a-f]{12}$')
+
+    def __init__(self, ttl_seconds=600):
+        self.ttl_seconds = ttl_seconds
+
+    def _state_path(self, workspace_dir):
+        return os.path.join(workspace_dir, self.STATE_FILE)
+
+    def _save(self, session):
+        # Ghi ra file tạm rồi đổi tên để không bao giờ đọc phải trạng thái ghi dở
+        path = self._state_path(session.workspace_dir)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def create(self, user_id, mode='frames', fps=30.0, expected_frames=None):
+        workspace_id, workspace_dir = create_liveness_workspace()
+        session = LivenessStreamSession(workspace_id, workspace_dir, user_id, mode, fps, expected_frames)
+        self._save(session)
+        return session
+
+    @contextmanager
+    def open(self, session_id, user_id):
+        """
+        Mở phiên của người dùng để xử lý, trạng thái được lưu lại khi thoát khỏi khối with
+
+        Yields:
+            LivenessStreamSession, None nếu không tồn tại hoặc đã hết hạn
+        """
+        if not self.SESSION_ID_PATTERN.match(session_id):
+            yield None
+            return
+        workspace_dir = os.path.join(liveness_upload_dir(), session_id)
+        path = self._state_path(workspace_dir)
+        if not os.path.exists(path):
+            yield None
+            return
+
+        with FileLock(f'{path}.lock'):
+            # File trạng thái do chính ứng dụng ghi trong workspace
+            with open(path, 'rb') as f:
+                session = pickle.load(f)
+            now = time.time()
+            if session.user_id != user_id or now - session.updated_at > self.ttl_seconds:
+                yield None
+                return
+            session.updated_at = now
+            try:
+                yield session
+            finally:
+                self._save(session)
+
+# Các phiên liveness theo luồng, dùng chung giữa các tiến trình qua workspace
+liveness_streams = LivenessStreamManager(ttl_seconds=Config.LIVENESS_STREAM_TTL)
@@ -0,0 +1,143 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+class StageTimer:
+    """
+    Đo thời gian theo từng giai đoạn xử lý của một yêu cầu
+
+    Mỗi giai đoạn lưu tổng thời gian và số lần chạy, kèm theo các bộ đếm (ví dụ số frame).
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Đo thời gian của một khối lệnh và cộng vào giai đoạn name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def add(self, name, seconds, runs=1):
+        """Cộng thời gian (giây) đã đo ở nơi khác vào giai đoạn name"""
+        stage = self.stages.setdefault(name, [0.0, 0])
+        stage[0] += seconds
+        stage[1] += runs
+
+    def count(self, name, value=1):
+        """Tăng bộ đếm name"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def seconds(self, name):
+        return self.stages.get(name, [0.0, 0])[0]
+
+    def runs(self, name):
+        return self.stages.get(name, [0.0, 0])[1]
+
+    def total_seconds(self):
+        return time.perf_counter() - self.started_at
+
+    def as_dict(self):
+        """
+        Chuyển kết quả đo sang dictionary
+
+        Returns:
+            Dictionary gồm 'total_ms', 'stages' (ms, số lần chạy, ms trung bình) và 'counters'
+        """
+        return {
+            'total_ms': round(self.total_seconds() * 1000, 2),
+            'stages': {
+                name: {
+                    'ms': round(seconds * 1000, 2),
+                    'runs': runs,
+                    'ms_avg': round(seconds * 1000 / runs, 3) if runs > 0 else 0.0
+                }
+                for name, (seconds, runs) in self.stages.items()
+            },
+            'counters': dict(self.counters)
+        }
+
+class StageHistograms:
+    """
+    Histogram độ trễ (ms) theo từng giai đoạn, tổng hợp trong tiến trình cho mọi yêu cầu
+
+    Các bucket cố định theo thang log nên bộ nhớ không tăng theo số yêu cầu.
+    Bộ đếm có khóa để dùng chung giữa các luồng xử lý request.
+    """
+
+    # Cận trên (ms) của các bucket, bucket cuối chứa mọi giá trị lớn hơn
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 60000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def _observe(self, name, value_ms):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(self.BUCKETS_MS) + 1)}
+            self.histograms[name] = histogram
+        histogram['count'] += 1
+        histogram['sum_ms'] += value_ms
+        histogram['max_ms'] = max(histogram['max_ms'], value_ms)
+        histogram['buckets'][bisect_left(self.BUCKETS_MS, value_ms)] += 1
+
+    def record(self, timer):
+        """Ghi nhận tổng thời gian từng giai đoạn và toàn bộ yêu cầu của một StageTimer"""
+        with self.lock:
+            self._observe('total', timer.total_seconds() * 1000)
+            for name, (seconds, _) in timer.stages.items():
+                self._observe(name, seconds * 1000)
+
+    def observe(self, name, seconds):
+        """Ghi nhận một giá trị thời gian (giây) của giai đoạn name"""
+        with self.lock:
+            self._observe(name, seconds * 1000)
+
+    def _percentile(self, histogram, q):
+        # Ước lượng phân vị bằng cận trên của bucket chứa nó
+        target = q * histogram['count']
+        cumulative = 0
+        for i, bucket_count in enumerate(histogram['buckets']):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else histogram['max_ms']
+        return histogram['max_ms']
+
+    def snapshot(self):
+        """
+        Lấy ảnh chụp các histogram hiện tại
+
+        Returns:
+            Dictionary theo giai đoạn gồm count, avg_ms, max_ms, p50_ms, p95_ms, p99_ms và buckets
+        """
+        with self.lock:
+            result = {}
+            for name, histogram in self.histograms.items():
+                labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+                result[name] = {
+                    'count': histogram['count'],
+                    'avg_ms': round(histogram['sum_ms'] / histogram['count'], 2) if histogram['count'] > 0 else 0.0,
+                    'max_ms': round(histogram['max_ms'], 2),
+                    'p50_ms': self._percentile(histogram, 0.5),
+                    'p95_ms': self._percentile(histogram, 0.95),
+                    'p99_ms': self._percentile(histogram, 0.99),
+                    'buckets': dict(zip(labels, histogram['buckets']))
+                }
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+# Histogram dùng chung cho pipeline liveness
+liveness_histograms = StageHistograms()
+
+# Histogram thời gian chờ reader và nhận dạng của EasyOCR
+ocr_histograms = StageHistograms()
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import logging
+import cv2
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def _warm_up_ocr():
+    """Khởi tạo các EasyOCR reader trong pool và nhận dạng thử (giống test_easyocr)"""
+    from utils.easyocr_utils import reader_pool
+    image = np.full((100, 400, 3), 255, dtype=np.uint8)
+    cv2.putText(image, "Xin chao Viet Nam 123", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+    reader_pool.warm_up(image)
+
+def _warm_up_dlib():
+    """Chạy thử bộ phát hiện khuôn mặt và landmark predictor của pipeline liveness"""
+    import dlib
+    from utils.liveness import face_detector, landmark_predictor, preprocess_frame_gray
+    frame = np.full((480, 640, 3), 128, dtype=np.uint8)
+    gray = preprocess_frame_gray(frame)
+    face_detector(gray, 0)
+    landmark_predictor(gray, dlib.rectangle(200, 120, 440, 360))
+
+def _warm_up_deepface():
+    """Nạp model DeepFace dùng cho xác minh khuôn mặt"""
+    from verification_models.deepface_verification import get_deepface_verification
+    get_deepface_verification().warm_up()
+
+# Các model được nạp sẵn, chọn bằng Config.WARMUP_MODELS
+WARMUP_STEPS = {
+    'ocr': _warm_up_ocr,
+    'dlib': _warm_up_dlib,
+    'deepface': _warm_up_deepface
+}
+
+class ModelReadiness:
+    """
+    Trạng thái nạp sẵn các model của tiến trình (có khóa)
+
+    Mỗi model có trạng thái 'pending', 'loading', 'ready' hoặc 'failed' kèm thời gian nạp
+    và lỗi (nếu có). Tiến trình sẵn sàng khi mọi model được yêu cầu đều 'ready'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.pid = None
+
+    def set(self, name, status, **fields):
+        with self.lock:
+            model = self.models.setdefault(name, {})
+            model.update(fields)
+            model['status'] = status
+
+    def is_ready(self):
+        with self.lock:
+            return all(model['status'] == 'ready' for model in self.models.values())
+
+    def snapshot(self):
+        """Bản sao trạng thái các model"""
+        with self.lock:
+            return {name: dict(model) for name, model in self.models.items()}
+
+    def run(self, names):
+        """Nạp lần lượt các model (lỗi của một model không chặn các model khác)"""
+        for name in names:
+            self.set(name, 'loading')
+            start_time = time.perf_counter()
+            try:
+                WARMUP_STEPS[name]()
+            except Exception as e:
+                logger.error(f"Lỗi khi nạp sẵn model {name}: {e}")
+                self.set(name, 'failed', seconds=round(time.perf_counter() - start_time, 2), error=str(e))
+            else:
+                seconds = round(time.perf_counter() - start_time, 2)
+                logger.info(f"Đã nạp sẵn model {name} trong {seconds} giây")
+                self.set(name, 'ready', seconds=seconds, error=None)
+
+    def start(self, names=None, background=None):
+        """
+        Bắt đầu nạp sẵn các model, tối đa một lần cho mỗi tiến trình
+
+        Được gọi trong create_app. Nếu gunicorn chạy với --preload (create_app chạy trước khi fork),
+        cần gọi lại trong hook post_fork vì luồng nền không được sao chép sang tiến trình con.
+
+        Args:
+            names: Danh sách model, mặc định lấy từ Config.WARMUP_MODELS
+            background: Nạp trong luồng nền để ứng dụng khởi động ngay, mặc định lấy từ
+                Config.WARMUP_BACKGROUND
+        """
+        if names is None:
+            names = [name.strip() for name in Config.WARMUP_MODELS.split(',') if name.strip()]
+        if background is None:
+            background = Config.WARMUP_BACKGROUND
+        unknown = [name for name in names if name not in WARMUP_STEPS]
+        if unknown:
+            raise ValueError(f"Model nạp sẵn không hợp lệ: {unknown} (hỗ trợ: {', '.join(WARMUP_STEPS)})")
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.models = {name: {'status': 'pending'} for name in names}
+
+        if background:
+            threading.Thread(target=self.run, args=(names,), name='model-warmup', daemon=True).start()
+        else:
+            self.run(names)
+
+# Trạng thái nạp sẵn model dùng chung cho tiến trình
+model_readiness = ModelReadiness()
@@ -63,6 +63,17 @@ class DeepFaceVerification:
             # Trả về kết quả thất bại khi có lỗi
             return {"verified": False, "distance": None, "message": f"Lỗi khi xử lý ảnh: {str(e)}"}
 
+    def warm_up(self):
+        """
+        Nạp model DeepFace và chạy thử một lần trên ảnh giả để các yêu cầu sau không phải chờ nạp model.
+        DeepFace lưu model đã nạp trong bộ nhớ tiến trình nên các instance sau dùng lại được.
+        """
+        import numpy as np
+        DeepFace.build_model(self.model_name)
+        dummy = np.full((224, 224, 3), 128, dtype=np.uint8)
+        DeepFace.represent(dummy, model_name=self.model_name, enforce_detection=False, detector_backend='opencv')
+        logger.info(f"Đã nạp sẵn model DeepFace: {self.model_name}")
+
 # Helper function to get an instance of DeepFaceVerification (optional, but good practice)
 def get_deepface_verification():
     """